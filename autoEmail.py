@@ -1,8 +1,55 @@
-import win32com.client
 from datetime import datetime, timedelta
 import os
 import sys
 import re
+import json
+import html
+import hashlib
+import argparse
+import time
+import threading
+import multiprocessing
+import statistics
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import xlsx_reader
+from html_table import extract_range, render_html_table, hoist_styles, html_size_report
+from smtp_mail import build_mime_message, SMTPConnectionPool, send_messages
+from signature import load_signature, image_cache_path
+from snapshot import open_cached_workbook
+from pipeline import Stage, run_stages
+from metrics import compile_template, rollup_values, MISSING_VALUE
+from history import record_metrics, compare_metrics
+import profiling
+import com_trace
+from profiling import timed
+from sheet_block import (count_com_call, get_com_call_total, get_com_call_counts,
+                         reset_com_call_counts, add_com_call_counts, read_block,
+                         worksheet_supports_block_text)
+
+try:
+    import win32com.client
+except ImportError:
+    # Headless hosts (no pywin32) can still use the xlsx_reader backend
+    win32com = None
+
+# Set while office_session.py serves jobs: Office applications and workbooks
+# are then borrowed from its warm instances instead of dispatched per run
+_office_session = None
+# Set by --record/--replay: a com_trace.Recorder wrapping the applications, or a
+# com_trace.Player answering for them from a saved trace
+_com_trace = None
+
+def dispatch_application(prog_id):
+    """An Office application object: the session daemon's warm instance, or a new COM dispatch"""
+    if _com_trace is not None:
+        return _com_trace.root(prog_id, lambda: _dispatch_application(prog_id))
+    return _dispatch_application(prog_id)
+
+def _dispatch_application(prog_id):
+    if _office_session is not None:
+        return _office_session.application(prog_id)
+    return win32com.client.Dispatch(prog_id)
 
 def get_column_letter(col_num):
     """Convert column number to Excel column letter"""
@@ -26,34 +73,116 @@ def calculate_end_column(start_col, month):
     end_num = start_num + month  # 1月: +1, 2月: +2...
     return get_column_letter(end_num)
 
-def find_row_by_text(worksheet, search_text, search_range):
-    """Find row number containing specific text in the given range"""
+# Label index cache: (workbook path, mtime, sheet name, search range) -> {label: row}
+LABEL_INDEX_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".autoEmail_cache", "label_index.json")
+_label_index_cache = None
+_label_index_lock = threading.Lock()
+
+def get_workbook_key(worksheet):
+    """Return (workbook path, mtime) of the saved file a worksheet belongs to"""
     try:
-        found_range = worksheet.Range(search_range).Find(search_text)
-        if found_range:
-            return found_range.Row
+        path = worksheet.Parent.FullName
+        # Snapshot workbooks already know the source mtime (no second stat on the share)
+        mtime = getattr(worksheet.Parent, "source_mtime", None)
+        return path, mtime if mtime is not None else os.path.getmtime(path)
+    except Exception:
         return None
-    except Exception as e:
-        print(f"Error finding text '{search_text}': {e}")
+
+def get_workbook_version(workbook):
+    """Version of the saved file a workbook's values come from: (size, mtime_ns[, sha256])
+
+    None when the values may differ from the saved file (unsaved changes in Excel) or it cannot be read.
+    """
+    version = getattr(workbook, "source_version", None)
+    if version is not None:
+        return version
+    try:
+        if not workbook.Saved:
+            return None
+        stat = os.stat(workbook.FullName)
+        return stat.st_size, stat.st_mtime_ns
+    except Exception:
         return None
 
-def get_cell_value(worksheet, row, col_letter):
-    """Get cell value from worksheet"""
+def load_label_index_cache():
+    """Load the label index cache from disk (once per process)"""
+    global _label_index_cache
+    if _label_index_cache is None:
+        _label_index_cache = {}
+        try:
+            with open(LABEL_INDEX_CACHE_FILE, encoding="utf-8") as f:
+                _label_index_cache = json.load(f)
+        except (OSError, ValueError):
+            pass
+    return _label_index_cache
+
+def save_label_index_cache():
+    """Write the label index cache back to disk"""
     try:
-        cell_address = f"{col_letter}{row}"
-        return worksheet.Range(cell_address).Value
-    except Exception as e:
-        print(f"Error getting cell value at {col_letter}{row}: {e}")
-        return 0
+        os.makedirs(os.path.dirname(LABEL_INDEX_CACHE_FILE), exist_ok=True)
+        # Write then rename, so parallel batch workers never read a half-written file
+        temp_file = f"{LABEL_INDEX_CACHE_FILE}.{os.getpid()}.tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            json.dump(_label_index_cache, f, ensure_ascii=False)
+        os.replace(temp_file, LABEL_INDEX_CACHE_FILE)
+    except OSError as e:
+        print(f"Warning: could not save label index cache: {e}")
 
-def get_cell_text(worksheet, row, col_letter):
-    """Get cell text (display value) from worksheet"""
+@timed()
+def build_label_index(worksheet, search_range):
+    """Scan the search range once and map exact label text to its first row"""
+    block = read_block(worksheet, search_range)
+    
+    index = {}
+    for offset, row_values in enumerate(block.values):
+        for cell in row_values:
+            if isinstance(cell, str):
+                label = cell.strip()
+                if label and label not in index:
+                    index[label] = block.first_row + offset
+    return index
+
+def get_label_index(worksheet, search_range):
+    """Get the label index of a worksheet, cached by workbook path and mtime"""
+    # Traced runs build the index every time, so a replay makes the calls the recording did
+    workbook_key = get_workbook_key(worksheet) if _com_trace is None else None
+    if workbook_key is None:
+        return build_label_index(worksheet, search_range)
+    
+    cache_key = f"{workbook_key[0]}|{workbook_key[1]}|{worksheet.Name}|{search_range}"
+    with _label_index_lock:
+        cache = load_label_index_cache()
+        if cache_key in cache:
+            return cache[cache_key]
+    
+    # Built outside the lock so both sheets can be indexed concurrently
+    index = build_label_index(worksheet, search_range)
+    with _label_index_lock:
+        # Drop indexes of older saves of the same sheet
+        for stale_key in [k for k in cache if k.startswith(f"{workbook_key[0]}|")
+                          and k.endswith(f"|{worksheet.Name}|{search_range}")]:
+            del cache[stale_key]
+        cache[cache_key] = index
+        save_label_index_cache()
+    return index
+
+@timed()
+def find_row_by_text(worksheet, search_text, search_range, use_find=False):
+    """Find row number of the cell whose text is exactly search_text in the given range
+    
+    With use_find=True the old Range.Find lookup (partial match) is used instead.
+    """
     try:
-        cell_address = f"{col_letter}{row}"
-        return worksheet.Range(cell_address).Text
+        if use_find:
+            count_com_call("Range.Find")
+            found_range = worksheet.Range(search_range).Find(search_text)
+            if found_range:
+                return found_range.Row
+            return None
+        return get_label_index(worksheet, search_range).get(search_text)
     except Exception as e:
-        print(f"Error getting cell text at {col_letter}{row}: {e}")
-        return ""
+        print(f"Error finding text '{search_text}': {e}")
+        return None
 
 def format_digital_account_number(value):
     """Format number for digital account display (always show as full number with commas)"""
@@ -63,13 +192,13 @@ def format_digital_account_number(value):
         return f"{round(value):,}"
     return str(value)
 
-def format_platform_revenue(value):
-    """Format number for platform revenue display (萬元 or 億元) with thousand separator"""
+def format_platform_revenue(value, digits=1):
+    """Format number for platform revenue display (萬元 or 億元, with `digits` decimals) with thousand separator"""
     if value is None:
         return "0"
     if isinstance(value, (int, float)):
         if value >= 100000000:  # 億
-            return f"{round(value/100000000, 1)}億元"
+            return f"{round(value/100000000, digits)}億元"
         elif value >= 10000:  # 萬
             wan_value = round(value/10000)
             if wan_value >= 1000:  # Add thousand separator for 萬元 values >= 1000
@@ -80,17 +209,23 @@ def format_platform_revenue(value):
             return f"{round(value):,}元"
     return str(value)
 
+def format_honor_target(value):
+    """The 榮譽累積月目標數 the way head office publishes it (億元 with 2 decimals)"""
+    return format_platform_revenue(value, 2)
+
+# Numbers (including decimals) followed by % or just numbers
+PERCENT_NUMBER_RE = re.compile(r'([-]?\d+\.?\d*)')
+
 def format_percentage_from_text(text_value):
     """Format percentage from Excel cell text (extract number and format to 1 decimal place)"""
     if text_value is None or text_value == "":
         return "0%"
     
     # Convert to string if not already
-    text_str = str(text_value)
-    
-    # Extract numeric part using regex
-    # Look for numbers (including decimals) followed by % or just numbers
-    match = re.search(r'([-]?\d+\.?\d*)', text_str)
+    return _format_percent_text(str(text_value))
+
+def _format_percent_text(text_str):
+    match = PERCENT_NUMBER_RE.search(text_str)
     if match:
         try:
             numeric_value = float(match.group(1))
@@ -105,204 +240,699 @@ def format_percentage_from_text(text_value):
     
     return "0%"
 
-def convert_formulas_to_values(worksheet, start_row, end_row, start_col, end_col):
-    """Convert formulas to values in specified range"""
+# Bulk versions for whole columns/tables: same output as the scalar formatters.
+# Plain int/float (and str for percentages) take the fast path, repeated values
+# are formatted once; anything else (None, bool, other types) goes through the
+# scalar function so the result stays identical.
+
+def format_digital_account_numbers(values):
+    """format_digital_account_number over a sequence of values"""
+    formatted = {}
+    results = []
+    append = results.append
+    for value in values:
+        value_type = type(value)
+        if value_type is float or value_type is int:
+            text = formatted.get(value)
+            if text is None:
+                text = formatted[value] = f"{round(value):,}"
+        else:
+            text = format_digital_account_number(value)
+        append(text)
+    return results
+
+def format_honor_targets(values):
+    """format_honor_target over a sequence of values"""
+    return [format_honor_target(value) for value in values]
+
+def format_platform_revenues(values):
+    """format_platform_revenue over a sequence of values"""
+    formatted = {}
+    results = []
+    append = results.append
+    for value in values:
+        value_type = type(value)
+        if value_type is float or value_type is int:
+            text = formatted.get(value)
+            if text is None:
+                # "," adds nothing below 1000, so one format covers both 萬元 cases
+                if value >= 100000000:
+                    text = f"{round(value / 100000000, 1)}億元"
+                elif value >= 10000:
+                    text = f"{round(value / 10000):,}萬元"
+                else:
+                    text = f"{round(value):,}元"
+                formatted[value] = text
+        else:
+            text = format_platform_revenue(value)
+        append(text)
+    return results
+
+def format_percentages_from_text(text_values):
+    """format_percentage_from_text over a sequence of cell texts"""
+    formatted = {"": "0%"}
+    results = []
+    append = results.append
+    for text_value in text_values:
+        if type(text_value) is str:
+            text = formatted.get(text_value)
+            if text is None:
+                text = formatted[text_value] = _format_percent_text(text_value)
+        else:
+            text = format_percentage_from_text(text_value)
+        append(text)
+    return results
+
+# Where the metric labels are searched on both worksheets. Over COM the range
+# is read as one block; the headless backends stream every row of its columns
+# instead (stopping at the last label), so tables that grow past row 100 are found.
+LABEL_SEARCH_RANGE = "A1:Z100"
+LABEL_SEARCH_COLUMNS = xlsx_reader.parse_range_address(LABEL_SEARCH_RANGE)[1::2]
+
+# Mail formatters by the names used in the metric registry (metrics.REPORT_METRICS)
+METRIC_FORMATTERS = {
+    "number": format_digital_account_number,
+    "revenue": format_platform_revenue,
+    "honor_revenue": format_honor_target,
+    "percent": format_percentage_from_text,
+}
+
+METRIC_BULK_FORMATTERS = {
+    "number": format_digital_account_numbers,
+    "revenue": format_platform_revenues,
+    "honor_revenue": format_honor_targets,
+    "percent": format_percentages_from_text,
+}
+
+def _find_metric_row(worksheet, label):
+    return find_row_by_text(worksheet, label, LABEL_SEARCH_RANGE)
+
+def extract_sheet_metrics(worksheet, sheet_name, target_month, use_find=False):
+    """Read the mail template's metrics of one sheet (one label lookup pass, one block read)"""
+    def find_row(ws, label):
+        return find_row_by_text(ws, label, LABEL_SEARCH_RANGE, use_find)
     try:
-        # Create range string
-        range_str = f"{start_col}{start_row}:{end_col}{end_row}"
-        print(f"Converting formulas to values in range: {range_str}")
-        
-        # Get the range
-        range_obj = worksheet.Range(range_str)
-        
-        # Copy the range
-        range_obj.Copy()
-        
-        # Paste as values only
-        range_obj.PasteSpecial(Paste=-4163)  # xlPasteValues = -4163
-        
-        # Clear clipboard
-        worksheet.Application.CutCopyMode = False
-        
-        print(f"Successfully converted formulas to values in range {range_str}")
-        
+        # Monthly series stay cached per workbook path and file version, so later months
+        # of an unchanged file only read their new columns
+        series_source = getattr(worksheet.Parent, "FullName", None)
+        return compile_template().plan.extract_sheet(worksheet, target_month, find_row, sheet_name,
+                                                     label_cols=None if use_find else LABEL_SEARCH_COLUMNS,
+                                                     series_source=series_source,
+                                                     series_version=get_workbook_version(worksheet.Parent))
     except Exception as e:
-        print(f"Error converting formulas to values: {e}")
+        print(f"Error getting {sheet_name} values: {e}")
+        return {}
+
+@timed()
+def get_digital_account_values(ws_digital_account, target_month, use_find=False):
+    """Get the 數位戶 metrics for the target month"""
+    return extract_sheet_metrics(ws_digital_account, "數位戶", target_month, use_find)
 
-def get_dynamic_values(ws_digital_account, ws_digital_platform, target_month):
+@timed()
+def get_digital_platform_values(ws_digital_platform, target_month, use_find=False):
+    """Get the 數位平台收益 metrics for the target month"""
+    return extract_sheet_metrics(ws_digital_platform, "數位平台收益", target_month, use_find)
+
+def get_dynamic_values(ws_digital_account, ws_digital_platform, target_month, use_find=False):
     """Get dynamic values from Excel worksheets using target month"""
+    values = get_digital_account_values(ws_digital_account, target_month, use_find)
+    values.update(get_digital_platform_values(ws_digital_platform, target_month, use_find))
+    return values
+
+# Worksheets the report reads (the only ones kept in workbook snapshots)
+REPORT_SHEETS = ("數位戶", "數位平台收益")
+
+@timed()
+def find_report_worksheets(workbook):
+    """Find the 數位戶 and 數位平台收益 worksheets in a workbook"""
+    ws_digital_account = None
+    ws_digital_platform = None
     
-    # Calculate target column (target month offset from base column)
-    digital_account_base_col = "Q"  # 數位戶表格起始列
-    digital_platform_base_col = "P"  # 數位平台收益表格起始列
+    for sheet in workbook.Worksheets:
+        if sheet.Name == REPORT_SHEETS[0]:
+            ws_digital_account = sheet
+        elif sheet.Name == REPORT_SHEETS[1]:
+            ws_digital_platform = sheet
     
-    # Calculate actual column letters for target month
-    digital_account_col_num = column_letter_to_num(digital_account_base_col) + target_month
-    digital_platform_col_num = column_letter_to_num(digital_platform_base_col) + target_month
+    return ws_digital_account, ws_digital_platform
+
+def com_call_counters():
+    """COM/backend call counts keyed for the run profile"""
+    return {f"com_calls.{kind}": count for kind, count in get_com_call_counts().items()}
+
+def print_com_call_summary():
+    """Print how many COM/backend calls the run made, by kind"""
+    counts = get_com_call_counts()
+    details = ", ".join(f"{kind}={count}" for kind, count in sorted(counts.items()))
+    print(f"COM/backend calls this run: {get_com_call_total()} ({details})")
+
+def build_mail_body(dynamic_values, formatted_date):
+    """Build the plain text mail body (with table placeholders) from the extracted values"""
+    return compile_template().render(dynamic_values, METRIC_FORMATTERS, date=formatted_date)
+
+MAIL_SUBJECT = "(週報)績效數字統計"
+
+# Sheet rows of the 數位平台收益 range (P11:..41) left out of the mail table (default of --exclude-rows)
+PLATFORM_EXCLUDED_ROWS = [(23, 31)]
+
+# Lines of the mail body shown in bold, and section headers that are underlined
+BOLD_LINES = ("網行銀客戶數(具有網行銀會員身分之存戶+卡戶)", "數位平台收益")
+UNDERLINE_HEADERS = ("(1) 數位戶客戶數:", "(2)數位平台收益:")
+
+def build_mail_html(mail_body, tables):
+    """Convert the plain text mail body to HTML and put the rendered tables in the placeholders"""
+    html_lines = []
+    styles = []
+    for line in mail_body.split("\n"):
+        stripped = line.strip()
+        if stripped in tables:
+            # Compact tables bring their CSS classes along; one <style> in the head serves them all
+            css, table_html = hoist_styles(tables[stripped])
+            styles.append(css)
+            html_lines.append(table_html)
+            continue
+        
+        indent = len(line) - len(line.lstrip(" "))
+        text = "&nbsp;" * indent + html.escape(stripped)
+        if stripped in BOLD_LINES:
+            text = f"<b>{text}</b>"
+        for header in UNDERLINE_HEADERS:
+            escaped_header = html.escape(header)
+            if escaped_header in text:
+                text = text.replace(escaped_header, f"<u>{escaped_header}</u>", 1)
+        html_lines.append(text + "<br>")
     
-    digital_account_col = get_column_letter(digital_account_col_num)
-    digital_platform_col = get_column_letter(digital_platform_col_num)
+    head = f"<head><style>{''.join(styles)}</style></head>" if any(styles) else ""
+    return (f'<html>{head}<body><div style="font-family:Calibri,\'Microsoft JhengHei\',sans-serif;font-size:12pt">'
+            + "\n".join(html_lines) + "</div></body></html>")
+
+def print_html_size(html_body, label="Mail body"):
+    """Print the size of a rendered body and how much the compact tables save over inline styles"""
+    sizes = html_size_report(html_body)
+    saving = sizes["tables_inline"] / sizes["tables"] if sizes["tables"] else 1
+    print(f"{label}: {sizes['body'] / 1024:.1f} KB, tables {sizes['tables'] / 1024:.1f} KB "
+          f"({sizes['tables_inline'] / 1024:.1f} KB with inline styles, {saving:.1f}x), "
+          f"{sizes['classes']} CSS classes")
+    return sizes
+
+def add_signature(html_body, signature_html):
+    """Append a signature fragment to the end of a rendered mail body"""
+    if not signature_html:
+        return html_body
+    closing = "</div></body></html>"
+    if html_body.endswith(closing):
+        return html_body[:-len(closing)] + "<br>\n" + signature_html + closing
+    return html_body + signature_html
+
+@timed()
+def render_report_table(worksheet, range_address, exclude_rows=(), exclude_columns=()):
+    """Render a worksheet range as an HTML table, leaving out masked rows/columns (no clipboard)"""
+    try:
+        view = extract_range(worksheet, range_address).view(exclude_rows, exclude_columns)
+        # Class names start with the table's first cell ("q50_3"), so both tables can share the head
+        return render_html_table(view, compact=True, class_prefix=range_address.split(":")[0].lower())
+    except Exception as e:
+        print(f"Error rendering range {range_address}: {e}")
+        return ""
+
+def get_report_ranges(target_month):
+    """Return the 數位戶 and 數位平台收益 table ranges for the target month"""
+    # 數位戶: Q50 to (Q+month)60
+    digital_account_end_col = calculate_end_column("Q", target_month)
+    # 數位平台收益: P11 to (P+month)41 (整個範圍，23-31行不顯示)
+    digital_platform_end_col = calculate_end_column("P", target_month)
+    return f"Q50:{digital_account_end_col}60", f"P11:{digital_platform_end_col}41"
+
+# 榮譽累積 figures head office publishes per period, for workbooks without their rows:
+# {"2026-05": {"target": 163000000, "rate": "140.6%"}, ...}
+HONOR_FIGURES_FILE = os.path.join(os.path.expanduser("~"), "autoEmail_honor.json")
+HONOR_KEYS = {"target": "honor_cumulative_target", "rate": "platform_honor_cumulative_rate_text"}
+
+def add_honor_figures(dynamic_values, year, target_month):
+    """The values plus the configured 榮譽累積 figures of the period for those the workbook did not have"""
+    missing = {field: key for field, key in HONOR_KEYS.items() if dynamic_values.get(key) is None}
+    if not missing or year is None:
+        return dynamic_values
+    period = f"{year}-{target_month:02d}"
+    try:
+        with open(HONOR_FIGURES_FILE, encoding="utf-8") as f:
+            configured = json.load(f).get(period) or {}
+    except FileNotFoundError:
+        configured = {}
+    except (OSError, ValueError, AttributeError) as e:
+        print(f"Error reading {HONOR_FIGURES_FILE}: {e}")
+        configured = {}
+    figures = {key: configured[field] for field, key in missing.items() if configured.get(field) is not None}
+    if len(figures) < len(missing):
+        print(f"榮譽累積 figures for {period} are neither on the workbook nor in {HONOR_FIGURES_FILE}")
+    return {**dynamic_values, **figures}
+
+def add_history_deltas(dynamic_values, year, target_month, unit=""):
+    """The values plus MoM/YoY changes from the metrics history, when the mail template shows any"""
+    if year is None or not compile_template().history_fields:
+        return dynamic_values
+    return {**dynamic_values, **compare_metrics(dynamic_values, year, target_month, unit)}
+
+@timed()
+def assemble_report_html(dynamic_values, table1_html, table2_html, target_month, year=None, unit=""):
+    """Build the mail body text and put both rendered tables in it"""
+    dynamic_values = add_honor_figures(dynamic_values, year, target_month)
+    mail_body = build_mail_body(add_history_deltas(dynamic_values, year, target_month, unit), f"{target_month:02d}")
+    # Bold/underline formatting is part of the HTML
+    html_body = build_mail_html(mail_body, {
+        "[TABLE1_PLACEHOLDER]": table1_html,
+        "[TABLE2_PLACEHOLDER]": table2_html,
+    })
+    print_html_size(html_body, f"Mail body{' ' + unit if unit else ''} {target_month:02d}")
+    return html_body
+
+def build_report_html(ws_digital_account, ws_digital_platform, target_month, year=None, unit="",
+                      exclude_rows=PLATFORM_EXCLUDED_ROWS):
+    """Extract the values and render the full HTML mail body for one month"""
+    dynamic_values = get_dynamic_values(ws_digital_account, ws_digital_platform, target_month)
+    range1, range2 = get_report_ranges(target_month)
+    
+    # Render both tables straight from the worksheets (no clipboard)
+    table1_html = render_report_table(ws_digital_account, range1)
+    # 數位平台收益: exclude_rows are masked out of the view (the workbook is never modified)
+    table2_html = render_report_table(ws_digital_platform, range2, exclude_rows=exclude_rows)
+    
+    return dynamic_values, assemble_report_html(dynamic_values, table1_html, table2_html, target_month, year, unit)
+
+@timed()
+def build_report_pipeline(ws_digital_account, ws_digital_platform, target_month, signature_path,
+                          concurrent=True, year=None, exclude_rows=PLATFORM_EXCLUDED_ROWS):
+    """Same result as build_report_html plus the signature, with independent stages overlapped
+    
+    Reading each sheet's metrics, rendering each table and loading the signature
+    run concurrently; only the final assembly waits for all of them. Worksheet
+    stages stay on the calling thread for the Excel backend (COM objects are
+    bound to the thread that created them), so there only the signature overlaps.
+    Returns (dynamic_values, html_body, signature).
+    """
+    headless = worksheet_supports_block_text(ws_digital_account)
+    inline = not (concurrent and headless)
+    range1, range2 = get_report_ranges(target_month)
+    
+    def assemble(account_values, platform_values, table1_html, table2_html):
+        dynamic_values = {**account_values, **platform_values}
+        return dynamic_values, assemble_report_html(dynamic_values, table1_html, table2_html, target_month, year)
+    
+    stages = [
+        Stage("數位戶 values", lambda: get_digital_account_values(ws_digital_account, target_month), inline=inline),
+        Stage("數位平台收益 values", lambda: get_digital_platform_values(ws_digital_platform, target_month),
+              inline=inline),
+        Stage("數位戶 table", lambda: render_report_table(ws_digital_account, range1), inline=inline),
+        Stage("數位平台收益 table", lambda: render_report_table(ws_digital_platform, range2,
+                                                          exclude_rows=exclude_rows), inline=inline),
+        Stage("signature", lambda: load_signature(signature_path), inline=not concurrent),
+        Stage("assemble", assemble, inline=True,
+              requires=("數位戶 values", "數位平台收益 values", "數位戶 table", "數位平台收益 table")),
+    ]
+    results, report = run_stages(stages, label=f"{target_month}月 pipeline")
+    dynamic_values, html_body = results["assemble"]
+    return dynamic_values, html_body, results["signature"]
+
+def get_workbook_path(year, month):
+    """Return the network share path of the statistics workbook for a month"""
+    file_name = f"{year}統計({year}{month:02d})"
+    return f"\\\\X.X.X.X\\{file_name}.xlsx"
+
+def parse_month_range(text):
+    """Parse '3', '1-3' or '1,2,5-7' into a sorted list of months"""
+    months = set()
+    for part in text.replace(" ", "").split(","):
+        if not part:
+            continue
+        if "-" in part:
+            start, end = (int(x) for x in part.split("-", 1))
+            months.update(range(start, end + 1))
+        else:
+            months.add(int(part))
+    if not months or not all(1 <= month <= 12 for month in months):
+        raise ValueError(f"Months must be between 1 and 12: {text}")
+    return sorted(months)
+
+def parse_row_spans(text):
+    """Parse '23-31' or '12,23-31' into [(first, last), ...] sheet rows; '' leaves no rows out"""
+    spans = []
+    for part in text.replace(" ", "").split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        first, last = int(first), int(last or first)
+        if not 1 <= first <= last:
+            raise ValueError(f"Rows must be positive, first to last: {part}")
+        spans.append((first, last))
+    return spans
+
+def format_row_spans(spans):
+    """'23-31' style text of row spans, for the run log"""
+    return ",".join(f"{first}-{last}" if first != last else str(first) for first, last in spans)
+
+BATCH_OUTPUT_DIR = os.path.join(os.path.expanduser("~"), "autoEmail_reports")
+
+# Workbook opened once per batch worker process and reused for every month it renders
+_batch_workbook = None
+_batch_year = None
+_batch_exclude_rows = PLATFORM_EXCLUDED_ROWS
+
+def open_headless_workbook(file_path, recalculate=False, use_cache=True):
+    """Open the workbook without Excel, through the local snapshot cache unless use_cache=False"""
+    if use_cache:
+        return open_cached_workbook(file_path, REPORT_SHEETS, recalculate)
+    return xlsx_reader.open_workbook(file_path, recalculate)
+
+def _init_batch_worker(file_path, recalculate=False, use_cache=True, year=None, exclude_rows=PLATFORM_EXCLUDED_ROWS):
+    global _batch_workbook, _batch_year, _batch_exclude_rows
+    # Forked workers start with a copy of the parent's records; only report their own
+    profiling.drain()
+    reset_com_call_counts()
+    _batch_workbook = open_headless_workbook(file_path, recalculate, use_cache)
+    _batch_year = year
+    _batch_exclude_rows = exclude_rows
+
+def _render_batch_month(target_month):
+    """Render one month in a batch worker; returns (month, html, seconds, profile data)"""
+    start_time = time.perf_counter()
+    with profiling.span("batch_month", month=target_month):
+        ws_digital_account, ws_digital_platform = find_report_worksheets(_batch_workbook)
+        if ws_digital_account is None or ws_digital_platform is None:
+            raise ValueError("Report worksheets not found in workbook")
+        dynamic_values, html_body = build_report_html(ws_digital_account, ws_digital_platform, target_month,
+                                                      _batch_year, exclude_rows=_batch_exclude_rows)
+    # Hand this worker's spans, call counts and metrics to the parent process
+    profile = {"profile": profiling.drain(), "com_calls": get_com_call_counts(), "values": dynamic_values}
+    reset_com_call_counts()
+    return target_month, html_body, time.perf_counter() - start_time, profile
+
+# MAPI property holding an attachment's Content-ID (PR_ATTACH_CONTENT_ID)
+PR_ATTACH_CONTENT_ID = "http://schemas.microsoft.com/mapi/proptag/0x3712001F"
+
+def attach_signature_images(mail, signature):
+    """Attach the signature images to an Outlook mail so its cid: references resolve"""
+    for content_id, (data, subtype) in signature.images.items():
+        image_path = image_cache_path(content_id, subtype)
+        if not os.path.exists(image_path):
+            os.makedirs(os.path.dirname(image_path), exist_ok=True)
+            with open(image_path, "wb") as f:
+                f.write(data)
+        attachment = mail.Attachments.Add(image_path, 1, 0)  # olByValue, position 0 (hidden)
+        attachment.PropertyAccessor.SetProperty(PR_ATTACH_CONTENT_ID, content_id)
+
+@timed()
+def save_outlook_draft(outlook, html_body, signature=None, subject=MAIL_SUBJECT):
+    """Save an HTML report as an Outlook draft (no window is displayed)"""
+    mail = outlook.CreateItem(0)  # olMailItem = 0
+    mail.Subject = subject
+    if signature is not None:
+        mail.HTMLBody = add_signature(html_body, signature.html)
+        attach_signature_images(mail, signature)
+    else:
+        mail.HTMLBody = html_body
+    mail.Save()
+    return mail
+
+@timed()
+def write_report_html(html_body, output_dir, year, month):
+    """Write the rendered mail body to output_dir and return its path"""
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, f"report_{year}{month:02d}.html")
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write(html_body)
+    return output_path
+
+@timed()
+def run_batch(file_path, months, output_dir, year=None, workers=None, create_drafts=False,
+              signature=None, recalculate=False, use_cache=True, history=True, exclude_rows=PLATFORM_EXCLUDED_ROWS):
+    """Render several months from one workbook across a process pool
+    
+    Every worker parses the workbook once and reuses it for all the months
+    it renders. Each month is written to output_dir as report_YYYYMM.html
+    (with the signature inlined), and optionally saved as an Outlook draft.
+    The metrics of every month are recorded in the history unless history=False.
+    Returns {month: rendered html body without the signature}.
+    """
+    year = year or datetime.now().year
+    workers = workers or min(len(months), os.cpu_count() or 1)
+    print(f"Batch: {len(months)} month(s) from {file_path} with {workers} worker(s)")
+    
+    start_time = time.perf_counter()
+    if use_cache:
+        # Build (or validate) the snapshot once so the workers only hit it
+        open_headless_workbook(file_path, recalculate).Close()
+    html_bodies = {}
+    outputs = {}
+    timings = {}
+    signature_html = signature.inline_html() if signature is not None else ""
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                             initargs=(file_path, recalculate, use_cache, year, exclude_rows)) as pool:
+        futures = {pool.submit(_render_batch_month, month): month for month in months}
+        for future in as_completed(futures):
+            month = futures[future]
+            try:
+                month, html_body, seconds, profile = future.result()
+            except Exception as e:
+                print(f"❌ {month}月 failed: {e}")
+                continue
+            profiling.merge(profile["profile"])
+            add_com_call_counts(profile["com_calls"])
+            if history:
+                record_metrics(profile["values"], year, month, source=file_path)
+            html_bodies[month] = html_body
+            outputs[month] = write_report_html(add_signature(html_body, signature_html), output_dir, year, month)
+            timings[month] = seconds
+    
+    if create_drafts and html_bodies:
+        outlook = dispatch_application("Outlook.Application")
+        for month in sorted(html_bodies):
+            save_outlook_draft(outlook, html_bodies[month], signature)
+        print(f"Saved {len(html_bodies)} Outlook draft(s)")
     
-    print(f"數位戶 target column: {digital_account_col}")
-    print(f"數位平台收益 target column: {digital_platform_col}")
+    total_seconds = time.perf_counter() - start_time
+    for month in sorted(timings):
+        print(f"  {month:2d}月: {timings[month] * 1000:.1f} ms -> {outputs[month]}")
+    if total_seconds > 0:
+        print(f"Batch finished: {len(outputs)}/{len(months)} month(s) in {total_seconds:.2f}s "
+              f"({len(outputs) / total_seconds:.1f} months/s)")
+    return html_bodies
+
+# Unit workbooks read from the file share at the same time (across all worker processes)
+UNIT_SHARE_CONCURRENCY = 4
+UNIT_ROLLUP_NAME = "合計"
+
+def _unit_name(path, year, month):
+    """Unit name of a workbook: its folder for the standard file name, else the file name"""
+    file_name = os.path.basename(path)
+    if file_name == f"{year}統計({year}{month:02d}).xlsx":
+        return os.path.basename(os.path.dirname(os.path.abspath(path)))
+    return os.path.splitext(file_name)[0]
+
+def discover_unit_workbooks(source, year, month):
+    """Map unit names to workbook paths
     
-    values = {}
+    source is a directory (one sub-directory per unit holding its
+    {year}統計({year}{month}).xlsx, and/or unit .xlsx files directly in it),
+    a comma-separated list of [unit=]path, or @file with one [unit=]path per line.
+    """
+    if os.path.isdir(source):
+        entries = []
+        for name in sorted(os.listdir(source)):
+            path = os.path.join(source, name)
+            standard_file = os.path.join(path, f"{year}統計({year}{month:02d}).xlsx")
+            if os.path.isdir(path) and os.path.exists(standard_file):
+                entries.append(standard_file)
+            elif name.lower().endswith(".xlsx") and not name.startswith("~$"):
+                entries.append(path)
+    elif source.startswith("@"):
+        with open(source[1:], encoding="utf-8") as f:
+            entries = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    else:
+        entries = [entry.strip() for entry in source.split(",") if entry.strip()]
     
+    units = {}
+    for entry in entries:
+        unit, separator, path = entry.partition("=")
+        if not separator or os.path.exists(entry):
+            unit, path = _unit_name(entry, year, month), entry
+        if unit in units:
+            raise ValueError(f"Two workbooks for unit {unit}: {units[unit]} and {path}")
+        units[unit] = path
+    return units
+
+_share_slots = None
+_unit_options = (False, True)
+_unit_year = None
+_unit_exclude_rows = PLATFORM_EXCLUDED_ROWS
+
+def _init_unit_worker(share_slots, recalculate=False, use_cache=True, year=None, exclude_rows=PLATFORM_EXCLUDED_ROWS):
+    global _share_slots, _unit_options, _unit_year, _unit_exclude_rows
+    profiling.drain()
+    reset_com_call_counts()
+    _share_slots = share_slots
+    _unit_options = (recalculate, use_cache)
+    _unit_year = year
+    _unit_exclude_rows = exclude_rows
+
+def _render_unit(unit, file_path, target_month):
+    """Extract and render one unit's report in a worker; errors are returned, not raised"""
+    start_time = time.perf_counter()
+    result = {"unit": unit, "path": file_path}
     try:
-        # 數位戶客戶數 values from 數位戶 worksheet
-        # Find rows for each metric (search in a reasonable range)
-        search_range = "A1:Z100"  # Adjust range as needed
-        
-        # Find 月目標數 row
-        month_target_row = find_row_by_text(ws_digital_account, "月目標數", search_range)
-        if month_target_row:
-            values['digital_month_target'] = get_cell_value(ws_digital_account, month_target_row, digital_account_col)
-        
-        # Find 數位戶實績(存戶+卡戶) row
-        digital_actual_row = find_row_by_text(ws_digital_account, "數位戶實績(存戶+卡戶)", search_range)
-        if digital_actual_row:
-            values['digital_actual'] = get_cell_value(ws_digital_account, digital_actual_row, digital_account_col)
-        
-        # Find 月目標達成率 row - get text instead of value for percentage
-        digital_rate_row = find_row_by_text(ws_digital_account, "月目標達成率", search_range)
-        if digital_rate_row:
-            values['digital_achievement_rate_text'] = get_cell_text(ws_digital_account, digital_rate_row, digital_account_col)
-        
-        # 數位平台收益 values from 數位平台收益 worksheet
-        # Find 月目標數 row
-        platform_month_target_row = find_row_by_text(ws_digital_platform, "月目標數", search_range)
-        if platform_month_target_row:
-            values['platform_month_target'] = get_cell_value(ws_digital_platform, platform_month_target_row, digital_platform_col)
-        
-        # Find 實際數位平台收益 row
-        platform_actual_row = find_row_by_text(ws_digital_platform, "實際數位平台收益", search_range)
-        if platform_actual_row:
-            values['platform_actual'] = get_cell_value(ws_digital_platform, platform_actual_row, digital_platform_col)
-        
-        # Find 月目標達成率 row - get text instead of value for percentage
-        platform_rate_row = find_row_by_text(ws_digital_platform, "月目標達成率", search_range)
-        if platform_rate_row:
-            values['platform_achievement_rate_text'] = get_cell_text(ws_digital_platform, platform_rate_row, digital_platform_col)
-        
-        # Find 累積月目標數 row
-        platform_cumulative_target_row = find_row_by_text(ws_digital_platform, "累積月目標數", search_range)
-        if platform_cumulative_target_row:
-            values['platform_cumulative_target'] = get_cell_value(ws_digital_platform, platform_cumulative_target_row, digital_platform_col)
-        
-        # Find 累積月實際數 row
-        platform_cumulative_actual_row = find_row_by_text(ws_digital_platform, "累積月實際數", search_range)
-        if platform_cumulative_actual_row:
-            values['platform_cumulative_actual'] = get_cell_value(ws_digital_platform, platform_cumulative_actual_row, digital_platform_col)
-        
-        # Find 累積月目標達成率 row - get text instead of value for percentage
-        platform_cumulative_rate_row = find_row_by_text(ws_digital_platform, "累積月目標達成率", search_range)
-        if platform_cumulative_rate_row:
-            values['platform_cumulative_rate_text'] = get_cell_text(ws_digital_platform, platform_cumulative_rate_row, digital_platform_col)
-        
+        with profiling.span("unit", unit=unit):
+            # Every read of the unit's workbook happens while holding a share slot
+            with _share_slots:
+                result["wait_seconds"] = time.perf_counter() - start_time
+                workbook = open_headless_workbook(file_path, *_unit_options)
+                try:
+                    ws_digital_account, ws_digital_platform = find_report_worksheets(workbook)
+                    if ws_digital_account is None or ws_digital_platform is None:
+                        raise ValueError("Report worksheets not found in workbook")
+                    result["values"], result["html_body"] = build_report_html(
+                        ws_digital_account, ws_digital_platform, target_month, _unit_year, unit, _unit_exclude_rows)
+                finally:
+                    workbook.Close(False)
     except Exception as e:
-        print(f"Error getting dynamic values: {e}")
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["seconds"] = time.perf_counter() - start_time
+    result["profile"] = profiling.drain()
+    result["com_calls"] = get_com_call_counts()
+    reset_com_call_counts()
+    return result
+
+def render_unit_table(unit_values, metrics):
+    """HTML table with one row per unit (the rollup last) and one column per metric"""
+    units = list(unit_values)
+    columns = []
+    for metric in metrics:
+        bulk_format = METRIC_BULK_FORMATTERS[metric.formatter]
+        values = [unit_values[unit].get(metric.key, metric.default) for unit in units]
+        texts = bulk_format(values)
+        if metric.default is None:
+            texts = [MISSING_VALUE if value is None else text for value, text in zip(values, texts)]
+        columns.append(texts)
+    cell_style = "border:1px solid #808080;padding:2px 6px"
+    lines = ['<table style="border-collapse:collapse;font-size:10pt">',
+             "<tr>" + f'<th style="{cell_style};background:#DDEBF7">單位</th>'
+             + "".join(f'<th style="{cell_style};background:#DDEBF7">{html.escape(metric.label)}</th>'
+                       for metric in metrics) + "</tr>"]
+    for position, unit in enumerate(units):
+        weight = ";font-weight:bold" if unit == UNIT_ROLLUP_NAME else ""
+        lines.append("<tr>" + f'<td style="{cell_style}{weight}">{html.escape(unit)}</td>'
+                     + "".join(f'<td style="{cell_style};text-align:right{weight}">{html.escape(column[position])}</td>'
+                               for column in columns) + "</tr>")
+    lines.append("</table>")
+    return "\n".join(lines)
+
+@timed()
+def build_rollup_html(unit_values, target_month, year=None):
+    """Consolidated report: the mail text filled with the rolled-up metrics, unit tables instead of sheet ranges"""
+    # The 榮譽累積 figures are head office's for the whole: configured, not combined from the units
+    rollup = add_honor_figures(rollup_values(list(unit_values.values())), year, target_month)
+    table_values = {**unit_values, UNIT_ROLLUP_NAME: rollup}
+    plan = compile_template().plan
+    tables = {
+        "[TABLE1_PLACEHOLDER]": render_unit_table(table_values, [metric for metric in plan.metrics
+                                                                 if metric.sheet == "數位戶"]),
+        "[TABLE2_PLACEHOLDER]": render_unit_table(table_values, [metric for metric in plan.metrics
+                                                                 if metric.sheet == "數位平台收益"]),
+    }
+    mail_body = build_mail_body(add_history_deltas(rollup, year, target_month, UNIT_ROLLUP_NAME), f"{target_month:02d}")
+    return rollup, build_mail_html(mail_body, tables)
+
+def print_unit_report(results, total_seconds):
+    """Per-unit latency (slowest first), failures, and the overall spread"""
+    for result in sorted(results, key=lambda result: -result["seconds"]):
+        waited = result.get("wait_seconds", 0) * 1000
+        status = f"❌ {result['error']}" if "error" in result else "ok"
+        print(f"  {result['unit']}: {result['seconds'] * 1000:.1f} ms (waited {waited:.1f} ms for the share) {status}")
+    latencies = [result["seconds"] for result in results]
+    failed = [result for result in results if "error" in result]
+    if latencies:
+        print(f"Units finished: {len(results) - len(failed)}/{len(results)} ok in {total_seconds:.2f}s "
+              f"(median {statistics.median(latencies) * 1000:.1f} ms, max {max(latencies) * 1000:.1f} ms)")
+    for result in failed:
+        print(f"❌ {result['unit']} failed ({result['path']}): {result['error']}")
+
+@timed()
+def run_units(units, target_month, output_dir, year=None, workers=None, share_concurrency=UNIT_SHARE_CONCURRENCY,
+              create_drafts=False, signature=None, recalculate=False, use_cache=True, history=True,
+              exclude_rows=PLATFORM_EXCLUDED_ROWS):
+    """Render the report for every unit workbook across a process pool, plus a consolidated rollup
     
-    return values
+    At most share_concurrency workbooks are read from the share at once. A
+    failing unit is reported and skipped; the others still get their report.
+    Each unit is written to output_dir/<unit>/report_YYYYMM.html and the
+    rollup to output_dir/合計/, with a latency/failure summary in
+    output_dir/units_YYYYMM.json. Unit and rollup metrics go to the history
+    (rollup as unit 合計) unless history=False. Returns the list of per-unit results.
+    """
+    year = year or datetime.now().year
+    workers = workers or min(len(units), os.cpu_count() or 1)
+    print(f"Units: {len(units)} workbook(s) with {workers} worker(s), "
+          f"at most {share_concurrency} reading the share at once")
+    
+    start_time = time.perf_counter()
+    signature_html = signature.inline_html() if signature is not None else ""
+    share_slots = multiprocessing.BoundedSemaphore(share_concurrency)
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_unit_worker,
+                             initargs=(share_slots, recalculate, use_cache, year, exclude_rows)) as pool:
+        futures = [pool.submit(_render_unit, unit, path, target_month) for unit, path in units.items()]
+        for future in as_completed(futures):
+            result = future.result()
+            profiling.merge(result.pop("profile"))
+            add_com_call_counts(result.pop("com_calls"))
+            if "error" not in result:
+                if history:
+                    record_metrics(result["values"], year, target_month, result["unit"], result["path"])
+                result["output"] = write_report_html(add_signature(result["html_body"], signature_html),
+                                                     os.path.join(output_dir, result["unit"]), year, target_month)
+            results.append(result)
+    
+    by_unit = {result["unit"]: result for result in results if "error" not in result}
+    unit_values = {unit: by_unit[unit]["values"] for unit in units if unit in by_unit}
+    if unit_values:
+        rollup, rollup_html = build_rollup_html(unit_values, target_month, year)
+        if history:
+            record_metrics(rollup, year, target_month, UNIT_ROLLUP_NAME)
+        rollup_path = write_report_html(add_signature(rollup_html, signature_html),
+                                        os.path.join(output_dir, UNIT_ROLLUP_NAME), year, target_month)
+        print(f"Rollup of {len(unit_values)} unit(s) written to {rollup_path}")
+    
+    if create_drafts and unit_values:
+        outlook = dispatch_application("Outlook.Application")
+        for unit in unit_values:
+            save_outlook_draft(outlook, by_unit[unit]["html_body"], signature, f"{MAIL_SUBJECT} - {unit}")
+        save_outlook_draft(outlook, rollup_html, signature, f"{MAIL_SUBJECT} - {UNIT_ROLLUP_NAME}")
+        print(f"Saved {len(unit_values) + 1} Outlook draft(s)")
+    
+    total_seconds = time.perf_counter() - start_time
+    print_unit_report(results, total_seconds)
+    summary_path = os.path.join(output_dir, f"units_{year}{target_month:02d}.json")
+    os.makedirs(output_dir, exist_ok=True)
+    with open(summary_path, "w", encoding="utf-8") as f:
+        json.dump({"month": target_month, "seconds": round(total_seconds, 3),
+                   "units": [{key: result[key] for key in ("unit", "path", "seconds", "wait_seconds", "error", "output")
+                              if key in result} for result in results]},
+                  f, ensure_ascii=False, indent=1)
+    return results
 
-def get_user_input_month():
-    """Get target month from user input"""
+def get_user_input_months():
+    """Get target month (or a month range such as 1-3 for batch mode) from user input"""
     while True:
         try:
-            print("請輸入要產出報表的月份 (1-12):")
+            print("請輸入要產出報表的月份 (1-12，批次可輸入範圍如 1-3):")
             month_input = input("月份: ").strip()
-            target_month = int(month_input)
-            
-            if 1 <= target_month <= 12:
-                return target_month
-            else:
-                print("請輸入1-12之間的數字")
+            return parse_month_range(month_input)
         except ValueError:
-            print("請輸入有效的數字")
-
-def copy_excel_range_to_outlook(worksheet, range_address):
-    """Copy Excel range and return it for pasting into Outlook"""
-    try:
-        range_obj = worksheet.Range(range_address)
-        range_obj.Copy()
-        return range_obj
-    except Exception as e:
-        print(f"Error copying range {range_address}: {e}")
-        return None
-
-def copy_excel_range_with_deletion(worksheet, range_address, delete_rows_start, delete_rows_end):
-    """Copy Excel range and delete specific rows after copying, with formula conversion"""
-    try:
-        # First copy the entire range
-        range_obj = worksheet.Range(range_address)
-        range_obj.Copy()
-        
-        # Create a temporary worksheet to manipulate the data
-        temp_ws = worksheet.Parent.Worksheets.Add()
-        temp_ws.Name = "TempData"
-        
-        # Paste the copied data to temporary worksheet (preserve formatting)
-        temp_ws.Range("A1").PasteSpecial(Paste=-4104)  # xlPasteAll = -4104 (values + formatting)
-        
-        # **重要：將公式轉換為數值，避免刪除行後出現 #REF! 錯誤**
-        # 獲取貼上的資料範圍
-        used_range = temp_ws.UsedRange
-        if used_range:
-            print("Converting formulas to values in temporary worksheet...")
-            # 複製範圍
-            used_range.Copy()
-            # 貼上為數值（這會將所有公式轉換為計算結果）
-            used_range.PasteSpecial(Paste=-4163)  # xlPasteValues = -4163
-            # 清除剪貼簿
-            worksheet.Parent.Application.CutCopyMode = False
-            print("Successfully converted formulas to values")
-        
-        # Calculate the rows to delete in the temporary worksheet
-        # If original range starts at row 11 and we want to delete rows 23-31,
-        # in the temp sheet this would be rows 13-21 (23-11+1 to 31-11+1)
-        original_start_row = int(range_address.split(':')[0][1:])  # Extract row number from range
-        temp_delete_start = delete_rows_start - original_start_row + 1
-        temp_delete_end = delete_rows_end - original_start_row + 1
-        
-        # Delete the unwanted rows in temporary worksheet
-        if temp_delete_start > 0 and temp_delete_end > 0:
-            delete_range = f"{temp_delete_start}:{temp_delete_end}"
-            print(f"Deleting rows {temp_delete_start}-{temp_delete_end} from temporary data...")
-            temp_ws.Rows(delete_range).Delete()
-            print(f"Successfully deleted rows {temp_delete_start}-{temp_delete_end} from temporary data")
-        
-        # Copy the modified data with formatting (now all values, no formulas)
-        used_range = temp_ws.UsedRange
-        if used_range:
-            used_range.Copy()
-            print("Final data copied successfully (formulas converted to values)")
-        else:
-            print("Warning: No data found in temporary worksheet")
-            return None
-        
-        # Don't delete the temporary worksheet immediately - let the caller handle it
-        # Store reference for later cleanup
-        temp_ws.Name = f"TempData_{worksheet.Name}"
-        
-        return used_range
-        
-    except Exception as e:
-        print(f"Error copying range with deletion {range_address}: {e}")
-        # Clean up temporary worksheet if it exists
-        try:
-            if 'temp_ws' in locals():
-                worksheet.Parent.Application.DisplayAlerts = False
-                temp_ws.Delete()
-                worksheet.Parent.Application.DisplayAlerts = True
-                print("Cleaned up temporary worksheet due to error")
-        except:
-            pass
-        return None
+            print("請輸入1-12之間的有效數字或範圍")
 
+@timed()
 def get_word_document_content_with_formatting(word_file_path):
     """Get content from Word document with formatting preserved"""
     try:
-        import win32com.client
-        word_app = win32com.client.Dispatch("Word.Application")
+        word_app = dispatch_application("Word.Application")
         word_app.Visible = False
         
         # Open the Word document
@@ -317,9 +947,10 @@ def get_word_document_content_with_formatting(word_file_path):
         # Get the plain text as backup
         content_text = word_doc.Content.Text
         
-        # Close document and Word application
+        # Close the document, and Word unless it belongs to the session daemon
         word_doc.Close(False)
-        word_app.Quit()
+        if _office_session is None:
+            word_app.Quit()
         
         print(f"Successfully retrieved formatted content from {word_file_path}")
         return content_text.strip(), True  # Return text and flag indicating formatting is copied
@@ -328,6 +959,7 @@ def get_word_document_content_with_formatting(word_file_path):
         print(f"Error getting Word document content with formatting: {e}")
         return None, False
 
+@timed()
 def insert_signature_to_email(word_doc, signature_path):
     """Insert signature from Word document to email with formatting preserved"""
     try:
@@ -395,257 +1027,601 @@ def insert_signature_to_email(word_doc, signature_path):
         print(f"Error inserting signature: {e}")
         return False
 
-def main():
+# Exit codes of the command-line entry point
+EXIT_OK = 0
+EXIT_ERROR = 1
+EXIT_USAGE = 2
+EXIT_WORKBOOK_NOT_FOUND = 3
+EXIT_WORKSHEET_NOT_FOUND = 4
+
+SIGNATURE_PATH = r"C:\Users\Documents\SIGN.docx"
+SMTP_PASSWORD_ENV = "AUTOEMAIL_SMTP_PASSWORD"
+PROFILE_TRACE_FILE = os.path.join(os.path.expanduser("~"), ".autoEmail_cache", "profile.jsonl")
+
+def parse_args(argv):
+    """Parse command-line arguments for unattended runs"""
+    parser = argparse.ArgumentParser(
+        description="Generate the (週報)績效數字統計 report mail from the statistics workbook.",
+        epilog=(f"exit codes: {EXIT_OK}=ok, {EXIT_ERROR}=error, {EXIT_USAGE}=bad arguments, "
+                f"{EXIT_WORKBOOK_NOT_FOUND}=workbook not found, {EXIT_WORKSHEET_NOT_FOUND}=worksheet not found"))
+    parser.add_argument("--month", "-m", required=True,
+                        help="report month 1-12, or a range such as 1-3 / 1,2,5-7 for batch mode")
+    parser.add_argument("--year", "-y", type=int, default=datetime.now().year,
+                        help="report year (default: current year)")
+    parser.add_argument("--workbook", "-w",
+                        help="workbook path (default: the month's file on the network share)")
+    parser.add_argument("--output", "-o", choices=("display", "draft", "html", "eml", "smtp"),
+                        help="display the mail, save it as an Outlook draft, write HTML or .eml to disk, "
+                             "or send it over SMTP (default: draft, html with --dry-run)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="write the rendered message as HTML to --output-dir instead of creating a mail")
+    parser.add_argument("--output-dir", default=BATCH_OUTPUT_DIR,
+                        help=f"directory for HTML/.eml output (default: {BATCH_OUTPUT_DIR})")
+    parser.add_argument("--backend", choices=("excel", "headless"),
+                        help="read the workbook through Excel or the headless reader "
+                             "(default: excel when pywin32 is installed)")
+    parser.add_argument("--workers", type=int, help="batch/units mode worker processes")
+    parser.add_argument("--units", metavar="SOURCE",
+                        help="render the month for many unit workbooks plus a rollup: a directory (one "
+                             "sub-directory or .xlsx per unit), a comma-separated [unit=]path list, or @file")
+    parser.add_argument("--share-concurrency", type=int, default=UNIT_SHARE_CONCURRENCY,
+                        help=f"units mode: workbooks read from the share at once (default: {UNIT_SHARE_CONCURRENCY})")
+    parser.add_argument("--recalculate", action="store_true",
+                        help="headless backend: evaluate formulas locally instead of using the "
+                             "values cached in the file (cells without cached values always are)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="headless backend: read the workbook itself instead of its local snapshot")
+    parser.add_argument("--serial", action="store_true",
+                        help="run the extraction/rendering stages one after another (no overlap)")
+    parser.add_argument("--profile", action="store_true",
+                        help="print a per-stage timing and call count summary at the end")
+    parser.add_argument("--trace", nargs="?", const=PROFILE_TRACE_FILE,
+                        help=f"append timing spans as JSON lines to a file (default: {PROFILE_TRACE_FILE})")
+    parser.add_argument("--watch", nargs="?", type=float, const=WATCH_INTERVAL, metavar="SECONDS",
+                        help="keep running and regenerate the report whenever the cells it reads change "
+                             f"(polls every {WATCH_INTERVAL}s by default; the workbook is read headless)")
+    parser.add_argument("--no-history", action="store_true",
+                        help="do not record the extracted metrics in the local metrics history")
+    parser.add_argument("--session", nargs="?", const="", metavar="HOST:PORT",
+                        help="run the report in the Office session daemon (office_session.py), which keeps "
+                             "Excel/Outlook/Word warm between runs")
+    parser.add_argument("--record", metavar="TRACE",
+                        help="record every Excel/Outlook/Word call of the run to a trace file (com_trace.py)")
+    parser.add_argument("--replay", metavar="TRACE",
+                        help="replay a recorded trace instead of calling Office (works without pywin32)")
+    parser.add_argument("--replay-latency", default="0", metavar="MS",
+                        help="simulated latency per replayed call: milliseconds, 'recorded', "
+                             "or per member like 'Value=5,Text=5,1'")
+    parser.add_argument("--signature", default=SIGNATURE_PATH,
+                        help=f"signature .docx (default: {SIGNATURE_PATH})")
+    parser.add_argument("--exclude-rows", default=format_row_spans(PLATFORM_EXCLUDED_ROWS), metavar="ROWS",
+                        help="數位平台收益 sheet rows left out of the mail table, such as 23-31 or 12,23-31; "
+                             "'' keeps every row (default: %(default)s)")
+    
+    mail_group = parser.add_argument_group("eml/smtp output")
+    mail_group.add_argument("--sender", help="From address")
+    mail_group.add_argument("--to", help="comma-separated recipients, or @file with one address per line")
+    mail_group.add_argument("--cc", help="comma-separated Cc recipients, or @file")
+    mail_group.add_argument("--smtp-host", default="localhost")
+    mail_group.add_argument("--smtp-port", type=int, default=25)
+    mail_group.add_argument("--smtp-user", help=f"SMTP login (password from ${SMTP_PASSWORD_ENV})")
+    mail_group.add_argument("--smtp-starttls", action="store_true")
+    mail_group.add_argument("--smtp-ssl", action="store_true")
+    mail_group.add_argument("--smtp-connections", type=int, default=2, help="SMTP connection pool size")
+    args = parser.parse_args(argv)
+    
+    try:
+        args.months = parse_month_range(args.month)
+    except ValueError as e:
+        parser.error(str(e))
+    try:
+        args.exclude_rows = parse_row_spans(args.exclude_rows)
+    except ValueError as e:
+        parser.error(f"Invalid --exclude-rows: {e}")
+    if args.dry_run and args.output not in (None, "html"):
+        parser.error(f"--dry-run only writes HTML; it cannot be combined with --output {args.output}")
+    args.output = args.output or ("html" if args.dry_run else "draft")
+    if args.watch is not None:
+        if len(args.months) > 1 or args.units:
+            parser.error("--watch follows a single month of one workbook")
+        if args.watch <= 0:
+            parser.error("--watch interval must be positive")
+    if args.units:
+        if len(args.months) > 1:
+            parser.error("--units renders a single month")
+        if args.output in ("eml", "smtp"):
+            parser.error("--units writes HTML or Outlook drafts (use --dry-run/--output html|draft)")
+        if args.share_concurrency < 1:
+            parser.error("--share-concurrency must be at least 1")
+    if args.session is not None and args.watch is not None:
+        parser.error("--watch runs locally; it cannot be combined with --session")
+    if args.record or args.replay:
+        if args.record and args.replay:
+            parser.error("--record and --replay cannot be combined")
+        if len(args.months) > 1 or args.units or args.watch is not None or args.session is not None:
+            parser.error("--record/--replay trace a single local run (no batch, --units, --watch or --session)")
+        if args.backend == "headless":
+            parser.error("--record/--replay trace the Excel backend")
+        args.backend = "excel"
+        try:
+            args.replay_latency = com_trace.parse_latency(args.replay_latency)
+        except ValueError:
+            parser.error(f"Invalid --replay-latency: {args.replay_latency}")
+    if args.backend is None:
+        args.backend = "excel" if win32com is not None or args.session is not None else "headless"
+    # With --session Office runs in the daemon, not here; a replay needs no Office at all
+    if (win32com is None and args.session is None and not args.replay
+            and (args.backend == "excel" or args.output in ("display", "draft"))):
+        parser.error("pywin32 is not installed: use --backend headless with --dry-run/--output html|eml|smtp")
+    if args.output in ("eml", "smtp"):
+        if not args.sender or not args.to:
+            parser.error("--sender and --to are required for eml/smtp output")
+        args.mail_settings = {
+            "sender": args.sender,
+            "to": read_address_list(args.to),
+            "cc": read_address_list(args.cc),
+            "smtp_host": args.smtp_host,
+            "smtp_port": args.smtp_port,
+            "smtp_user": args.smtp_user,
+            "smtp_password": os.environ.get(SMTP_PASSWORD_ENV),
+            "smtp_starttls": args.smtp_starttls,
+            "smtp_ssl": args.smtp_ssl,
+            "smtp_connections": args.smtp_connections,
+        }
+    else:
+        args.mail_settings = None
+    return args
+
+def read_address_list(value):
+    """Split 'a@x, b@x' into addresses; '@path' reads one address per line from a file"""
+    if not value:
+        return []
+    if value.startswith("@"):
+        with open(value[1:], encoding="utf-8") as f:
+            value = ",".join(line.strip() for line in f if line.strip() and not line.startswith("#"))
+    return [address.strip() for address in value.split(",") if address.strip()]
+
+def build_report_message(html_body, mail_settings, signature=None):
+    """Build the MIME message of a rendered report (signature images as inline parts)"""
+    if signature is not None:
+        html_body = add_signature(html_body, signature.html)
+    return build_mime_message(MAIL_SUBJECT, html_body, mail_settings["sender"],
+                              mail_settings["to"], cc=mail_settings["cc"],
+                              inline_images=signature.images if signature is not None else None)
+
+@timed()
+def write_report_eml(message, output_dir, year, month):
+    """Write a MIME message to output_dir as an .eml file and return its path"""
+    os.makedirs(output_dir, exist_ok=True)
+    output_path = os.path.join(output_dir, f"report_{year}{month:02d}.eml")
+    with open(output_path, "wb") as f:
+        f.write(bytes(message))
+    return output_path
+
+@timed()
+def deliver_reports(html_bodies, output, mail_settings, output_dir, year, signature=None):
+    """Write (.eml) or send (SMTP) the rendered reports of {month: html}; returns failed months
+
+    A month whose message had recipients refused counts as failed too.
+    """
+    messages = {month: build_report_message(html_body, mail_settings, signature)
+                for month, html_body in html_bodies.items()}
+    if output == "eml":
+        for month, message in sorted(messages.items()):
+            print(f"✅ {month}月 message written to {write_report_eml(message, output_dir, year, month)}")
+        return []
+    
+    with SMTPConnectionPool(mail_settings["smtp_host"], mail_settings["smtp_port"],
+                            size=min(mail_settings["smtp_connections"], len(messages)),
+                            username=mail_settings["smtp_user"], password=mail_settings["smtp_password"],
+                            starttls=mail_settings["smtp_starttls"], use_ssl=mail_settings["smtp_ssl"]) as pool:
+        sent, failures, refusals = send_messages(pool, list(messages.values()))
+    return [month for month, message in messages.items()
+            if message["Message-ID"] in failures or message["Message-ID"] in refusals]
+
+@timed()
+def open_report_workbook(file_path, backend, recalculate=False, use_cache=True):
+    """Open the workbook through Excel or the headless reader; returns (excel, workbook)"""
+    if backend == "headless":
+        return None, open_headless_workbook(file_path, recalculate, use_cache)
+    if _office_session is not None:
+        # Warm Excel; the workbook stays open in the session until the file changes
+        return _office_session.application("Excel.Application"), _office_session.workbook(file_path)
+    
+    excel = dispatch_application("Excel.Application")
+    excel.Visible = False
+    excel.DisplayAlerts = False
+    return excel, excel.Workbooks.Open(file_path)
+
+@timed()
+def create_outlook_mail(html_body, output, signature_path, signature=None):
+    """Create the report mail in Outlook, add the signature, then display or save it
+    
+    With a parsed signature the fragment goes straight into HTMLBody; Word is
+    only driven through the inspector when SIGN.docx could not be parsed.
+    """
+    outlook = dispatch_application("Outlook.Application")
+    mail = outlook.CreateItem(0)  # olMailItem = 0
+    
+    # Set email properties
+    mail.Subject = MAIL_SUBJECT
+    if signature is not None:
+        mail.HTMLBody = add_signature(html_body, signature.html)
+        attach_signature_images(mail, signature)
+    else:
+        mail.HTMLBody = html_body
+    
+    if output == "display":
+        # Display the email first
+        mail.Display()
+    
+    if signature is None:
+        # Get the mail item's inspector and word editor
+        inspector = mail.GetInspector
+        word_doc = inspector.WordEditor
+        
+        # Add signature from Word document
+        print("Adding signature from Word document...")
+        signature_success = insert_signature_to_email(word_doc, signature_path)
+        if not signature_success:
+            print("⚠ Warning: Signature could not be added automatically.")
+            print("Please manually add the signature content to the email.")
+    
+    if output == "draft":
+        mail.Save()
+        print("✅ Email saved to Drafts")
+
+def run_report(year, months, file_path=None, output="display", output_dir=BATCH_OUTPUT_DIR,
+               backend="excel", workers=None, keep_excel_open=False, mail_settings=None,
+               signature_path=SIGNATURE_PATH, recalculate=False, use_cache=True, concurrent=True,
+               units=None, share_concurrency=UNIT_SHARE_CONCURRENCY, history=True,
+               exclude_rows=PLATFORM_EXCLUDED_ROWS):
+    """Generate the report for one month (or a batch of months, or many units); returns an exit code
+    
+    The extracted metrics are recorded in the metrics history unless history=False.
+    exclude_rows are the 數位平台收益 sheet rows left out of the mail table.
+    """
+    target_month = months[-1]
+    if units:
+        try:
+            unit_workbooks = discover_unit_workbooks(units, year, target_month)
+        except (OSError, ValueError) as e:
+            print(f"Cannot read unit list {units}: {e}")
+            return EXIT_USAGE
+        if not unit_workbooks:
+            print(f"No unit workbooks found in {units}")
+            return EXIT_WORKBOOK_NOT_FOUND
+        # Unit workbooks are always read headless (one process per workbook, no Excel instances)
+        results = run_units(unit_workbooks, target_month, output_dir, year=year, workers=workers,
+                            share_concurrency=share_concurrency, create_drafts=output in ("display", "draft"),
+                            signature=load_signature(signature_path), recalculate=recalculate,
+                            use_cache=use_cache, history=history, exclude_rows=exclude_rows)
+        return EXIT_OK if all("error" not in result for result in results) else EXIT_ERROR
+    
+    # The latest month's workbook holds every earlier month column
+    file_path = file_path or get_workbook_path(year, target_month)
+    
+    # Check if file exists (a replayed workbook only exists in the trace)
+    replaying = _com_trace is not None and _com_trace.replaying
+    if not replaying and not os.path.exists(file_path):
+        print(f"File not found: {file_path}")
+        return EXIT_WORKBOOK_NOT_FOUND
+    
+    if len(months) > 1:
+        # Parsed once per run (and cached on disk until SIGN.docx changes)
+        signature = load_signature(signature_path)
+        html_bodies = run_batch(file_path, months, output_dir, year=year, workers=workers,
+                                create_drafts=output in ("display", "draft"), signature=signature,
+                                recalculate=recalculate, use_cache=use_cache, history=history,
+                                exclude_rows=exclude_rows)
+        failed = [month for month in months if month not in html_bodies]
+        if output in ("eml", "smtp") and html_bodies:
+            failed += deliver_reports(html_bodies, output, mail_settings, output_dir, year, signature)
+        return EXIT_OK if not failed else EXIT_ERROR
+    
     excel = None
-    outlook = None
     workbook = None
     
     try:
-        # Get user input for target month
-        target_month = get_user_input_month()
-        print(f"選擇的月份: {target_month}月")
-        
-        # Get current year for file path
-        current_date = datetime.now()
-        current_year = current_date.year
-        
-        # Format month as MM
-        formatted_month = f"{target_month:02d}"
-        
-        # Use target month as the formatted date for email content
-        formatted_date = f"{target_month:02d}"
-        
-        # Construct file name and path
-        file_name = f"{current_year}統計({current_year}{formatted_month})"
-        file_path = f"\\\\X.X.X.X\\{file_name}.xlsx"
-        
-        # Check if file exists
-        if not os.path.exists(file_path):
-            print(f"File not found: {file_path}")
-            input("Press Enter to exit...")
-            return
-        
-        print(f"Processing file: {file_name}")
-        
-        # Create Excel application
-        excel = win32com.client.Dispatch("Excel.Application")
-        excel.Visible = False
-        excel.DisplayAlerts = False
+        print(f"Processing file: {os.path.basename(file_path)}")
         
         # Open workbook
-        workbook = excel.Workbooks.Open(file_path)
+        excel, workbook = open_report_workbook(file_path, backend, recalculate, use_cache)
         
         # Find worksheets
-        ws_digital_account = None
-        ws_digital_platform = None
-        
-        for sheet in workbook.Worksheets:
-            if sheet.Name == "數位戶":
-                ws_digital_account = sheet
-            elif sheet.Name == "數位平台收益":
-                ws_digital_platform = sheet
+        ws_digital_account, ws_digital_platform = find_report_worksheets(workbook)
         
         if ws_digital_account is None:
             print("Worksheet '數位戶' not found!")
-            return
+            return EXIT_WORKSHEET_NOT_FOUND
         
         if ws_digital_platform is None:
             print("Worksheet '數位平台收益' not found!")
-            return
-        
-        # Get dynamic values from Excel using target month
-        dynamic_values = get_dynamic_values(ws_digital_account, ws_digital_platform, target_month)
-        
-        # Calculate dynamic column ranges using target month
-        # 數位戶: Q50 to (Q+month)60
-        digital_account_end_col = calculate_end_column("Q", target_month)
-        range1 = f"Q50:{digital_account_end_col}60"
-        
-        # 數位平台收益: P11 to (P+month)41 (整個範圍，稍後刪除23-31行)
-        digital_platform_end_col = calculate_end_column("P", target_month)
-        range2 = f"P11:{digital_platform_end_col}41"
+            return EXIT_WORKSHEET_NOT_FOUND
         
+        range1, range2 = get_report_ranges(target_month)
         print(f"Target Month: {target_month}")
         print(f"數位戶 range: {range1}")
-        print(f"數位平台收益 range: {range2} (will delete rows 23-31)")
-        
-        # Create Outlook application
-        outlook = win32com.client.Dispatch("Outlook.Application")
-        mail = outlook.CreateItem(0)  # olMailItem = 0
+        print(f"數位平台收益 range: {range2}" + (f" (rows {format_row_spans(exclude_rows)} left out)" if exclude_rows else ""))
         
-        # Set email properties
-        mail.Subject = "(週報)績效數字統計"
-        
-        # Create email body with dynamic values
-        mail_body = f"""Dear all,
-
-至{formatted_date}績效數字統計及說明如下，謝謝。
-
-(1) 數位戶客戶數: 年目標為1,564,000戶，月目標{format_digital_account_number(dynamic_values.get('digital_month_target', 0))}戶，目前實際數為{format_digital_account_number(dynamic_values.get('digital_actual', 0))}戶，
-月目標達成率為{format_percentage_from_text(dynamic_values.get('digital_achievement_rate_text', '0%'))}。
-網行銀客戶數(具有網行銀會員身分之存戶+卡戶)
-
-[TABLE1_PLACEHOLDER]
-
-(2)數位平台收益: 年目標為4億元，月目標{format_platform_revenue(dynamic_values.get('platform_month_target', 0))}，目前實際數為{format_platform_revenue(dynamic_values.get('platform_actual', 0))}，月目標達成率為{format_percentage_from_text(dynamic_values.get('platform_achievement_rate_text', '0%'))}。
-     累積月目標數{format_platform_revenue(dynamic_values.get('platform_cumulative_target', 0))}，累積月實際數{format_platform_revenue(dynamic_values.get('platform_cumulative_actual', 0))}，累積月目標達成率為{format_percentage_from_text(dynamic_values.get('platform_cumulative_rate_text', '0%'))}。
-     榮譽累積月目標數1.63億元，榮譽累積月目標達成率為140.6%。
-數位平台收益
-
-[TABLE2_PLACEHOLDER]
-"""
+        # Get dynamic values, render both tables and load the signature (concurrently where possible)
+        dynamic_values, html_body, signature = build_report_pipeline(
+            ws_digital_account, ws_digital_platform, target_month, signature_path, concurrent, year, exclude_rows)
+        if history:
+            record_metrics(dynamic_values, year, target_month, source=file_path)
         
         print(f"Email content generated for {target_month}月 data")
-        print(f"Using month date: {formatted_date}")
-        
-        # Set initial body
-        mail.Body = mail_body
-        
-        # Display the email first
-        mail.Display()
-        
-        # Get the mail item's inspector and word editor
-        inspector = mail.GetInspector
-        word_doc = inspector.WordEditor
-        
-        # Find and replace placeholders with actual Excel data
-        # Copy first table (數位戶)
-        print("Copying 數位戶 data...")
-        range_obj1 = copy_excel_range_to_outlook(ws_digital_account, range1)
-        if range_obj1:
-            # Find the placeholder text and replace with copied range
-            find_range = word_doc.Content
-            find_range.Find.Text = "[TABLE1_PLACEHOLDER]"
-            if find_range.Find.Execute():
-                find_range.Paste()
-                print("數位戶 table pasted successfully")
-                
-                # Make the text above the table bold
-                find_range = word_doc.Content
-                find_range.Find.Text = "網行銀客戶數(具有網行銀會員身分之存戶+卡戶)"
-                if find_range.Find.Execute():
-                    find_range.Font.Bold = True
-        
-        # Copy second table (數位平台收益) - copy range 11-41 and delete rows 23-31
-        print("Copying 數位平台收益 data with deletion of rows 23-31...")
-        print("⚠️  Converting formulas to values to prevent #REF! errors...")
-        
-        # Find the placeholder text first
-        find_range = word_doc.Content
-        find_range.Find.Text = "[TABLE2_PLACEHOLDER]"
-        if find_range.Find.Execute():
-            # Copy range with deletion of rows 23-31 (formulas will be converted to values)
-            print("Preparing data with row deletion and formula conversion...")
-            range_obj2 = copy_excel_range_with_deletion(ws_digital_platform, range2, 23, 31)
-            if range_obj2:
-                # Clear the placeholder text
-                find_range.Text = ""
-                # Paste the table data
-                find_range.Paste()
-                print("✅ 數位平台收益 table pasted successfully (with rows 23-31 deleted, formulas converted to values)")
-                
-                # Clean up temporary worksheet
-                try:
-                    temp_sheet_name = f"TempData_{ws_digital_platform.Name}"
-                    for sheet in workbook.Worksheets:
-                        if sheet.Name == temp_sheet_name:
-                            excel.DisplayAlerts = False
-                            sheet.Delete()
-                            excel.DisplayAlerts = True
-                            print("Temporary worksheet cleaned up")
-                            break
-                except Exception as cleanup_error:
-                    print(f"Warning: Could not clean up temporary worksheet: {cleanup_error}")
-            else:
-                print("❌ Failed to copy 數位平台收益 table with deletion")
-                # Fallback: try the original method
-                print("Attempting fallback method...")
-                try:
-                    range_obj2_fallback = copy_excel_range_to_outlook(ws_digital_platform, f"P11:{digital_platform_end_col}22")
-                    if range_obj2_fallback:
-                        find_range.Text = ""
-                        find_range.Paste()
-                        print("Fallback: First part of table pasted")
-                        
-                        # Add second part
-                        find_range.Collapse(0)
-                        find_range.TypeText("\n\n")
-                        range_obj2_fallback2 = copy_excel_range_to_outlook(ws_digital_platform, f"P32:{digital_platform_end_col}41")
-                        if range_obj2_fallback2:
-                            find_range.Paste()
-                            print("Fallback: Second part of table pasted")
-                except Exception as fallback_error:
-                    print(f"Fallback method also failed: {fallback_error}")
+        print(f"Using month date: {target_month:02d}")
+        
+        if output == "html":
+            signature_html = signature.inline_html() if signature is not None else ""
+            output_path = write_report_html(add_signature(html_body, signature_html), output_dir, year, target_month)
+            print(f"✅ Rendered message written to {output_path}")
+        elif output in ("eml", "smtp"):
+            if deliver_reports({target_month: html_body}, output, mail_settings, output_dir, year, signature):
+                return EXIT_ERROR
         else:
-            print("Could not find [TABLE2_PLACEHOLDER] in email content")
-        
-        # Make the second occurrence of "數位平台收益" text bold (skip the first one)
-        print("Making the second occurrence of '數位平台收益' text bold...")
-        find_range = word_doc.Content
-        find_range.Find.ClearFormatting()
-        find_range.Find.Text = "數位平台收益"
-        
-        # Search for all instances and find the second standalone one
-        occurrence_count = 0
-        while find_range.Find.Execute():
-            # Check if this is a standalone line (not part of a longer paragraph)
-            paragraph_text = find_range.Paragraphs(1).Range.Text.strip()
-            if paragraph_text == "數位平台收益":
-                occurrence_count += 1
-                if occurrence_count == 2:  # Apply bold to the second occurrence only
-                    find_range.Font.Bold = True
-                    print("Applied bold formatting to the second occurrence of '數位平台收益' text")
-                    break
-            # Move to next occurrence
-            find_range.Start = find_range.End
-        
-        # Apply underline formatting to text between parentheses and colon
-        # Format: (1) 數位戶客戶數: and (2)數位平台收益:
-        print("Applying underline formatting to section headers...")
-        
-        # Find and format "(1) 數位戶客戶數:"
-        find_range = word_doc.Content
-        find_range.Find.Text = "(1) 數位戶客戶數:"
-        if find_range.Find.Execute():
-            find_range.Font.Underline = True
+            create_outlook_mail(html_body, output, signature_path, signature)
+            print("✅ Email draft created successfully!")
         
-        # Find and format "(2)數位平台收益:"
-        find_range = word_doc.Content
-        find_range.Find.Text = "(2)數位平台收益:"
-        if find_range.Find.Execute():
-            find_range.Font.Underline = True
-        
-        # Add signature from Word document
-        print("Adding signature from Word document...")
-        signature_path = r"C:\Users\Documents\SIGN.docx"
-        
-        signature_success = insert_signature_to_email(word_doc, signature_path)
-        if not signature_success:
-            print("⚠ Warning: Signature could not be added automatically.")
-            print("Please manually add the signature content to the email.")
-        
-        print("✅ Email draft created successfully!")
-        print("Tables have been inserted with original Excel formatting.")
+        print("Tables have been rendered as HTML with the original Excel formatting.")
         print(f"Dynamic values have been updated based on {target_month}月 data.")
-        print("✅ 數位平台收益 table: formulas converted to values, rows 23-31 deleted - no #REF! errors!")
+        return EXIT_OK
         
     except Exception as e:
         print(f"An error occurred: {e}")
         import traceback
         traceback.print_exc()
+        return EXIT_ERROR
     
     finally:
-        # Clean up - but don't close Excel as requested
         try:
-            if workbook:
+            session_workbook = excel is not None and _office_session is not None
+            if workbook is not None and not session_workbook and (excel is None or not keep_excel_open):
+                workbook.Close(False)
+                # Only quit an Excel instance that has nothing else open
+                if excel is not None and excel.Workbooks.Count == 0:
+                    excel.Quit()
+            elif workbook is not None and not session_workbook:
                 print("Workbook remains open as requested")
-                # workbook.Close(False)  # Commented out to keep Excel open
-            # if excel:
-            #     excel.Quit()  # Commented out to keep Excel open
-        except:
+        except Exception:
             pass
+        print_com_call_summary()
+
+WATCH_INTERVAL = 30  # seconds between polls of the workbook in watch mode
+
+def _hash_block(digest, worksheet, address, with_formats=False):
+    """Add the values, display text (and cell formats) of a range to a hash"""
+    block = read_block(worksheet, address)
+    digest.update(repr(block.values).encode("utf-8"))
+    digest.update(repr(block.text_grid()).encode("utf-8"))
+    if with_formats:
+        for row in range(block.first_row, block.last_row + 1):
+            for col in range(block.first_col, block.last_col + 1):
+                digest.update(repr(sorted(worksheet.cell_format(row, col).items())).encode("utf-8"))
+
+@timed()
+def report_section_hashes(ws_digital_account, ws_digital_platform, target_month):
+    """Hash the cells each report section reads: {section: sha256 hex}
+    
+    Metric sections resolve their labels the way the extraction plan does
+    and hash each metric's label row with the month columns read from it
+    (every month up to the target month for the cumulative 數位平台收益
+    figures), so a label moving to another row counts as a change too.
+    Table sections hash their range, including cell formats.
+    """
+    range1, range2 = get_report_ranges(target_month)
+    sections = {
+        "數位戶 values": (ws_digital_account, "數位戶"),
+        "數位平台收益 values": (ws_digital_platform, "數位平台收益"),
+        "數位戶 table": (ws_digital_account, range1),
+        "數位平台收益 table": (ws_digital_platform, range2),
+    }
+    plan = compile_template().plan
+    hashes = {}
+    for name, (worksheet, target) in sections.items():
+        digest = hashlib.sha256()
+        if name.endswith(" values"):
+            locations = plan.resolve_sheet(worksheet, target_month, _find_metric_row, target,
+                                           label_cols=LABEL_SEARCH_COLUMNS)
+            for key, (row, cols) in sorted(locations.items()):
+                digest.update(repr((key, row)).encode("utf-8"))
+                _hash_block(digest, worksheet, f"{xlsx_reader.index_to_column(min(cols))}{row}:"
+                                               f"{xlsx_reader.index_to_column(max(cols))}{row}")
+        else:
+            _hash_block(digest, worksheet, target, with_formats=True)
+        hashes[name] = digest.hexdigest()
+    return hashes
+
+def build_report_sections(ws_digital_account, ws_digital_platform, target_month, names,
+                          exclude_rows=PLATFORM_EXCLUDED_ROWS):
+    """Rebuild the named report sections; returns {section: values dict or table html}"""
+    range1, range2 = get_report_ranges(target_month)
+    builders = {
+        "數位戶 values": lambda: get_digital_account_values(ws_digital_account, target_month),
+        "數位平台收益 values": lambda: get_digital_platform_values(ws_digital_platform, target_month),
+        "數位戶 table": lambda: render_report_table(ws_digital_account, range1),
+        "數位平台收益 table": lambda: render_report_table(ws_digital_platform, range2,
+                                                    exclude_rows=exclude_rows),
+    }
+    return {name: builders[name]() for name in names}
+
+def publish_watched_report(html_body, output, output_dir, year, target_month, signature, mail_settings, draft=None):
+    """Write or save the regenerated report; returns the Outlook draft now holding it (if any)"""
+    if output == "html":
+        signature_html = signature.inline_html() if signature is not None else ""
+        print(f"✅ Report written to {write_report_html(add_signature(html_body, signature_html), output_dir, year, target_month)}")
+    elif output in ("eml", "smtp"):
+        deliver_reports({target_month: html_body}, output, mail_settings, output_dir, year, signature)
+    else:
+        # Replace the previous draft rather than piling up one per save of the workbook
+        if draft is not None:
+            try:
+                draft.Delete()
+            except Exception:
+                pass  # already sent or deleted by hand
+        draft = save_outlook_draft(dispatch_application("Outlook.Application"), html_body, signature)
+        print("✅ Outlook draft updated")
+    return draft
+
+def watch_report(file_path, target_month, output="html", output_dir=BATCH_OUTPUT_DIR, year=None,
+                 signature_path=SIGNATURE_PATH, mail_settings=None, interval=WATCH_INTERVAL,
+                 recalculate=False, trace=None, max_polls=None, history=True, exclude_rows=PLATFORM_EXCLUDED_ROWS):
+    """Poll the workbook and regenerate the report only when cells it reads have changed
+    
+    Each poll is a stat; only a new size/mtime leads to a (partial, headless)
+    read that hashes the cells behind every report section. Unchanged
+    sections keep their previous result; if no section changed the report is
+    left alone. Workbooks are closed and profiling records flushed after each
+    poll; only the formula results of the cells read are carried over (and
+    recomputed just where the new save changed them), so memory stays flat
+    over long runs.
+    Runs until interrupted (or for max_polls polls).
+    """
+    year = year or datetime.now().year
+    print(f"Watching {file_path} for {target_month}月 every {interval:g}s (Ctrl+C to stop)")
+    last_stat = None
+    hashes = {}
+    sections = {}
+    draft = None
+    # Formula results carried from one save to the next: only formulas reading changed cells rerun
+    formula_engine = None
+    polls = 0
+    while max_polls is None or polls < max_polls:
+        if polls:
+            time.sleep(interval)
+        polls += 1
+        try:
+            stat = os.stat(file_path)
+        except OSError as e:
+            print(f"Cannot stat {file_path}: {e}")
+            continue
+        if (stat.st_size, stat.st_mtime_ns) == last_stat:
+            continue
+        
+        workbook = None
+        try:
+            workbook = xlsx_reader.open_workbook(file_path, recalculate)
+            if formula_engine is not None:
+                dropped = workbook.reuse_formula_engine(formula_engine)
+                print(f"Formula results kept from the previous save ({dropped} to recompute)")
+            ws_digital_account, ws_digital_platform = find_report_worksheets(workbook)
+            if ws_digital_account is None or ws_digital_platform is None:
+                print("Report worksheets not found; waiting for the next save")
+                last_stat = (stat.st_size, stat.st_mtime_ns)
+                continue
+            new_hashes = report_section_hashes(ws_digital_account, ws_digital_platform, target_month)
+            changed = [name for name, digest in new_hashes.items() if hashes.get(name) != digest]
+            if changed:
+                print(f"{time.strftime('%H:%M:%S')} changed: {', '.join(changed)}")
+                sections.update(build_report_sections(ws_digital_account, ws_digital_platform, target_month, changed,
+                                                      exclude_rows))
+                dynamic_values = {**sections["數位戶 values"], **sections["數位平台收益 values"]}
+                html_body = assemble_report_html(dynamic_values, sections["數位戶 table"],
+                                                 sections["數位平台收益 table"], target_month, year)
+                if history:
+                    record_metrics(dynamic_values, year, target_month, source=file_path)
+                draft = publish_watched_report(html_body, output, output_dir, year, target_month,
+                                               load_signature(signature_path), mail_settings, draft)
+            else:
+                print(f"{time.strftime('%H:%M:%S')} workbook saved, report cells unchanged")
+            hashes = new_hashes
+            last_stat = (stat.st_size, stat.st_mtime_ns)
+        except Exception as e:
+            # Usually the file is still being written; try again on the next poll
+            print(f"Could not read {os.path.basename(file_path)} ({type(e).__name__}: {e}); retrying")
+        finally:
+            if workbook is not None:
+                formula_engine = workbook.formula_engine(build=False) or formula_engine
+                workbook.Close(False)
+            if trace:
+                profiling.write_json_lines(trace, com_call_counters())
+            profiling.drain()
+            reset_com_call_counts()
+    return EXIT_OK
+
+def main(argv=None):
+    """Interactive run when started without arguments, unattended run otherwise"""
+    argv = sys.argv[1:] if argv is None else argv
+    reset_com_call_counts()
+    
+    if not argv:
+        # Get user input for target month
+        target_months = get_user_input_months()
+        print(f"選擇的月份: {', '.join(f'{month}月' for month in target_months)}")
+        
+        # Keep Excel open at the end, as the interactive workflow always has
+        exit_code = run_report(datetime.now().year, target_months,
+                               backend="excel" if win32com is not None else "headless",
+                               output="display" if win32com is not None else "html",
+                               keep_excel_open=True)
+        input("Press Enter to exit...")
+        return exit_code
     
-    input("Press Enter to exit...")
+    try:
+        args = parse_args(argv)
+    except SystemExit as e:
+        return EXIT_OK if e.code == 0 else EXIT_USAGE
+    
+    profiling.reset(backend=args.backend, output=args.output, months=args.months,
+                    cache=not args.no_cache, concurrent=not args.serial, units=args.units)
+    if args.watch is not None:
+        file_path = args.workbook or get_workbook_path(args.year, args.months[-1])
+        try:
+            return watch_report(file_path, args.months[-1], output=args.output, output_dir=args.output_dir,
+                                year=args.year, signature_path=args.signature, mail_settings=args.mail_settings,
+                                interval=args.watch, recalculate=args.recalculate, trace=args.trace,
+                                history=not args.no_history, exclude_rows=args.exclude_rows)
+        except KeyboardInterrupt:
+            print("Watch stopped")
+            return EXIT_OK
+    
+    if args.session is not None:
+        import office_session
+        address = (office_session.parse_address(args.session) if args.session
+                   else (office_session.SESSION_HOST, office_session.SESSION_PORT))
+        absolute = lambda path: os.path.abspath(path) if path else path  # the daemon has its own cwd
+        return office_session.submit_report({
+            "year": args.year, "months": args.months, "file_path": absolute(args.workbook),
+            "output": args.output, "output_dir": absolute(args.output_dir), "backend": args.backend,
+            "workers": args.workers, "mail_settings": args.mail_settings,
+            "signature_path": absolute(args.signature), "recalculate": args.recalculate,
+            "use_cache": not args.no_cache, "concurrent": not args.serial, "units": args.units,
+            "share_concurrency": args.share_concurrency, "history": not args.no_history,
+            "exclude_rows": args.exclude_rows,
+        }, address)
+    
+    global _com_trace
+    if args.record:
+        _com_trace = com_trace.Recorder(args.record)
+    elif args.replay:
+        try:
+            _com_trace = com_trace.Player(args.replay, args.replay_latency)
+        except (OSError, ValueError) as e:
+            print(f"Cannot read trace {args.replay}: {e}")
+            return EXIT_USAGE
+    try:
+        with profiling.span("run_report"):
+            exit_code = run_report(args.year, args.months, file_path=args.workbook, output=args.output,
+                                   output_dir=args.output_dir, backend=args.backend, workers=args.workers,
+                                   mail_settings=args.mail_settings, signature_path=args.signature,
+                                   recalculate=args.recalculate, use_cache=not args.no_cache,
+                                   concurrent=not args.serial, units=args.units,
+                                   share_concurrency=args.share_concurrency, history=not args.no_history,
+                                   exclude_rows=args.exclude_rows)
+    finally:
+        if args.record:
+            print(f"Recorded {_com_trace.save()} COM calls to {args.record}")
+        elif args.replay:
+            _com_trace.print_summary()
+        _com_trace = None
+    profiling.set_run_info(exit_code=exit_code)
+    if args.trace:
+        profiling.write_json_lines(args.trace, com_call_counters())
+        print(f"Profile trace appended to {args.trace}")
+    if args.profile:
+        profiling.print_profile(com_call_counters())
+    return exit_code
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
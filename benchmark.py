@@ -0,0 +1,308 @@
+"""Benchmark the report pipeline on synthetic workbooks, per backend, against saved baselines
+
+For every workbook size and backend this times:
+
+* open     - open the workbook and find the report worksheets
+* extract  - get_dynamic_values for the target month (metrics/s)
+* render   - extract_range + render_html_table of both report tables (cells/s)
+* format   - numfmt.format_value over the report and detail cells (cells/s)
+* bulk     - the bulk mail formatters (萬元/億元, #,###, percent) over the same cells (cells/s)
+* report   - build_report_html end to end on the open workbook
+* scan     - stream every row of both sheets (rows/s, headless backends only)
+
+Each measurement is repeated and the median kept. Results can be saved as a
+named baseline (JSON under ~/.autoEmail_cache/benchmarks) and later runs
+compared against it; a metric slower than the baseline by more than the
+tolerance counts as a regression and makes the run exit with status 1.
+
+python benchmark.py --sizes small,medium --save before
+python benchmark.py --sizes small,medium --compare before
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+import autoEmail
+import xlsx_reader
+from numfmt import format_value
+from sheet_block import get_com_call_total, reset_com_call_counts
+from snapshot import SnapshotCache
+from synthetic_workbook import generate_workbook, DETAIL_FIRST_ROW
+
+BENCHMARK_DIR = os.path.join(os.path.expanduser("~"), ".autoEmail_cache", "benchmarks")
+# name -> (detail rows, years of month columns)
+SIZES = {"small": (0, 1), "medium": (10000, 2), "large": (200000, 5)}
+BACKENDS = ("xlsx", "snapshot", "excel")
+FORMAT_SAMPLE_ROWS = 2000  # detail rows whose cells feed the format benchmark
+EXIT_REGRESSION = 1
+
+
+def workbook_for_size(size, rows, years, seed=1):
+    """Generate (once) the synthetic workbook for a size; returns its path"""
+    directory = os.path.join(BENCHMARK_DIR, "workbooks")
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{size}-r{rows}-y{years}-s{seed}.xlsx")
+    if not os.path.exists(path):
+        start_time = time.perf_counter()
+        generate_workbook(path, rows, years, seed)
+        print(f"Generated {os.path.basename(path)} in {time.perf_counter() - start_time:.1f} s")
+    return path
+
+
+class _Backend:
+    """Open workbooks one way and close them again"""
+
+    def __init__(self, name):
+        self.name = name
+        self.excel = None
+        self.snapshots = SnapshotCache(os.path.join(BENCHMARK_DIR, "snapshots")) if name == "snapshot" else None
+
+    def open(self, path):
+        if self.name == "xlsx":
+            return xlsx_reader.open_workbook(path)
+        if self.name == "snapshot":
+            return self.snapshots.open(path, autoEmail.REPORT_SHEETS)
+        if self.excel is None:
+            self.excel = autoEmail.win32com.client.Dispatch("Excel.Application")
+            self.excel.Visible = False
+            self.excel.DisplayAlerts = False
+        return self.excel.Workbooks.Open(os.path.abspath(path), ReadOnly=True)
+
+    def close(self, workbook):
+        workbook.Close(False)
+
+    def quit(self):
+        if self.excel is not None:
+            self.excel.Quit()
+            self.excel = None
+
+
+def available_backends(names):
+    """Drop backends this host cannot run (Excel needs pywin32)"""
+    backends = []
+    for name in names:
+        if name == "excel" and autoEmail.win32com is None:
+            print("Skipping excel backend: pywin32 is not installed")
+            continue
+        backends.append(name)
+    return backends
+
+
+def _time(func):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):  # the pipeline prints progress lines
+        result = func()
+    return (time.perf_counter() - start) * 1000, result
+
+
+def _format_cells(worksheet, range_address, detail_rows, month_count):
+    """(value, number format) pairs of a report table and the first detail rows"""
+    first_row, first_col, last_row, last_col = xlsx_reader.parse_range_address(range_address)
+    rows = list(range(first_row, last_row + 1)) + list(range(DETAIL_FIRST_ROW, DETAIL_FIRST_ROW + detail_rows))
+    cells = []
+    for row in rows:
+        for col in range(first_col, first_col + month_count + 2):
+            value, style = worksheet.cell(row, col)
+            if value is not None:
+                cells.append((value, worksheet.Parent.number_format(style)))
+    return cells
+
+
+def run_case(path, backend, target_month, repeats, rows, years):
+    """Time every metric for one workbook and backend; returns {metric: result}"""
+    samples = {name: [] for name in ("open", "extract", "render", "format", "bulk", "report", "scan")}
+    amounts = {}
+    range1, range2 = autoEmail.get_report_ranges(target_month)
+    reset_com_call_counts()
+    backend.close(backend.open(path))  # warm-up: builds the snapshot, fills the label index cache
+
+    for _ in range(repeats):
+        ms, workbook = _time(lambda: backend.open(path))
+        try:
+            ws_account, ws_platform = autoEmail.find_report_worksheets(workbook)
+            samples["open"].append(ms)
+            ms, values = _time(lambda: autoEmail.get_dynamic_values(ws_account, ws_platform, target_month))
+            samples["extract"].append(ms)
+            amounts["extract"] = len(values)
+
+            def render():
+                return [autoEmail.render_report_table(ws_account, range1),
+                        autoEmail.render_report_table(ws_platform, range2,
+                                                      exclude_rows=autoEmail.PLATFORM_EXCLUDED_ROWS)]
+            ms, _ = _time(render)
+            samples["render"].append(ms)
+            amounts["render"] = sum((last_row - first_row + 1) * (last_col - first_col + 1)
+                                    for first_row, first_col, last_row, last_col
+                                    in map(xlsx_reader.parse_range_address, (range1, range2)))
+
+            ms, _ = _time(lambda: autoEmail.build_report_html(ws_account, ws_platform, target_month))
+            samples["report"].append(ms)
+
+            if backend.name != "excel":
+                detail_rows = min(rows, FORMAT_SAMPLE_ROWS)
+                cells = (_format_cells(ws_account, range1, detail_rows, 12 * years)
+                         + _format_cells(ws_platform, range2, detail_rows, 12 * years))
+                ms, _ = _time(lambda: [format_value(value, code) for value, code in cells])
+                samples["format"].append(ms)
+                amounts["format"] = len(cells)
+
+                numbers = [value for value, _ in cells]
+                texts = [format_value(value, code) for value, code in cells]
+
+                def bulk_format():
+                    autoEmail.format_digital_account_numbers(numbers)
+                    autoEmail.format_platform_revenues(numbers)
+                    autoEmail.format_percentages_from_text(texts)
+                ms, _ = _time(bulk_format)
+                samples["bulk"].append(ms)
+                amounts["bulk"] = len(cells)
+        finally:
+            backend.close(workbook)
+
+        if backend.name != "excel":
+            def scan():
+                workbook = backend.open(path)
+                try:
+                    scanned = 0
+                    for sheet in autoEmail.find_report_worksheets(workbook):
+                        sheet.ensure_rows(sys.maxsize)
+                        scanned += len(sheet.rows)
+                    return scanned
+                finally:
+                    backend.close(workbook)
+            ms, scanned = _time(scan)
+            samples["scan"].append(ms)
+            amounts["scan"] = scanned
+
+    units = {"extract": "metrics/s", "render": "cells/s", "format": "cells/s", "bulk": "cells/s",
+             "scan": "rows/s"}
+    results = {}
+    for name, values in samples.items():
+        if not values:
+            continue
+        median = statistics.median(values)
+        result = {"median_ms": round(median, 3), "min_ms": round(min(values), 3)}
+        if name in units and median > 0:
+            result["throughput"] = round(amounts[name] / median * 1000, 1)
+            result["unit"] = units[name]
+        results[name] = result
+    results["com_calls"] = get_com_call_total()
+    return results
+
+
+def run_benchmarks(sizes, backends, target_month=12, repeats=5, seed=1):
+    """Benchmark every size x backend; returns the results document"""
+    # Keep the benchmark's label index entries out of the real cache file
+    autoEmail.LABEL_INDEX_CACHE_FILE = os.path.join(BENCHMARK_DIR, "label_index.json")
+    results = {}
+    for size in sizes:
+        rows, years = SIZES[size]
+        path = workbook_for_size(size, rows, years, seed)
+        for name in backends:
+            backend = _Backend(name)
+            try:
+                print(f"Benchmarking {size} ({rows} detail rows, {years} years) on {name} ...")
+                results[f"{size}/{name}"] = run_case(path, backend, target_month, repeats, rows, years)
+            finally:
+                backend.quit()
+    return {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "target_month": target_month,
+        "repeats": repeats,
+        "results": results,
+    }
+
+
+def print_results(document):
+    print(f"\n{'case':<20} {'metric':<8} {'median ms':>10} {'min ms':>10} {'throughput':>22}")
+    for case, metrics in document["results"].items():
+        for name, result in metrics.items():
+            if name == "com_calls":
+                continue
+            throughput = f"{result['throughput']:,.0f} {result['unit']}" if "throughput" in result else ""
+            print(f"{case:<20} {name:<8} {result['median_ms']:>10.2f} {result['min_ms']:>10.2f} {throughput:>22}")
+        print(f"{case:<20} backend calls: {metrics['com_calls']}")
+
+
+def baseline_path(name):
+    return name if name.endswith(".json") else os.path.join(BENCHMARK_DIR, f"{name}.json")
+
+
+def save_baseline(document, name):
+    path = baseline_path(name)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(document, f, ensure_ascii=False, indent=2)
+    print(f"Saved baseline {path}")
+
+
+def compare_with_baseline(document, name, tolerance=0.2):
+    """Print current vs baseline medians; returns the regressed (case, metric) pairs"""
+    with open(baseline_path(name), encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\nCompared with baseline {name} ({baseline['created']}, Python {baseline['python']})")
+    print(f"{'case':<20} {'metric':<8} {'baseline ms':>12} {'now ms':>10} {'change':>9}")
+    regressions = []
+    for case, metrics in document["results"].items():
+        for metric, result in metrics.items():
+            before = baseline["results"].get(case, {}).get(metric)
+            if metric == "com_calls" or not before or not before["median_ms"]:
+                continue
+            change = result["median_ms"] / before["median_ms"] - 1
+            flag = ""
+            if change > tolerance:
+                regressions.append((case, metric))
+                flag = "  REGRESSION"
+            print(f"{case:<20} {metric:<8} {before['median_ms']:>12.2f} {result['median_ms']:>10.2f} "
+                  f"{change * 100:>+8.1f}%{flag}")
+    if regressions:
+        print(f"{len(regressions)} metric(s) slower than the baseline by more than {tolerance:.0%}")
+    else:
+        print("No regressions")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark report extraction, formatting and rendering.")
+    parser.add_argument("--sizes", default="small,medium",
+                        help=f"comma separated sizes: {', '.join(SIZES)} (default: small,medium)")
+    parser.add_argument("--backends", default=",".join(BACKENDS),
+                        help="comma separated backends: xlsx, snapshot, excel (default: all available)")
+    parser.add_argument("--month", type=int, default=12, help="target month (default: 12)")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", metavar="NAME", help="save the results as a baseline")
+    parser.add_argument("--compare", metavar="NAME", help="compare with a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="slowdown allowed before a metric counts as a regression (default: 0.2)")
+    parser.add_argument("--json", metavar="FILE", help="also write the raw results to FILE")
+    args = parser.parse_args(argv)
+
+    sizes = [size.strip() for size in args.sizes.split(",") if size.strip()]
+    unknown = [size for size in sizes if size not in SIZES]
+    if unknown:
+        parser.error(f"unknown size(s): {', '.join(unknown)}")
+    backends = available_backends([name.strip() for name in args.backends.split(",") if name.strip()])
+
+    document = run_benchmarks(sizes, backends, args.month, args.repeats, args.seed)
+    print_results(document)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(document, f, ensure_ascii=False, indent=2)
+    if args.save:
+        save_baseline(document, args.save)
+    if args.compare and compare_with_baseline(document, args.compare, args.tolerance):
+        return EXIT_REGRESSION
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
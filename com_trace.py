@@ -0,0 +1,350 @@
+"""Record and replay the COM calls of a report run (Excel worksheets, Outlook mail, Word)
+
+RecordingProxy wraps an automation object and passes every attribute read,
+method call, assignment and iteration through to it, noting the call and
+its result in a Recorder: plain values as they are, objects as references
+to further proxies. A Player later stands in for the applications:
+ReplayProxy answers each call from the trace, optionally after a simulated
+latency, so a run can be repeated deterministically on a machine without
+Office (to count and time calls on Linux, say).
+
+Calls are matched on (object, kind, member, arguments) rather than on their
+position in the trace, each match taking the next recorded answer (the
+last one repeats once they run out). A run that makes fewer calls than the
+recording still replays, and Player.print_summary() shows recorded against
+replayed calls per member; a call the trace has no answer for raises
+ReplayMissing.
+
+Traces are gzip-compressed JSON lines, one [object, kind, member, args,
+result, seconds] list per call after a header line.
+
+python autoEmail.py -m 6 --record run.trace.gz                       (Windows desktop)
+python autoEmail.py -m 6 --replay run.trace.gz --replay-latency 2 --profile
+"""
+import gzip
+import json
+import time
+import base64
+import inspect
+import threading
+from collections import Counter, deque
+from datetime import datetime
+from decimal import Decimal
+
+TRACE_FORMAT = "autoEmail-com-trace"
+TRACE_VERSION = 1
+
+
+class ReplayMissing(LookupError):
+    """The replayed run made a call the trace has no answer for"""
+
+
+class ReplayedError(Exception):
+    """An exception the recorded call raised (COM errors and the like), raised again on replay"""
+
+
+def _encode(value):
+    """JSON form of an argument or plain result; None for objects that need a proxy"""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (tuple, list)):
+        return [_encode(item) for item in value]
+    if isinstance(value, (set, frozenset)):  # sorted, so the call keys do not depend on hash order
+        return {"set": sorted((_encode(item) for item in value), key=json.dumps)}
+    if isinstance(value, dict):
+        return {"dict": [[_encode(key), _encode(item)] for key, item in value.items()]}
+    if isinstance(value, (RecordingProxy, ReplayProxy)):
+        return {"ref": value._ref}
+    if isinstance(value, datetime):  # pywintypes.datetime too
+        return {"datetime": value.isoformat()}
+    if isinstance(value, Decimal):  # COM currency
+        return {"decimal": str(value)}
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {"bytes": base64.b64encode(bytes(value)).decode("ascii")}
+    return None
+
+
+def _is_plain(value):
+    """Results recorded as values; anything else (container subclasses too) gets a proxy"""
+    if type(value) in (tuple, list, set, frozenset):
+        return all(_is_plain(item) for item in value)
+    if type(value) is dict:
+        return all(_is_plain(key) and _is_plain(item) for key, item in value.items())
+    if isinstance(value, (tuple, list, set, frozenset, dict)):
+        return False
+    return value is None or _encode(value) is not None
+
+
+def _unwrap(value):
+    """Arguments as the real objects expect them (proxies replaced by their targets)"""
+    if isinstance(value, RecordingProxy):
+        return value._target
+    if isinstance(value, tuple):
+        return tuple(_unwrap(item) for item in value)
+    return value
+
+
+def _call_key(ref, kind, member, args=(), kwargs=None):
+    return json.dumps([ref, kind, member, [_encode(arg) for arg in args], _encode_kwargs(kwargs)],
+                      ensure_ascii=False)
+
+
+def _encode_kwargs(kwargs):
+    return {name: _encode(value) for name, value in sorted((kwargs or {}).items())}
+
+
+class RecordingProxy:
+    """Passes everything through to an automation object, noting each call in a Recorder"""
+
+    __slots__ = ("_target", "_recorder", "_ref")
+
+    def __init__(self, target, recorder, ref):
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_recorder", recorder)
+        object.__setattr__(self, "_ref", ref)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self._recorder.get(self, name)
+
+    def __setattr__(self, name, value):
+        self._recorder.set(self, name, value)
+
+    def __call__(self, *args, **kwargs):
+        return self._recorder.call(self, "", args, kwargs)
+
+    def __iter__(self):
+        return iter(self._recorder.iterate(self))
+
+
+class Recorder:
+    """Collects the calls made through RecordingProxies and saves them as a trace"""
+
+    replaying = False
+
+    def __init__(self, path):
+        self.path = path
+        self.events = []
+        self._lock = threading.Lock()
+        self._next_ref = 0
+
+    def root(self, name, factory):
+        """Proxy for a top-level object (an application), created by factory()"""
+        proxy = self._proxy(factory())
+        self._add(None, "root", name, [], {}, {"ref": proxy._ref}, 0.0)
+        return proxy
+
+    def _proxy(self, target):
+        with self._lock:
+            ref = self._next_ref
+            self._next_ref += 1
+        return RecordingProxy(target, self, ref)
+
+    def _add(self, ref, kind, member, args, kwargs, result, seconds):
+        event = [ref, kind, member, args, kwargs, result, round(seconds, 6)]
+        with self._lock:
+            self.events.append(event)
+
+    def _result(self, value):
+        """(JSON form, value handed back): objects become proxies"""
+        if _is_plain(value):
+            return _encode(value), value
+        proxy = self._proxy(value)
+        return {"ref": proxy._ref}, proxy
+
+    def _perform(self, proxy, kind, member, args, kwargs, action):
+        start_time = time.perf_counter()
+        try:
+            value = action()
+        except Exception as e:
+            self._add(proxy._ref, kind, member, [_encode(arg) for arg in args], _encode_kwargs(kwargs),
+                      {"error": [type(e).__name__, str(e)]}, time.perf_counter() - start_time)
+            raise
+        return value, time.perf_counter() - start_time
+
+    def get(self, proxy, name):
+        value, seconds = self._perform(proxy, "get", name, (), None, lambda: getattr(proxy._target, name))
+        if inspect.ismethod(value) or inspect.isbuiltin(value) or inspect.isfunction(value):
+            # A method: the call is what gets recorded
+            return lambda *args, **kwargs: self.call(proxy, name, args, kwargs)
+        encoded, value = self._result(value)
+        self._add(proxy._ref, "get", name, [], {}, encoded, seconds)
+        return value
+
+    def set(self, proxy, name, value):
+        _, seconds = self._perform(proxy, "set", name, (), None,
+                                   lambda: setattr(proxy._target, name, _unwrap(value)))
+        self._add(proxy._ref, "set", name, [], {}, None, seconds)
+
+    def call(self, proxy, member, args, kwargs):
+        def action():
+            target = getattr(proxy._target, member) if member else proxy._target
+            return target(*_unwrap(tuple(args)), **{name: _unwrap(value) for name, value in kwargs.items()})
+        value, seconds = self._perform(proxy, "call", member, args, kwargs, action)
+        encoded, value = self._result(value)
+        self._add(proxy._ref, "call", member, [_encode(arg) for arg in args], _encode_kwargs(kwargs),
+                  encoded, seconds)
+        return value
+
+    def iterate(self, proxy):
+        items, seconds = self._perform(proxy, "iter", "", (), None, lambda: list(proxy._target))
+        results = [self._result(item) for item in items]
+        self._add(proxy._ref, "iter", "", [], {}, [encoded for encoded, _ in results], seconds)
+        return [value for _, value in results]
+
+    def save(self):
+        """Write the trace; returns the number of calls recorded"""
+        with self._lock:
+            events = list(self.events)
+        with gzip.open(self.path, "wt", encoding="utf-8") as f:
+            f.write(json.dumps({"format": TRACE_FORMAT, "version": TRACE_VERSION,
+                                "created": datetime.now().isoformat(timespec="seconds"),
+                                "calls": len(events)}) + "\n")
+            for event in events:
+                f.write(json.dumps(event, ensure_ascii=False, separators=(",", ":")) + "\n")
+        return len(events)
+
+
+class ReplayProxy:
+    """Stands in for a recorded automation object, answering from the trace"""
+
+    __slots__ = ("_player", "_ref")
+
+    def __init__(self, player, ref):
+        object.__setattr__(self, "_player", player)
+        object.__setattr__(self, "_ref", ref)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self._player.get(self, name)
+
+    def __setattr__(self, name, value):
+        self._player.set(self, name, value)
+
+    def __call__(self, *args, **kwargs):
+        return self._player.call(self, "", args, kwargs)
+
+    def __iter__(self):
+        return iter(self._player.iterate(self))
+
+
+def parse_latency(text):
+    """'2' (ms per call), 'recorded' (the recorded durations) or 'Value=5,Text=5,1' (per member, then default)"""
+    if text is None:
+        return 0.0
+    if text == "recorded":
+        return text
+    latency = {}
+    for part in str(text).split(","):
+        member, _, milliseconds = part.strip().rpartition("=")
+        latency[member] = float(milliseconds) / 1000
+    return latency[""] if list(latency) == [""] else latency
+
+
+class Player:
+    """Answers calls from a saved trace, with a simulated latency per call"""
+
+    replaying = True
+
+    def __init__(self, path, latency=0.0):
+        self.path = path
+        self.latency = latency
+        self.answers = {}     # call key -> deque of (result, seconds)
+        self.methods = set()  # (ref, member) of recorded method calls
+        self.roots = {}       # application name -> deque of refs
+        self.recorded = Counter()
+        self.replayed = Counter()
+        self.simulated_seconds = 0.0
+        self._lock = threading.Lock()
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            if header.get("format") != TRACE_FORMAT or header.get("version") != TRACE_VERSION:
+                raise ValueError(f"Not a COM trace: {path}")
+            for line in f:
+                ref, kind, member, args, kwargs, result, seconds = json.loads(line)
+                if kind == "root":
+                    self.roots.setdefault(member, deque()).append(result["ref"])
+                    continue
+                key = json.dumps([ref, kind, member, args, kwargs], ensure_ascii=False)
+                self.answers.setdefault(key, deque()).append((result, seconds))
+                if kind == "call":
+                    self.methods.add((ref, member))
+                self.recorded[member or kind] += 1
+
+    def root(self, name, factory=None):
+        """The recorded application object (factory is never called: nothing real is started)"""
+        with self._lock:
+            refs = self.roots.get(name)
+            if not refs:
+                raise ReplayMissing(f"No {name} in the trace")
+            ref = refs.popleft() if len(refs) > 1 else refs[0]
+        return ReplayProxy(self, ref)
+
+    def _answer(self, key, member, kind):
+        with self._lock:
+            answers = self.answers.get(key)
+            if not answers:
+                raise ReplayMissing(f"No recorded answer for {key}")
+            result, seconds = answers.popleft() if len(answers) > 1 else answers[0]
+            self.replayed[member or kind] += 1
+            delay = self._delay(member, seconds)
+            self.simulated_seconds += delay
+        if delay:
+            time.sleep(delay)
+        return self._decode(result)
+
+    def _delay(self, member, seconds):
+        if self.latency == "recorded":
+            return seconds
+        if isinstance(self.latency, dict):
+            return self.latency.get(member, self.latency.get("", 0.0))
+        return self.latency
+
+    def _decode(self, value):
+        if isinstance(value, list):
+            return tuple(self._decode(item) for item in value)
+        if isinstance(value, dict):
+            if "ref" in value:
+                return ReplayProxy(self, value["ref"])
+            if "error" in value:
+                kind, message = value["error"]
+                if kind == "AttributeError":
+                    raise AttributeError(message)  # hasattr()/getattr() probes behave as recorded
+                raise ReplayedError(f"{kind}: {message}")
+            if "set" in value:
+                return set(self._decode(item) for item in value["set"])
+            if "dict" in value:
+                return {self._decode(key): self._decode(item) for key, item in value["dict"]}
+            if "datetime" in value:
+                return datetime.fromisoformat(value["datetime"])
+            if "decimal" in value:
+                return Decimal(value["decimal"])
+            if "bytes" in value:
+                return base64.b64decode(value["bytes"])
+        return value
+
+    def get(self, proxy, name):
+        key = _call_key(proxy._ref, "get", name)
+        if key not in self.answers and (proxy._ref, name) in self.methods:
+            return lambda *args, **kwargs: self.call(proxy, name, args, kwargs)
+        return self._answer(key, name, "get")
+
+    def set(self, proxy, name, value):
+        self._answer(_call_key(proxy._ref, "set", name), name, "set")
+
+    def call(self, proxy, member, args, kwargs):
+        return self._answer(_call_key(proxy._ref, "call", member, args, kwargs), member, "call")
+
+    def iterate(self, proxy):
+        return list(self._answer(_call_key(proxy._ref, "iter", ""), "", "iter"))
+
+    def print_summary(self):
+        """Recorded vs. replayed calls per member, and the latency that was simulated"""
+        print(f"{'member':<24} {'recorded':>9} {'replayed':>9}")
+        for member in sorted(set(self.recorded) | set(self.replayed),
+                             key=lambda member: -max(self.recorded[member], self.replayed[member])):
+            print(f"{member:<24} {self.recorded[member]:>9} {self.replayed[member]:>9}")
+        print(f"{'total':<24} {sum(self.recorded.values()):>9} {sum(self.replayed.values()):>9}"
+              f"  (simulated latency {self.simulated_seconds:.3f}s)")
@@ -0,0 +1,129 @@
+"""Cumulative metrics from monthly series: prefix sums over any month window, across years
+
+A MonthlySeries keeps one metric's monthly values with their running
+totals, indexed by absolute month (year * 12 + month - 1), so the sum over
+any window (year to date, a fiscal year starting in July, the last twelve
+months across a year end) is one subtraction. Adding or revising months
+only recomputes the totals from the first changed month on.
+
+Series are cached per source (a workbook path, or a unit of the metrics
+history) and metric, tagged with the version of the source they were read
+from: while the file is unchanged a later month only extends the series
+with its new month columns; a saved change starts the series over.
+"""
+import threading
+from collections import OrderedDict
+
+FISCAL_YEAR_START_MONTH = 1
+# Cached series kept in memory (least recently used dropped first): the session daemon and
+# --units runs see a new workbook path per unit and month
+SERIES_CACHE_LIMIT = 256
+
+
+def month_index(year, month):
+    return year * 12 + month - 1
+
+
+def fiscal_year_start(year, month, start_month=FISCAL_YEAR_START_MONTH):
+    """(year, month) the fiscal year containing year/month starts at"""
+    return (year, start_month) if month >= start_month else (year - 1, start_month)
+
+
+def rate(numerator, denominator):
+    """numerator / denominator unrounded, or None without a denominator (formatting rounds it once)"""
+    return numerator / denominator if denominator else None
+
+
+class MonthlySeries:
+    """Monthly values of one metric with their running totals"""
+
+    def __init__(self):
+        self.first = None   # absolute month of values[0]
+        self.values = []    # numbers, None for months without one
+        self.prefix = [0.0]  # prefix[i] = sum of values[:i]
+
+    def __len__(self):
+        return len(self.values)
+
+    def months_from(self, year, month):
+        """How many consecutive months from year/month on the series holds (0 if it starts later)"""
+        if self.first is None or self.first > month_index(year, month):
+            return 0
+        return max(self.first + len(self.values) - month_index(year, month), 0)
+
+    def update(self, year, month, values):
+        """Set consecutive months from year/month on; returns how many months changed"""
+        start = month_index(year, month)
+        if self.first is None:
+            self.first = start
+        elif start < self.first:
+            self.values[:0] = [None] * (self.first - start)
+            self.first = start
+            self.prefix = [0.0]
+        offset = start - self.first
+        if offset > len(self.values):
+            self.values.extend([None] * (offset - len(self.values)))
+        changed = 0
+        changed_from = len(self.prefix) - 1  # months the totals do not cover yet (added in front or as a gap)
+        for position, value in enumerate(values, offset):
+            number = value if type(value) in (int, float) else None
+            if position < len(self.values):
+                if self.values[position] == number:
+                    continue
+                self.values[position] = number
+            else:
+                self.values.append(number)
+            changed += 1
+            changed_from = min(changed_from, position)
+        if changed_from < len(self.values):
+            self._recompute(changed_from)
+        return changed
+
+    def _recompute(self, start):
+        del self.prefix[start + 1:]
+        total = self.prefix[start]
+        for value in self.values[start:]:
+            total += value or 0.0
+            self.prefix.append(total)
+
+    def total(self, start, end):
+        """Sum over the months start..end, both (year, month) and inclusive; months without a value add 0"""
+        if self.first is None:
+            return 0.0
+        first = max(month_index(*start) - self.first, 0)
+        last = min(month_index(*end) - self.first, len(self.values) - 1)
+        if last < first:
+            return 0.0
+        return self.prefix[last + 1] - self.prefix[first]
+
+    def year_to_date(self, year, month, start_month=FISCAL_YEAR_START_MONTH):
+        """Sum from the start of the fiscal year through year/month"""
+        return self.total(fiscal_year_start(year, month, start_month), (year, month))
+
+    def trailing(self, year, month, months=12):
+        """Sum over the `months` months ending with year/month"""
+        start = month_index(year, month) - months + 1
+        return self.total((start // 12, start % 12 + 1), (year, month))
+
+
+_series_cache = OrderedDict()  # (source, metric key) -> (source version, MonthlySeries), oldest use first
+# Held while updating and querying cached series (sheets are extracted in parallel threads)
+series_lock = threading.RLock()
+
+
+def cached_series(source, key, version=None):
+    """The cached series of one metric from one source (created empty the first time)
+
+    version identifies the content the values come from (e.g. the file's
+    size, mtime and hash); a series cached for another version is replaced
+    by an empty one, so only one version per source and metric is kept.
+    Past SERIES_CACHE_LIMIT series the least recently used ones are dropped.
+    """
+    with series_lock:
+        cached = _series_cache.get((source, key))
+        if cached is None or cached[0] != version:
+            cached = _series_cache[(source, key)] = (version, MonthlySeries())
+        _series_cache.move_to_end((source, key))
+        while len(_series_cache) > SERIES_CACHE_LIMIT:
+            _series_cache.popitem(last=False)
+        return cached[1]
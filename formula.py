@@ -0,0 +1,541 @@
+"""Local evaluation of the worksheet formulas the report depends on (no Excel)
+
+Covers the subset the statistics sheets use: cell and range references
+(optionally sheet-qualified), + - * / ^ % & and comparisons, SUM and a few
+other aggregate functions, IF and IFERROR. Formulas are parsed once into
+small tuple trees and evaluated on demand with memoization.
+
+FormulaEngine keeps a dependency graph (cell -> formula cells reading it),
+so when a newer save of the workbook arrives, e.g. with a month column
+filled in, only the formulas that transitively depend on the changed cells
+are recomputed (watch mode carries the engine from one save to the next).
+"""
+import re
+from collections import Counter, deque
+
+from numfmt import format_general
+from xlsx_reader import column_to_index, index_to_column
+
+ERROR_CODES = ("#NULL!", "#DIV/0!", "#VALUE!", "#REF!", "#NAME?", "#NUM!", "#N/A")
+
+
+class ExcelError:
+    """An Excel error value such as #DIV/0!"""
+
+    def __init__(self, code):
+        self.code = code
+
+    def __eq__(self, other):
+        return isinstance(other, ExcelError) and other.code == self.code
+
+    def __hash__(self):
+        return hash(self.code)
+
+    def __repr__(self):
+        return f"ExcelError({self.code!r})"
+
+    def __str__(self):
+        return self.code
+
+
+class FormulaSyntaxError(ValueError):
+    """A formula uses syntax or functions outside the supported subset"""
+
+
+DIV0 = ExcelError("#DIV/0!")
+VALUE = ExcelError("#VALUE!")
+NAME = ExcelError("#NAME?")
+REF = ExcelError("#REF!")
+NUM = ExcelError("#NUM!")
+
+TOKEN_RE = re.compile(r"""
+    (?P<ws>\s+)
+  | (?P<string>"(?:[^"]|"")*")
+  | (?P<error>\#(?:NULL!|DIV/0!|VALUE!|REF!|NAME\?|NUM!|N/A))
+  | (?P<ref>(?:(?P<sheet>'(?:[^']|'')+'|[A-Za-z_\u0080-\uffff][\w.\u0080-\uffff]*)!)?
+            \$?[A-Za-z]{1,3}\$?\d+(?::\$?[A-Za-z]{1,3}\$?\d+)?)(?![\w(])
+  | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<func>[A-Za-z_][\w.]*)\s*\(
+  | (?P<bool>TRUE|FALSE)(?![\w(])
+  | (?P<op><=|>=|<>|[-+*/^&=<>%(),])
+""", re.VERBOSE | re.IGNORECASE)
+
+CELL_RE = re.compile(r"(\$?)([A-Za-z]{1,3})(\$?)(\d+)")
+SHARED_REF_RE = re.compile(r"""("(?:[^"]|"")*"|'(?:[^']|'')*'!)|(?<![\w.$])(\$?)([A-Za-z]{1,3})(\$?)(\d+)(?![\w(!])""")
+COMPARISONS = ("=", "<>", "<", ">", "<=", ">=")
+
+
+def shift_formula(text, row_offset, col_offset):
+    """Translate the relative references of a shared formula to another cell"""
+    def shift(match):
+        if match.group(1):
+            return match.group(1)  # string literal or quoted sheet name
+        col_abs, col, row_abs, row = match.group(2, 3, 4, 5)
+        col_index = column_to_index(col) + (0 if col_abs else col_offset)
+        row_index = int(row) + (0 if row_abs else row_offset)
+        return f"{col_abs}{index_to_column(col_index)}{row_abs}{row_index}"
+    return SHARED_REF_RE.sub(shift, text)
+
+
+def _tokenize(text):
+    tokens = []
+    position = 0
+    while position < len(text):
+        match = TOKEN_RE.match(text, position)
+        if match is None:
+            raise FormulaSyntaxError(f"Unexpected character at {position}: {text!r}")
+        position = match.end()
+        kind = match.lastgroup if match.lastgroup != "sheet" else "ref"
+        if kind == "ws":
+            continue
+        if kind == "ref":
+            tokens.append(("ref", match.group("ref")))
+        elif kind == "func":
+            tokens.append(("func", match.group("func").upper()))
+        else:
+            tokens.append((kind, match.group(kind)))
+    return tokens
+
+
+def _parse_reference(text, default_sheet):
+    sheet = default_sheet
+    if "!" in text:
+        sheet, text = text.rsplit("!", 1)
+        if sheet.startswith("'"):
+            sheet = sheet[1:-1].replace("''", "'")
+    cells = []
+    for part in text.split(":"):
+        _, col, _, row = CELL_RE.fullmatch(part).groups()
+        cells.append((int(row), column_to_index(col)))
+    if len(cells) == 1:
+        return ("ref", sheet, cells[0][0], cells[0][1])
+    (row1, col1), (row2, col2) = cells
+    return ("range", sheet, min(row1, row2), min(col1, col2), max(row1, row2), max(col1, col2))
+
+
+class _Parser:
+    """Recursive descent parser producing nested tuples"""
+
+    def __init__(self, text, sheet):
+        self.tokens = _tokenize(text)
+        self.position = 0
+        self.sheet = sheet
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def take(self, value=None):
+        token = self.peek()
+        if value is not None and token != ("op", value):
+            raise FormulaSyntaxError(f"Expected {value!r}, found {token[1]!r}")
+        self.position += 1
+        return token
+
+    def parse(self):
+        tree = self.comparison()
+        if self.position != len(self.tokens):
+            raise FormulaSyntaxError(f"Unexpected {self.peek()[1]!r}")
+        return tree
+
+    def _binary(self, operators, operand):
+        tree = operand()
+        while self.peek()[0] == "op" and self.peek()[1] in operators:
+            operator = self.take()[1]
+            tree = ("bin", operator, tree, operand())
+        return tree
+
+    def comparison(self):
+        return self._binary(COMPARISONS, self.concat)
+
+    def concat(self):
+        return self._binary(("&",), self.additive)
+
+    def additive(self):
+        return self._binary(("+", "-"), self.multiplicative)
+
+    def multiplicative(self):
+        return self._binary(("*", "/"), self.power)
+
+    def power(self):
+        return self._binary(("^",), self.percent)
+
+    def percent(self):
+        tree = self.unary()
+        while self.peek() == ("op", "%"):
+            self.take()
+            tree = ("pct", tree)
+        return tree
+
+    def unary(self):
+        if self.peek() == ("op", "-"):
+            self.take()
+            return ("neg", self.unary())
+        if self.peek() == ("op", "+"):
+            self.take()
+            return self.unary()
+        return self.primary()
+
+    def primary(self):
+        kind, value = self.take()
+        if kind == "number":
+            return ("const", float(value))
+        if kind == "string":
+            return ("const", value[1:-1].replace('""', '"'))
+        if kind == "bool":
+            return ("const", value.upper() == "TRUE")
+        if kind == "error":
+            return ("const", ExcelError(value.upper()))
+        if kind == "ref":
+            return _parse_reference(value, self.sheet)
+        if kind == "func":
+            name = value[6:] if value.startswith("_XLFN.") else value
+            if name not in FUNCTIONS:
+                raise FormulaSyntaxError(f"Unsupported function {name}")
+            args = []
+            if self.peek() != ("op", ")"):
+                args.append(self.comparison())
+                while self.peek() == ("op", ","):
+                    self.take()
+                    args.append(self.comparison())
+            self.take(")")
+            return ("call", name, args)
+        if (kind, value) == ("op", "("):
+            tree = self.comparison()
+            self.take(")")
+            return tree
+        raise FormulaSyntaxError(f"Unexpected {value!r}")
+
+
+def parse_formula(text, sheet):
+    """Parse formula text (without the leading '=') on `sheet` into a tuple tree"""
+    return _Parser(text.lstrip("="), sheet).parse()
+
+
+def formula_references(tree):
+    """Yield the ('ref', ...) and ('range', ...) nodes of a parsed formula"""
+    if tree[0] in ("ref", "range"):
+        yield tree
+    elif tree[0] in ("neg", "pct"):
+        yield from formula_references(tree[1])
+    elif tree[0] == "bin":
+        yield from formula_references(tree[2])
+        yield from formula_references(tree[3])
+    elif tree[0] == "call":
+        for arg in tree[2]:
+            yield from formula_references(arg)
+
+
+def referenced_sheets(text, sheet):
+    """Names of the sheets a formula's references point to (its own sheet for unqualified ones)
+
+    Only tokenizes, so formulas outside the supported subset are covered
+    too; text that does not even tokenize falls back to its sheet-qualified
+    references alone.
+    """
+    try:
+        references = [value for kind, value in _tokenize(text.lstrip("=")) if kind == "ref"]
+    except FormulaSyntaxError:
+        references = [match.group("ref") for match in TOKEN_RE.finditer(text) if match.group("sheet")]
+    names = set()
+    for reference in references:
+        if "!" in reference:
+            name = reference.rsplit("!", 1)[0]
+            names.add(name[1:-1].replace("''", "'") if name.startswith("'") else name)
+        else:
+            names.add(sheet)
+    return names
+
+
+def _to_number(value):
+    """Coerce a value to a number the way Excel arithmetic does"""
+    if isinstance(value, ExcelError):
+        return value
+    if value is None:
+        return 0.0
+    if isinstance(value, bool):
+        return float(value)
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value.strip().replace(",", ""))
+    except ValueError:
+        return VALUE
+
+
+def _to_text(value):
+    return format_general(value)
+
+
+def _compare(operator, left, right):
+    # Excel orders numbers < text < booleans; text compares case-insensitively
+    def key(value):
+        if value is None:
+            value = 0.0
+        if isinstance(value, bool):
+            return (2, value)
+        if isinstance(value, (int, float)):
+            return (0, value)
+        return (1, str(value).lower())
+    left, right = key(left), key(right)
+    return {"=": left == right, "<>": left != right, "<": left < right,
+            ">": left > right, "<=": left <= right, ">=": left >= right}[operator]
+
+
+def _arithmetic(operator, left, right):
+    left, right = _to_number(left), _to_number(right)
+    if isinstance(left, ExcelError):
+        return left
+    if isinstance(right, ExcelError):
+        return right
+    if operator == "+":
+        return left + right
+    if operator == "-":
+        return left - right
+    if operator == "*":
+        return left * right
+    if operator == "/":
+        return DIV0 if right == 0 else left / right
+    try:
+        result = left ** right
+    except (OverflowError, ZeroDivisionError):
+        return NUM
+    return NUM if isinstance(result, complex) else float(result)
+
+
+def _numbers(args):
+    """Numbers of aggregate arguments: text/booleans inside ranges are skipped"""
+    numbers = []
+    for arg in args:
+        if isinstance(arg, list):
+            for value in arg:
+                if isinstance(value, ExcelError):
+                    return value
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    numbers.append(float(value))
+        else:
+            number = _to_number(arg)
+            if isinstance(number, ExcelError):
+                return number
+            numbers.append(number)
+    return numbers
+
+
+def _aggregate(function):
+    def call(args):
+        numbers = _numbers(args)
+        return numbers if isinstance(numbers, ExcelError) else function(numbers)
+    return call
+
+
+def _round(args):
+    if len(args) != 2:
+        return VALUE
+    number, digits = _to_number(args[0]), _to_number(args[1])
+    if isinstance(number, ExcelError):
+        return number
+    if isinstance(digits, ExcelError):
+        return digits
+    return float(round(number, int(digits)))
+
+
+def _abs(args):
+    number = _to_number(args[0]) if len(args) == 1 else VALUE
+    return number if isinstance(number, ExcelError) else abs(number)
+
+
+# Functions whose arguments are all evaluated up front; IF and IFERROR are lazy
+FUNCTIONS = {
+    "SUM": _aggregate(sum),
+    "AVERAGE": _aggregate(lambda numbers: sum(numbers) / len(numbers) if numbers else DIV0),
+    "MIN": _aggregate(lambda numbers: min(numbers) if numbers else 0.0),
+    "MAX": _aggregate(lambda numbers: max(numbers) if numbers else 0.0),
+    "COUNT": _aggregate(lambda numbers: float(len(numbers))),
+    "ROUND": _round,
+    "ABS": _abs,
+    "IF": None,
+    "IFERROR": None,
+}
+
+
+class FormulaEngine:
+    """Evaluate a workbook's formulas locally, recomputing only what changed
+
+    Works on any workbook exposing worksheet(name) whose worksheets provide
+    ensure_rows(), raw_cell_value(row, col), formulas and shared_formulas
+    (the headless xlsx_reader backend). Formulas are parsed the first time
+    they are evaluated, so sheets are only streamed as far as the cells
+    asked for and their precedents reach.
+
+    rebind() moves the engine to a newer save of the workbook: the input
+    cells read so far are compared with the new file, and only the formulas
+    that transitively depend on changed cells (a month column being filled
+    in, say) lose their memoized results.
+    """
+
+    def __init__(self, workbook):
+        self.workbook = workbook
+        self.trees = {}          # (sheet, row, col) -> (formula text, parsed tree or None when unsupported)
+        self.dependents = {}     # (sheet, row, col) -> formula cells reading that cell
+        self.values = {}         # memoized results of formula cells
+        self.inputs = {}         # input cells read so far -> value
+        self.stats = Counter()
+        self._evaluating = set()
+
+    @staticmethod
+    def _formula_source(worksheet, row, col):
+        """Formula text of a cell (shared formulas translated), None when it holds no formula"""
+        if worksheet is None:
+            return None
+        worksheet.ensure_rows(row)
+        source = worksheet.formulas.get((row, col))
+        if isinstance(source, tuple):  # follower of a shared formula (its master comes first)
+            master_row, master_col, master_text = worksheet.shared_formulas[source[1]]
+            source = shift_formula(master_text, row - master_row, col - master_col)
+        return source
+
+    def _tree(self, key):
+        """Parsed formula of a cell: False without a formula, None when it is unsupported"""
+        if key in self.trees:
+            return self.trees[key][1]
+        sheet, row, col = key
+        source = self._formula_source(self.workbook.worksheet(sheet), row, col)
+        if source is None:
+            return False
+        try:
+            tree = parse_formula(source, sheet)
+        except (FormulaSyntaxError, AttributeError) as e:
+            self.stats["unsupported"] += 1
+            print(f"Formula at {sheet}!{index_to_column(col)}{row} not evaluated: {e}")
+            tree = None
+        self.trees[key] = (source, tree)
+        if tree is not None:
+            for reference in formula_references(tree):
+                for cell in self._reference_cells(reference):
+                    self.dependents.setdefault(cell, set()).add(key)
+        return tree
+
+    @staticmethod
+    def _reference_cells(reference):
+        if reference[0] == "ref":
+            return [reference[1:]]
+        _, sheet, row1, col1, row2, col2 = reference
+        return [(sheet, row, col) for row in range(row1, row2 + 1) for col in range(col1, col2 + 1)]
+
+    def has_formula(self, sheet, row, col):
+        return self._tree((sheet, row, col)) is not False
+
+    def value(self, sheet, row, col):
+        """Value of a cell, evaluating (and memoizing) it when it holds a formula"""
+        key = (sheet, row, col)
+        tree = self._tree(key)
+        if tree is False or tree is None:
+            if key not in self.inputs:
+                self.inputs[key] = self._input_value(sheet, row, col)
+            return self.inputs[key]
+        if key in self.values:
+            return self.values[key]
+        if key in self._evaluating:
+            return REF  # circular reference
+        self._evaluating.add(key)
+        try:
+            result = self._evaluate(tree)
+            if isinstance(result, list):
+                result = VALUE  # a bare multi-cell range in a single cell
+        finally:
+            self._evaluating.discard(key)
+        self.values[key] = result
+        self.stats["evaluated"] += 1
+        return result
+
+    def _input_value(self, sheet, row, col):
+        worksheet = self.workbook.worksheet(sheet)
+        if worksheet is None:
+            return REF
+        value = worksheet.raw_cell_value(row, col)
+        if isinstance(value, str) and value in ERROR_CODES:
+            return ExcelError(value)
+        return value
+
+    def _evaluate(self, tree):
+        kind = tree[0]
+        if kind == "const":
+            return tree[1]
+        if kind == "ref":
+            value = self.value(*tree[1:])
+            return 0.0 if value is None else value
+        if kind == "range":
+            return [self.value(*cell) for cell in self._reference_cells(tree)]
+        if kind == "neg":
+            value = _to_number(self._scalar(tree[1]))
+            return value if isinstance(value, ExcelError) else -value
+        if kind == "pct":
+            value = _to_number(self._scalar(tree[1]))
+            return value if isinstance(value, ExcelError) else value / 100
+        if kind == "bin":
+            operator, left, right = tree[1], self._scalar(tree[2]), self._scalar(tree[3])
+            if operator in COMPARISONS or operator == "&":
+                for value in (left, right):
+                    if isinstance(value, ExcelError):
+                        return value
+                if operator == "&":
+                    return _to_text(left) + _to_text(right)
+                return _compare(operator, left, right)
+            return _arithmetic(operator, left, right)
+        return self._call(tree[1], tree[2])
+
+    def _scalar(self, tree):
+        value = self._evaluate(tree)
+        return VALUE if isinstance(value, list) else value
+
+    def _call(self, name, args):
+        if name == "IFERROR":
+            if len(args) != 2:
+                return VALUE
+            value = self._scalar(args[0])
+            return self._scalar(args[1]) if isinstance(value, ExcelError) else value
+        if name == "IF":
+            if not 1 <= len(args) <= 3:
+                return VALUE
+            condition = self._scalar(args[0])
+            if isinstance(condition, ExcelError):
+                return condition
+            if isinstance(condition, str):
+                return VALUE
+            if condition:
+                return self._scalar(args[1]) if len(args) > 1 else True
+            return self._scalar(args[2]) if len(args) > 2 else False
+        return FUNCTIONS[name]([self._evaluate(arg) for arg in args])
+
+    def rebind(self, workbook):
+        """Carry the results over to a newer save of the workbook; returns how many were dropped
+
+        Input cells read so far are re-read from the new file, and formulas
+        whose text changed are parsed again; only formulas depending on either
+        are recomputed when next asked for.
+        """
+        self.workbook = workbook
+        changed = []
+        for key, value in list(self.inputs.items()):
+            if self._formula_source(workbook.worksheet(key[0]), key[1], key[2]) is not None:
+                del self.inputs[key]  # the cell holds a formula now
+                changed.append(key)
+                continue
+            new_value = self._input_value(*key)
+            if type(new_value) is not type(value) or new_value != value:
+                self.inputs[key] = new_value
+                changed.append(key)
+        for key, (source, _) in list(self.trees.items()):
+            if self._formula_source(workbook.worksheet(key[0]), key[1], key[2]) != source:
+                del self.trees[key]
+                changed.append(key)
+
+        dirty = set(changed)
+        queue = deque(changed)
+        while queue:
+            for dependent in self.dependents.get(queue.popleft(), ()):
+                if dependent not in dirty:
+                    dirty.add(dependent)
+                    queue.append(dependent)
+        dropped = sum(self.values.pop(key, None) is not None for key in dirty)
+        self.stats["invalidated"] += dropped
+        return dropped
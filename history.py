@@ -0,0 +1,225 @@
+"""Local history of the extracted report metrics, for month-over-month and year-over-year figures
+
+Every run records its metrics in a SQLite file keyed by (year, month, unit,
+metric), so comparisons with the previous month or the same month last year
+are a single indexed query instead of opening older workbooks on the share.
+Rates are stored both as their display text and as a number (111.7% -> 1.117).
+A batch run over months 1-12 of the latest workbook fills a whole year.
+metric_series() turns a metric's recorded months into prefix sums
+(cumulative.py) for sums over any window, across years.
+
+python history.py --year 2026 --month 6 [--unit 台北] [--trend digital_actual]
+python history.py --year 2026 --month 6 --window platform_actual [--fiscal-start 7]
+"""
+import os
+import argparse
+import sqlite3
+from datetime import datetime
+
+from cumulative import MonthlySeries, FISCAL_YEAR_START_MONTH, fiscal_year_start, series_lock
+
+HISTORY_DB = os.path.join(os.path.expanduser("~"), ".autoEmail_cache", "history.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metrics (
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    unit TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value REAL,
+    text TEXT,
+    source TEXT,
+    recorded_at TEXT NOT NULL,
+    PRIMARY KEY (unit, metric, year, month)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS metrics_by_period ON metrics (year, month, unit);
+"""
+
+
+def open_history(db_path=HISTORY_DB):
+    """Open (creating if needed) the history database"""
+    directory = os.path.dirname(db_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    connection = sqlite3.connect(db_path, timeout=30)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def metric_number(value):
+    """Numeric form of a metric: numbers as they are, '111.7%' as 1.117, anything else None"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        text = value.strip().replace(",", "")
+        try:
+            if text.endswith("%"):
+                return float(text[:-1]) / 100
+            return float(text)
+        except ValueError:
+            return None
+    return None
+
+
+def previous_month(year, month):
+    return (year - 1, 12) if month == 1 else (year, month - 1)
+
+
+def record_metrics(values, year, month, unit="", source=None, db_path=HISTORY_DB):
+    """Store (or replace) one period's metrics; returns how many were written"""
+    recorded_at = datetime.now().isoformat(timespec="seconds")
+    rows = [(year, month, unit, metric, metric_number(value), value if isinstance(value, str) else None,
+             source, recorded_at) for metric, value in values.items()]
+    try:
+        connection = open_history(db_path)
+        try:
+            with connection:
+                connection.executemany("INSERT OR REPLACE INTO metrics VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        finally:
+            connection.close()
+    except sqlite3.Error as e:
+        print(f"Warning: could not record metrics history: {e}")
+        return 0
+    return len(rows)
+
+
+def compare_metrics(values, year, month, unit="", db_path=HISTORY_DB):
+    """Deltas of the current values against the previous month and the same month last year
+
+    Returns {"<metric>.mom": change, "<metric>.mom_pct": relative change,
+    "<metric>.yoy": ..., "<metric>.yoy_pct": ...} for the metrics that have
+    history (one query for both periods).
+    """
+    previous = previous_month(year, month)
+    stored = {}
+    try:
+        connection = open_history(db_path)
+        try:
+            rows = connection.execute(
+                "SELECT year, month, metric, value FROM metrics WHERE unit = ? "
+                "AND ((year = ? AND month = ?) OR (year = ? AND month = ?))",
+                (unit, previous[0], previous[1], year - 1, month)).fetchall()
+        finally:
+            connection.close()
+    except sqlite3.Error as e:
+        print(f"Warning: could not read metrics history: {e}")
+        return {}
+    for row_year, row_month, metric, value in rows:
+        stored[(row_year, row_month, metric)] = value
+
+    deltas = {}
+    for metric, value in values.items():
+        current = metric_number(value)
+        if current is None:
+            continue
+        for suffix, (period_year, period_month) in (("mom", previous), ("yoy", (year - 1, month))):
+            before = stored.get((period_year, period_month, metric))
+            if before is None:
+                continue
+            deltas[f"{metric}.{suffix}"] = current - before
+            if before:
+                deltas[f"{metric}.{suffix}_pct"] = current / before - 1
+    return deltas
+
+
+def metric_trend(metric, unit="", year=None, month=None, months=12, db_path=HISTORY_DB):
+    """The last `months` recorded values of a metric up to year/month: [(year, month, value)]"""
+    year = year or datetime.now().year
+    month = month or 12
+    connection = open_history(db_path)
+    try:
+        rows = connection.execute(
+            "SELECT year, month, value FROM metrics WHERE unit = ? AND metric = ? "
+            "AND year * 12 + month <= ? ORDER BY year DESC, month DESC LIMIT ?",
+            (unit, metric, year * 12 + month, months)).fetchall()
+    finally:
+        connection.close()
+    return rows[::-1]
+
+
+_history_series = {}  # (db path, unit, metric) -> (MonthlySeries, latest recorded_at read)
+
+
+def metric_series(metric, unit="", db_path=HISTORY_DB):
+    """The recorded monthly values of a metric as prefix sums (cumulative.MonthlySeries)
+
+    Series stay cached; later calls only read the rows recorded since, so
+    a new month extends the series and a re-recorded month revises it.
+    """
+    key = (db_path, unit, metric)
+    with series_lock:
+        series, loaded_at = _history_series.get(key, (None, ""))
+        connection = open_history(db_path)
+        try:
+            rows = connection.execute(
+                "SELECT year, month, value, recorded_at FROM metrics WHERE unit = ? AND metric = ? "
+                "AND recorded_at >= ? ORDER BY year, month", (unit, metric, loaded_at)).fetchall()
+        finally:
+            connection.close()
+        series = series or MonthlySeries()
+        for row_year, row_month, value, recorded_at in rows:
+            series.update(row_year, row_month, [value])
+            loaded_at = max(loaded_at, recorded_at)
+        _history_series[key] = (series, loaded_at)
+        return series
+
+
+def print_window(metric, year, month, unit="", fiscal_start=FISCAL_YEAR_START_MONTH, db_path=HISTORY_DB):
+    """Print a metric's fiscal year-to-date and trailing twelve-month sums from the history"""
+    series = metric_series(metric, unit, db_path)
+    start_year, start_month = fiscal_year_start(year, month, fiscal_start)
+    print(f"{metric}{' ' + unit if unit else ''}")
+    print(f"  {start_year}/{start_month:02d}-{year}/{month:02d} (year to date): "
+          f"{series.year_to_date(year, month, fiscal_start):,.0f}")
+    print(f"  last 12 months to {year}/{month:02d}: {series.trailing(year, month):,.0f}")
+    if series.first is not None:
+        last_year, last_month = divmod(series.first + len(series) - 1, 12)
+        if (last_year, last_month + 1) < (year, month):
+            print(f"  (history ends at {last_year}/{last_month + 1:02d})")
+
+
+def print_history(year, month, unit="", db_path=HISTORY_DB):
+    """Print one period's metrics with their MoM/YoY changes"""
+    connection = open_history(db_path)
+    try:
+        rows = connection.execute(
+            "SELECT metric, value, text FROM metrics WHERE year = ? AND month = ? AND unit = ? ORDER BY metric",
+            (year, month, unit)).fetchall()
+    finally:
+        connection.close()
+    if not rows:
+        print(f"No history for {year}/{month:02d}{' ' + unit if unit else ''}")
+        return
+    values = {metric: text if text is not None else value for metric, value, text in rows}
+    deltas = compare_metrics(values, year, month, unit, db_path)
+    print(f"{year}/{month:02d}{' ' + unit if unit else ''}")
+    print(f"{'metric':<32} {'value':>16} {'MoM':>10} {'YoY':>10}")
+    for metric, value in values.items():
+        changes = []
+        for suffix in ("mom", "yoy"):
+            change = deltas.get(f"{metric}.{suffix}_pct")
+            changes.append(f"{change:+.1%}" if change is not None else "-")
+        shown = value if isinstance(value, str) else f"{value:,.0f}"
+        print(f"{metric:<32} {shown:>16} {changes[0]:>10} {changes[1]:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show recorded report metrics with MoM/YoY changes.")
+    parser.add_argument("--year", "-y", type=int, default=datetime.now().year)
+    parser.add_argument("--month", "-m", type=int, required=True)
+    parser.add_argument("--unit", default="", help="unit name (default: the main workbook)")
+    parser.add_argument("--trend", metavar="METRIC", help="also print the last 12 months of a metric")
+    parser.add_argument("--window", metavar="METRIC",
+                        help="also print the year-to-date and trailing 12-month sums of a metric")
+    parser.add_argument("--fiscal-start", type=int, default=FISCAL_YEAR_START_MONTH, choices=range(1, 13),
+                        metavar="MONTH", help="first month of the fiscal year for --window")
+    parser.add_argument("--db", default=HISTORY_DB)
+    args = parser.parse_args()
+    print_history(args.year, args.month, args.unit, args.db)
+    if args.window:
+        print_window(args.window, args.year, args.month, args.unit, args.fiscal_start, args.db)
+    if args.trend:
+        for year, month, value in metric_trend(args.trend, args.unit, args.year, args.month, db_path=args.db):
+            print(f"  {year}/{month:02d}: {value:,.4g}" if value is not None else f"  {year}/{month:02d}: -")
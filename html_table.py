@@ -0,0 +1,353 @@
+"""Render worksheet ranges as HTML tables (no Excel clipboard, Word or Outlook paste)
+
+extract_range() pulls everything the table needs out of a worksheet in one
+go (values, display text, fonts, fills, borders, merged cells and column
+widths) and render_html_table() turns that into a self-contained <table>
+fragment that can be dropped straight into the mail body.
+
+The mail uses the compact form: each distinct cell style becomes one CSS
+class instead of a style attribute repeated on every cell, which keeps the
+message several times smaller. html_size_report() measures the difference.
+"""
+import re
+import html
+
+from profiling import timed
+from sheet_block import read_block, count_com_call
+from xlsx_reader import index_to_column, column_to_index
+
+# Excel COM constants used when reading formats from a live worksheet
+XL_NONE = -4142
+XL_BORDER_SIDES = {"left": 7, "top": 8, "bottom": 9, "right": 10}
+XL_BORDER_WEIGHTS = {1: "1px solid", 2: "1px solid", -4138: "2px solid", 4: "3px solid"}
+XL_HORIZONTAL_ALIGN = {-4108: "center", -4131: "left", -4152: "right", -4130: "justify"}
+
+
+class ExtractedRange:
+    """Everything needed to render a worksheet range, held in memory"""
+
+    def __init__(self, first_row, first_col, values, texts, formats, merges, column_widths):
+        self.first_row = first_row
+        self.first_col = first_col
+        self.values = values            # tuple of row tuples of raw values
+        self.texts = texts              # tuple of row tuples of display text
+        self.formats = formats          # list of row lists of CSS dicts
+        self.merges = merges            # [(first_row, first_col, last_row, last_col)] clipped to the range
+        self.column_widths = column_widths  # Excel widths (characters), one per column
+
+    @property
+    def row_count(self):
+        return len(self.values)
+
+    @property
+    def column_count(self):
+        return len(self.column_widths)
+
+    def view(self, exclude_rows=(), exclude_columns=()):
+        """A RangeView of this range with some rows/columns masked out"""
+        return RangeView(self, exclude_rows, exclude_columns)
+
+
+def _expand_spans(spans):
+    """Expand [(start, end), ...] (rows, or column letters/indexes) to a set of indexes"""
+    excluded = set()
+    for span in spans:
+        start, end = span if isinstance(span, (tuple, list)) else (span, span)
+        start = column_to_index(start) if isinstance(start, str) else start
+        end = column_to_index(end) if isinstance(end, str) else end
+        excluded.update(range(start, end + 1))
+    return excluded
+
+
+class RangeView:
+    """An ExtractedRange seen through row/column exclusion masks
+
+    Only the lists of visible offsets are kept; cell data is read through
+    from the underlying range, so masking never copies the block.
+    """
+
+    def __init__(self, extracted, exclude_rows=(), exclude_columns=()):
+        self.extracted = extracted
+        hidden_rows = _expand_spans(exclude_rows)
+        hidden_columns = _expand_spans(exclude_columns)
+        self.row_offsets = [offset for offset in range(extracted.row_count)
+                            if extracted.first_row + offset not in hidden_rows]
+        self.col_offsets = [offset for offset in range(extracted.column_count)
+                            if extracted.first_col + offset not in hidden_columns]
+
+    def visible_rows(self):
+        return [self.extracted.first_row + offset for offset in self.row_offsets]
+
+    def visible_columns(self):
+        return [self.extracted.first_col + offset for offset in self.col_offsets]
+
+
+@timed()
+def extract_range(worksheet, address):
+    """Extract values, display text and formatting of a range from either backend"""
+    block = read_block(worksheet, address)
+    if hasattr(worksheet, "layout"):
+        formats, merges, widths = _extract_formats_headless(worksheet, block)
+    else:
+        formats, merges, widths = _extract_formats_com(worksheet, block)
+
+    clipped = []
+    for first_row, first_col, last_row, last_col in merges:
+        first_row, first_col = max(first_row, block.first_row), max(first_col, block.first_col)
+        last_row, last_col = min(last_row, block.last_row), min(last_col, block.last_col)
+        if first_row <= last_row and first_col <= last_col and (first_row, first_col) != (last_row, last_col):
+            clipped.append((first_row, first_col, last_row, last_col))
+
+    return ExtractedRange(block.first_row, block.first_col, block.values, block.text_grid(),
+                          formats, clipped, widths)
+
+
+def _extract_formats_headless(worksheet, block):
+    formats = [[worksheet.cell_format(row, col) for col in range(block.first_col, block.last_col + 1)]
+               for row in range(block.first_row, block.last_row + 1)]
+    merges = worksheet.layout()[0]
+    widths = [worksheet.column_width(col) for col in range(block.first_col, block.last_col + 1)]
+    return formats, merges, widths
+
+
+def _bgr_to_hex(color):
+    """Convert a COM BGR color integer to '#RRGGBB'"""
+    color = int(color)
+    return f"#{color & 0xFF:02X}{(color >> 8) & 0xFF:02X}{(color >> 16) & 0xFF:02X}"
+
+
+def _extract_formats_com(worksheet, block):
+    """Read cell formats through COM (one Range per cell, but no clipboard)"""
+    formats = []
+    merges = set()
+    for row in range(block.first_row, block.last_row + 1):
+        row_formats = []
+        for col in range(block.first_col, block.last_col + 1):
+            count_com_call("Range.Format")
+            cell = worksheet.Range(f"{index_to_column(col)}{row}")
+            css = {}
+            font = cell.Font
+            if font.Bold:
+                css["font-weight"] = "bold"
+            if font.Italic:
+                css["font-style"] = "italic"
+            if font.Color:
+                css["color"] = _bgr_to_hex(font.Color)
+            css["font-size"] = f"{float(font.Size):g}pt"
+            css["font-family"] = font.Name
+            if cell.Interior.ColorIndex != XL_NONE:
+                css["background"] = _bgr_to_hex(cell.Interior.Color)
+            if cell.HorizontalAlignment in XL_HORIZONTAL_ALIGN:
+                css["text-align"] = XL_HORIZONTAL_ALIGN[cell.HorizontalAlignment]
+            for side, index in XL_BORDER_SIDES.items():
+                border = cell.Borders(index)
+                if border.LineStyle != XL_NONE:
+                    css[f"border-{side}"] = f"{XL_BORDER_WEIGHTS.get(border.Weight, '1px solid')} {_bgr_to_hex(border.Color)}"
+            if cell.MergeCells:
+                area = cell.MergeArea
+                merges.add((area.Row, area.Column,
+                            area.Row + area.Rows.Count - 1, area.Column + area.Columns.Count - 1))
+            row_formats.append(css)
+        formats.append(row_formats)
+
+    widths = []
+    for col in range(block.first_col, block.last_col + 1):
+        count_com_call("Range.ColumnWidth")
+        widths.append(worksheet.Range(f"{index_to_column(col)}1").ColumnWidth)
+    return formats, sorted(merges), widths
+
+
+def column_width_px(width):
+    """Convert an Excel column width (characters) to pixels"""
+    return int(round(width * 7 + 5))
+
+
+def _css(declarations):
+    return ";".join(f"{key}:{value}" for key, value in declarations.items())
+
+
+def _table_cells(view):
+    """Rows of visible cells as [(rowspan, colspan, css dict, content)] (cells under a merge left out)"""
+    extracted = view.extracted
+    rows = view.visible_rows()
+    columns = view.visible_columns()
+
+    # Merged areas shrink to their visible rows/columns; the first visible cell carries the span
+    spans = {}
+    covered = set()
+    for first_row, first_col, last_row, last_col in extracted.merges:
+        merge_rows = [row for row in rows if first_row <= row <= last_row]
+        merge_cols = [col for col in columns if first_col <= col <= last_col]
+        if not merge_rows or not merge_cols:
+            continue
+        spans[(merge_rows[0], merge_cols[0])] = (len(merge_rows), len(merge_cols))
+        covered.update((row, col) for row in merge_rows for col in merge_cols)
+
+    table = []
+    for row_offset, row in zip(view.row_offsets, rows):
+        cells = []
+        for col_offset, col in zip(view.col_offsets, columns):
+            span = spans.get((row, col))
+            if span is None and (row, col) in covered:
+                cells.append(None)
+                continue
+            value = extracted.values[row_offset][col_offset]
+            text = extracted.texts[row_offset][col_offset]
+            css = dict(extracted.formats[row_offset][col_offset])
+            if "text-align" not in css and isinstance(value, (int, float)) and not isinstance(value, bool):
+                css["text-align"] = "right"  # Excel's General alignment for numbers
+            css.setdefault("white-space", "nowrap")
+            css["padding"] = "0 4px"
+            content = html.escape(str(text)) if text not in (None, "") else "&nbsp;"
+            cells.append((*(span or (1, 1)), css, content))
+        table.append(cells)
+    return table
+
+
+def _span_attributes(rowspan, colspan):
+    attributes = ""
+    if rowspan > 1:
+        attributes += f' rowspan="{rowspan}"'
+    if colspan > 1:
+        attributes += f' colspan="{colspan}"'
+    return attributes
+
+
+@timed()
+def render_html_table(source, compact=False, class_prefix="t"):
+    """Render an ExtractedRange (or a masked RangeView of one) as an HTML <table> fragment
+
+    By default every cell carries its own inline style. compact=True renders
+    the style-deduplicated form used in the mail (see _render_compact).
+    """
+    view = source if isinstance(source, RangeView) else RangeView(source)
+    table = _table_cells(view)
+    if compact:
+        return _render_compact(view, table, class_prefix)
+
+    parts = ['<table cellspacing="0" cellpadding="0" style="border-collapse:collapse">', "<colgroup>"]
+    for col_offset in view.col_offsets:
+        parts.append(f'<col style="width:{column_width_px(view.extracted.column_widths[col_offset])}px">')
+    parts.append("</colgroup>")
+    for cells in table:
+        parts.append("<tr>")
+        for cell in cells:
+            if cell is not None:
+                rowspan, colspan, css, content = cell
+                parts.append(f'<td{_span_attributes(rowspan, colspan)} style="{_css(css)}">{content}</td>')
+        parts.append("</tr>")
+    parts.append("</table>")
+    return "".join(parts)
+
+
+def _render_compact(view, table, prefix):
+    """Render cells with one CSS class per distinct style, in a leading <style> block
+
+    Declarations every cell shares go into a single "td" rule, a border
+    drawn by both neighbouring cells (Excel stores it on each) is kept on one
+    of them, runs of identical empty cells in a row become one colspan cell,
+    and column widths are width attributes. build_mail_html moves the
+    <style> block into the message head.
+    """
+    # Cells outside merges, by grid position, for the shared-border check
+    plain = {(r, c): cell[2] for r, cells in enumerate(table) for c, cell in enumerate(cells)
+             if cell is not None and cell[:2] == (1, 1)}
+    styles = []
+    for r, cells in enumerate(table):
+        for c, cell in enumerate(cells):
+            if cell is None:
+                continue
+            css = dict(cell[2])
+            if (r, c) in plain:
+                if (r, c - 1) in plain and css.get("border-left") == plain[(r, c - 1)].get("border-right"):
+                    css.pop("border-left", None)
+                if (r - 1, c) in plain and css.get("border-top") == plain[(r - 1, c)].get("border-bottom"):
+                    css.pop("border-top", None)
+            styles.append(css)
+    shared = dict(styles[0]) if styles else {}
+    for css in styles[1:]:
+        shared = {key: value for key, value in shared.items() if css.get(key) == value}
+
+    classes = {}  # declarations -> class name
+    rows = []
+    position = 0
+    for r, cells in enumerate(table):
+        row = []  # [rowspan, colspan, class name, content, can merge]
+        for c, cell in enumerate(cells):
+            if cell is None:
+                continue
+            rowspan, colspan, original, content = cell
+            declarations = _css({key: value for key, value in styles[position].items() if key not in shared})
+            position += 1
+            name = ""
+            if declarations:
+                name = classes.setdefault(declarations, f"{prefix}_{len(classes)}")
+            mergeable = ((r, c) in plain and content == "&nbsp;"
+                         and "border-left" not in original and "border-right" not in original)
+            if mergeable and row and row[-1][4] and row[-1][2] == name:
+                row[-1][1] += 1
+                continue
+            row.append([rowspan, colspan, name, content, mergeable])
+        rows.append(row)
+
+    rules = [f".{prefix}{{border-collapse:collapse}}"]
+    if shared:
+        rules.append(f".{prefix} td{{{_css(shared)}}}")
+    rules.extend(f".{name}{{{declarations}}}" for declarations, name in classes.items())
+    parts = [f"<style>{''.join(rules)}</style>",
+             f'<table class="{prefix}" cellspacing="0" cellpadding="0">', "<colgroup>"]
+    for col_offset in view.col_offsets:
+        parts.append(f'<col width="{column_width_px(view.extracted.column_widths[col_offset])}">')
+    parts.append("</colgroup>")
+    for row in rows:
+        parts.append("<tr>")
+        for rowspan, colspan, name, content, _ in row:
+            class_attribute = f' class="{name}"' if name else ""
+            parts.append(f"<td{_span_attributes(rowspan, colspan)}{class_attribute}>{content}</td>")
+        parts.append("</tr>")
+    parts.append("</table>")
+    return "".join(parts)
+
+
+STYLE_BLOCK_RE = re.compile(r"<style>(.*?)</style>", re.S)
+STYLE_RULE_RE = re.compile(r"\.([\w-]+)( td)?\{([^}]*)\}")
+TABLE_RE = re.compile(r'<table\b(?: class="([^"]*)")?.*?</table>', re.S)
+CELL_TAG_RE = re.compile(r"<td\b([^>]*)>")
+CLASS_ATTRIBUTE_RE = re.compile(r' class="([^"]*)"')
+
+
+def hoist_styles(fragment):
+    """Split the leading <style> block off a compact table: returns (css, table html)"""
+    match = STYLE_BLOCK_RE.match(fragment)
+    if match is None:
+        return "", fragment
+    return match.group(1), fragment[match.end():]
+
+
+def html_size_report(html_body):
+    """UTF-8 sizes of a mail body and of its tables (with their CSS), compact and with inline styles
+
+    The inline size writes each cell's rules back out as a style attribute,
+    like render_html_table without compact; merged empty cells and shared
+    borders stay merged, so it understates the saving a little.
+    """
+    cell_rules, class_rules = {}, {}
+    for name, cells, declarations in STYLE_RULE_RE.findall("".join(STYLE_BLOCK_RE.findall(html_body))):
+        (cell_rules if cells else class_rules)[name] = declarations
+
+    compact_bytes = sum(len(css.encode("utf-8")) for css in STYLE_BLOCK_RE.findall(html_body))
+    inline_bytes = 0
+    for match in TABLE_RE.finditer(html_body):
+        base = cell_rules.get(match.group(1) or "", "")
+
+        def inline_cell(cell):
+            if "style=" in cell.group(1):
+                return cell.group(0)
+            name = CLASS_ATTRIBUTE_RE.search(cell.group(1))
+            declarations = ";".join(filter(None, (base, class_rules.get(name.group(1)) if name else None)))
+            return f'<td{CLASS_ATTRIBUTE_RE.sub("", cell.group(1))} style="{declarations}">'
+
+        compact_bytes += len(match.group(0).encode("utf-8"))
+        inline_bytes += len(CELL_TAG_RE.sub(inline_cell, match.group(0)).encode("utf-8"))
+    return {"body": len(html_body.encode("utf-8")), "tables": compact_bytes,
+            "tables_inline": inline_bytes, "classes": len(class_rules)}
@@ -0,0 +1,367 @@
+"""Declarative report metrics and the mail template that uses them
+
+Each Metric says which sheet it lives on, the label that marks its row, the
+column the month table starts at, and whether the value or the display text
+is read. ExtractionPlan groups the metrics by sheet once: extracting any
+number of metrics then costs one label scan and one block read per sheet
+(or, on the headless backends, one streaming scan that reads the values of
+the label rows on the way and stops at the last label).
+
+Mail templates are str.format-style text whose fields name metrics
+("{digital_actual}") or "{date}". compile_template() splits a template into
+literal and field segments; compiled templates are kept in an in-process
+LRU cache, so every mail of a run reuses one parse. A template only extracts
+the metrics it uses. "{metric.mom}", "{metric.yoy}" (and their _pct forms)
+show the change against the metrics history recorded by history.py.
+
+Derived metrics (Metric.derive) are not read from a row of their own:
+("sum", key) is the year-to-date total of another metric's month columns,
+kept as cached prefix sums (cumulative.py), and ("rate", numerator,
+denominator) divides two metrics (or a metric by a fixed number). The
+cumulative platform figures are derived this way from 月目標數 and
+實際數位平台收益 instead of being read from the rows Excel computes.
+
+rollup_values() combines the metrics of several unit workbooks into one set
+(sums, with rates recomputed from the summed parts) for the consolidated
+report.
+"""
+import string
+from functools import lru_cache
+
+from numfmt import format_value
+from profiling import timed
+from sheet_block import read_block, read_number_format
+from cumulative import cached_series, series_lock, rate, MonthlySeries
+from xlsx_reader import column_to_index, index_to_column
+
+TEMPLATE_CACHE_LIMIT = 32  # compiled templates kept in memory (least recently used dropped first)
+# Computed rates are formatted straight to the one decimal the mail shows (the 0.0% of the
+# workbook's 累積月目標達成率 row) when no sheet cell tells otherwise, so they are rounded once
+RATE_NUMBER_FORMAT = "0.0%"
+
+
+class Metric:
+    """One number on the report: read from `sheet`, row labelled `label`, month column after `base_column`
+
+    Derived metrics are computed from other metrics instead; their label only names them,
+    except for rates with a base_column: they are shown with the number format of that row's cell.
+    A default of None shows MISSING_VALUE when the metric has no value; rollup None leaves
+    the metric out of the consolidated figures.
+    """
+
+    def __init__(self, key, sheet, label, base_column, text=False, formatter="number", default=0, rollup="sum",
+                 derive=None):
+        self.key = key
+        self.sheet = sheet
+        self.label = label
+        self.base_column = base_column
+        self.text = text            # read the display text (percentages) instead of the value
+        self.formatter = formatter  # name of the mail formatter, see autoEmail.METRIC_FORMATTERS
+        self.default = default      # used in the mail when the metric could not be read
+        self.rollup = rollup        # "sum" across units, (numerator, denominator) for rates, or None
+        self.derive = derive        # ("sum", key) or ("rate", numerator, denominator): computed, not read
+
+    def column(self, target_month):
+        return index_to_column(column_to_index(self.base_column) + target_month)
+
+
+REPORT_METRICS = [
+    Metric("digital_month_target", "數位戶", "月目標數", "Q"),
+    Metric("digital_actual", "數位戶", "數位戶實績(存戶+卡戶)", "Q"),
+    Metric("digital_achievement_rate_text", "數位戶", "月目標達成率", "Q",
+           text=True, formatter="percent", default="0%", rollup=("digital_actual", "digital_month_target")),
+    Metric("platform_month_target", "數位平台收益", "月目標數", "P", formatter="revenue"),
+    Metric("platform_actual", "數位平台收益", "實際數位平台收益", "P", formatter="revenue"),
+    Metric("platform_achievement_rate_text", "數位平台收益", "月目標達成率", "P",
+           text=True, formatter="percent", default="0%", rollup=("platform_actual", "platform_month_target")),
+    Metric("platform_cumulative_target", "數位平台收益", "累積月目標數", None, formatter="revenue",
+           derive=("sum", "platform_month_target")),
+    Metric("platform_cumulative_actual", "數位平台收益", "累積月實際數", None, formatter="revenue",
+           derive=("sum", "platform_actual")),
+    Metric("platform_cumulative_rate_text", "數位平台收益", "累積月目標達成率", "P",
+           text=True, formatter="percent", default="0%",
+           rollup=("platform_cumulative_actual", "platform_cumulative_target"),
+           derive=("rate", "platform_cumulative_actual", "platform_cumulative_target")),
+    # 榮譽累積 figures are head office's own: read from their rows when the workbook has them,
+    # otherwise configured per period (autoEmail.HONOR_FIGURES_FILE); never computed nor summed
+    Metric("honor_cumulative_target", "數位平台收益", "榮譽累積月目標數", "P", formatter="honor_revenue",
+           default=None, rollup=None),
+    Metric("platform_honor_cumulative_rate_text", "數位平台收益", "榮譽累積月目標達成率", "P",
+           text=True, formatter="percent", default=None, rollup=None),
+]
+
+MAIL_TEMPLATE = """Dear all,
+
+至{date}績效數字統計及說明如下，謝謝。
+
+(1) 數位戶客戶數: 年目標為1,564,000戶，月目標{digital_month_target}戶，目前實際數為{digital_actual}戶，
+月目標達成率為{digital_achievement_rate_text}。
+網行銀客戶數(具有網行銀會員身分之存戶+卡戶)
+
+[TABLE1_PLACEHOLDER]
+
+(2)數位平台收益: 年目標為4億元，月目標{platform_month_target}，目前實際數為{platform_actual}，月目標達成率為{platform_achievement_rate_text}。
+     累積月目標數{platform_cumulative_target}，累積月實際數{platform_cumulative_actual}，累積月目標達成率為{platform_cumulative_rate_text}。
+     榮譽累積月目標數{honor_cumulative_target}，榮譽累積月目標達成率為{platform_honor_cumulative_rate_text}。
+數位平台收益
+
+[TABLE2_PLACEHOLDER]
+"""
+
+# Template fields that are not metrics
+TEMPLATE_FIELDS = ("date",)
+MISSING_VALUE = "-"  # metrics without a value nor a default
+# "{metric.mom}" etc.: change against the previous month / same month last year (from history.py)
+DELTA_FIELDS = ("mom", "yoy", "mom_pct", "yoy_pct")
+MISSING_DELTA = "-"
+
+
+def with_sources(metrics, used):
+    """The metrics whose keys are in used, plus the metrics the derived ones are computed from"""
+    by_key = {metric.key: metric for metric in metrics}
+    needed = set()
+    pending = [key for key in used if key in by_key]
+    while pending:
+        key = pending.pop()
+        if key in needed:
+            continue
+        needed.add(key)
+        derive = by_key[key].derive
+        if derive:
+            pending.extend(operand for operand in derive[1:] if isinstance(operand, str))
+    return [metric for metric in metrics if metric.key in needed]
+
+
+class ExtractionPlan:
+    """Metrics grouped by sheet, read with one label lookup pass and one block per sheet"""
+
+    def __init__(self, metrics):
+        self.metrics = list(metrics)
+        self.by_sheet = {}
+        self.derived_by_sheet = {}
+        for metric in self.metrics:
+            group = self.derived_by_sheet if metric.derive else self.by_sheet
+            group.setdefault(metric.sheet, []).append(metric)
+        # Metrics read for every month up to the target month (the sources of year-to-date sums)
+        self.series_keys = {metric.derive[1] for metric in self.metrics
+                            if metric.derive and metric.derive[0] == "sum"}
+
+    @property
+    def sheet_names(self):
+        return list(self.by_sheet)
+
+    def _months(self, metric, target_month, first_months=None):
+        if metric.key not in self.series_keys:
+            return (target_month,)
+        return range(first_months.get(metric.key, 1) if first_months else 1, target_month + 1)
+
+    def extract_sheet(self, worksheet, target_month, find_row, sheet_name=None, label_cols=None,
+                      series_source=None, series_version=None):
+        """Read the metrics of one sheet (default: the worksheet's own name) from a worksheet
+
+        find_row(worksheet, label) returns the row of a label or None. With
+        label_cols = (first, last), worksheets that can stream (scan_labels)
+        find every label in one pass over all rows of those columns, stopping
+        at the last label; labels it misses still go through find_row.
+        Derived metrics are computed from what was read; with a series_source
+        (the workbook path) their monthly series stay cached for later months.
+        With a series_version as well (the saved file's size/mtime/hash), the
+        months already cached for that version are not read again.
+        """
+        sheet_name = sheet_name or worksheet.Name
+        metrics = self.by_sheet.get(sheet_name, [])
+        # Rates computed here still take their number format from their row on the sheet
+        rates = [metric for metric in self.derived_by_sheet.get(sheet_name, [])
+                 if metric.derive[0] == "rate" and metric.base_column]
+        rate_rows = {}
+        cached, first_months = {}, {}
+        if series_source:
+            with series_lock:
+                for metric in metrics:
+                    if metric.key in self.series_keys:
+                        monthly = cached[metric.key] = cached_series(series_source, metric.key, series_version)
+                        if series_version is not None:
+                            # The target month is read anyway, it is the metric's own value
+                            first_months[metric.key] = min(monthly.months_from(0, 1) + 1, target_month)
+        values = {}
+        series = {}
+        if label_cols and hasattr(worksheet, "scan_labels"):
+            cols = {column_to_index(metric.column(month))
+                    for metric in metrics for month in self._months(metric, target_month, first_months)}
+            found = worksheet.scan_labels({metric.label for metric in metrics + rates}, cols, label_cols)
+            rate_rows = {metric.key: found[metric.label][0] for metric in rates if metric.label in found}
+            for metric in metrics:
+                if metric.label in found:
+                    cells = found[metric.label][1]
+                    value, text = cells[column_to_index(metric.column(target_month))]
+                    values[metric.key] = text if metric.text else value
+                    if metric.key in self.series_keys:
+                        series[metric.key] = [cells[column_to_index(metric.column(month))][0]
+                                              for month in self._months(metric, target_month, first_months)]
+            metrics = [metric for metric in metrics if metric.label not in found]
+
+        cells = {}
+        for metric in metrics:
+            row = find_row(worksheet, metric.label)
+            if row:
+                cells[metric.key] = (row, [column_to_index(metric.column(month))
+                                           for month in self._months(metric, target_month, first_months)])
+        if cells:
+            rows = [row for row, _ in cells.values()]
+            cols = [col for _, metric_cols in cells.values() for col in metric_cols]
+            block = read_block(worksheet, f"{index_to_column(min(cols))}{min(rows)}:"
+                                          f"{index_to_column(max(cols))}{max(rows)}")
+            for metric in metrics:
+                if metric.key in cells:
+                    row, metric_cols = cells[metric.key]
+                    col = metric_cols[-1]
+                    values[metric.key] = block.text(row, col) if metric.text else block.value(row, col)
+                    if metric.key in self.series_keys:
+                        series[metric.key] = [block.value(row, col) for col in metric_cols]
+
+        def rate_format(metric):
+            row = rate_rows.get(metric.key) or find_row(worksheet, metric.label)
+            number_format = row and read_number_format(worksheet, row, column_to_index(metric.column(target_month)))
+            return number_format if number_format and "%" in number_format else RATE_NUMBER_FORMAT
+
+        self._derive(sheet_name, values, series, target_month, cached, first_months, rate_format)
+        return values
+
+    def resolve_sheet(self, worksheet, target_month, find_row, sheet_name=None, label_cols=None):
+        """Where extract_sheet() reads the metrics of one sheet: {metric key: (row, [column index, ...])}
+
+        Labels are looked up the same way (one streaming scan when possible,
+        find_row for the rest); metrics whose label is not found are left out.
+        """
+        metrics = self.by_sheet.get(sheet_name or worksheet.Name, [])
+        columns = {metric.key: [column_to_index(metric.column(month))
+                                for month in self._months(metric, target_month)] for metric in metrics}
+        rows = {}
+        if label_cols and hasattr(worksheet, "scan_labels"):
+            found = worksheet.scan_labels({metric.label for metric in metrics},
+                                          {col for cols in columns.values() for col in cols}, label_cols)
+            rows = {metric.key: found[metric.label][0] for metric in metrics if metric.label in found}
+        for metric in metrics:
+            if metric.key not in rows:
+                row = find_row(worksheet, metric.label)
+                if row:
+                    rows[metric.key] = row
+        return {key: (row, columns[key]) for key, row in rows.items()}
+
+    def _derive(self, sheet_name, values, series, target_month, cached, first_months, rate_format):
+        """Add the derived metrics of a sheet to values (in registry order, so rates follow their sums)
+
+        series holds the months read of each series metric, from its month in
+        first_months (default 1) on; cached the cached series to extend.
+        rate_format(metric) is the number format a rate is displayed with.
+        """
+        for metric in self.derived_by_sheet.get(sheet_name, []):
+            kind, *operands = metric.derive
+            if kind == "sum":
+                if operands[0] not in series:
+                    continue
+                with series_lock:
+                    # Workbook columns are months of one year, whichever it is
+                    monthly = cached[operands[0]] if operands[0] in cached else MonthlySeries()
+                    monthly.update(0, first_months.get(operands[0], 1), series[operands[0]])
+                    values[metric.key] = monthly.year_to_date(0, target_month)
+            elif kind == "rate":
+                numerator, denominator = (values.get(operand) for operand in operands)
+                if type(numerator) in (int, float) and type(denominator) in (int, float) and denominator:
+                    values[metric.key] = format_value(rate(numerator, denominator), rate_format(metric))
+
+
+def rollup_values(unit_values, metrics=REPORT_METRICS):
+    """Combine the metrics of several units: sums, and rates recomputed from the summed parts
+
+    unit_values is a list of {metric key: value} dicts. Values that are not
+    numbers (missing cells, text) are left out of the sums.
+    """
+    totals = {}
+    for metric in metrics:
+        if metric.rollup != "sum":
+            continue
+        numbers = [values[metric.key] for values in unit_values
+                   if type(values.get(metric.key)) in (int, float)]
+        if numbers:
+            totals[metric.key] = sum(numbers)
+    for metric in metrics:
+        if metric.rollup is None or metric.rollup == "sum":
+            continue
+        numerator, denominator = (totals.get(key) for key in metric.rollup)
+        if numerator is not None and denominator:
+            totals[metric.key] = format_value(rate(numerator, denominator), RATE_NUMBER_FORMAT)
+    return totals
+
+
+class CompiledTemplate:
+    """A mail template split into (literal text, field name or None) segments"""
+
+    def __init__(self, segments, metrics):
+        self.segments = segments
+        self.plan = ExtractionPlan(metrics)
+        self.history_fields = [field for _, field in segments if field and "." in field]
+
+    def render(self, values, formatters, **fields):
+        """Fill in the template: metric fields go through their formatter, others come from fields
+
+        Delta fields read "<metric>.<mom|yoy|...>" entries of values (see
+        history.compare_metrics) and show MISSING_DELTA without history.
+        """
+        by_key = {metric.key: metric for metric in self.plan.metrics}
+        parts = []
+        for literal, field in self.segments:
+            parts.append(literal)
+            if field is None:
+                continue
+            key, _, delta = field.partition(".")
+            metric = by_key.get(key)
+            if metric is None:
+                parts.append(str(fields[field]))
+            elif delta:
+                parts.append(_format_delta(metric, delta, values.get(field), formatters))
+            else:
+                value = values.get(metric.key, metric.default)
+                if value is None and metric.default is None:
+                    parts.append(MISSING_VALUE)
+                else:
+                    parts.append(formatters[metric.formatter](value))
+        return "".join(parts)
+
+
+def _format_delta(metric, delta, change, formatters):
+    if change is None:
+        return MISSING_DELTA
+    sign = "-" if change < 0 else "+"
+    if delta.endswith("_pct"):
+        return f"{sign}{abs(change):.1%}"
+    # Rates change by percentage points; other metrics use their own formatter
+    magnitude = f"{abs(change):.2%}" if metric.text else abs(change)
+    return sign + formatters[metric.formatter](magnitude)
+
+
+def _parse_template(template, metrics):
+    known = {metric.key for metric in metrics}
+    segments = []
+    for literal, field, format_spec, conversion in string.Formatter().parse(template):
+        if field is not None and field not in known and field not in TEMPLATE_FIELDS:
+            key, _, delta = field.partition(".")
+            if key not in known or delta not in DELTA_FIELDS:
+                raise ValueError(f"Unknown template field: {{{field}}}")
+        if format_spec or conversion:
+            raise ValueError(f"Template field {{{field}}} cannot have a format spec or conversion")
+        segments.append((literal, field))
+    return segments
+
+
+@timed()
+def compile_template(template=MAIL_TEMPLATE, metrics=REPORT_METRICS):
+    """Compile a template against the metric registry (cached in memory)"""
+    return _compile_template(template, tuple(metrics))
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_LIMIT)
+def _compile_template(template, metrics):
+    segments = _parse_template(template, metrics)
+    used = {field.partition(".")[0] for _, field in segments if field}
+    return CompiledTemplate(segments, with_sources(metrics, used))
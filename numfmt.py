@@ -0,0 +1,451 @@
+"""Excel number-format engine: compute a cell's display text (Range.Text) locally
+
+Supports the parts of Excel number formats used by the report workbooks and
+the common built-ins: up to four sections (positive;negative;zero;text),
+conditions and colour tags, 0/#/? digit placeholders, decimals, thousands
+separators and trailing-comma scaling, percent, scientific notation, quoted
+and escaped literal text, _x padding, @ text placeholders and basic dates.
+
+Format codes are compiled once and cached, so formatting a cell is a dict
+lookup plus a little arithmetic.
+"""
+import re
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+
+# Built-in number formats that Excel does not write into styles.xml
+BUILTIN_NUMBER_FORMATS = {
+    0: "General",
+    1: "0",
+    2: "0.00",
+    3: "#,##0",
+    4: "#,##0.00",
+    9: "0%",
+    10: "0.00%",
+    11: "0.00E+00",
+    12: "# ?/?",
+    13: "# ??/??",
+    14: "yyyy/m/d",
+    15: "d-mmm-yy",
+    16: "d-mmm",
+    17: "mmm-yy",
+    18: "h:mm AM/PM",
+    19: "h:mm:ss AM/PM",
+    20: "h:mm",
+    21: "h:mm:ss",
+    22: "yyyy/m/d h:mm",
+    37: "#,##0 ;(#,##0)",
+    38: "#,##0 ;[Red](#,##0)",
+    39: "#,##0.00;(#,##0.00)",
+    40: "#,##0.00;[Red](#,##0.00)",
+    45: "mm:ss",
+    46: "[h]:mm:ss",
+    47: "mm:ss.0",
+    48: "##0.0E+0",
+    49: "@",
+}
+
+CONDITION_RE = re.compile(r"^\[(<=|>=|<>|<|>|=)(-?[\d.]+)\]")
+DATE_TOKEN_RE = re.compile(r"yyyy|yy|mmmmm|mmmm|mmm|mm|m|dddd|ddd|dd|d|hh|h|ss|s|AM/PM|A/P|\.0+", re.IGNORECASE)
+EXCEL_EPOCH = datetime(1899, 12, 30)
+MONTH_NAMES = ["January", "February", "March", "April", "May", "June", "July",
+               "August", "September", "October", "November", "December"]
+DAY_NAMES = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+_compiled_formats = {}
+
+
+def format_general(value):
+    """Display a value the way Excel's General format does"""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, float):
+        if value == int(value) and abs(value) < 1e11:
+            return str(int(value))
+        text = f"{value:.10g}"
+        if "e" in text:
+            mantissa, exponent = text.split("e")
+            text = f"{float(mantissa):.5g}E{int(exponent):+03d}"
+        return text
+    return str(value)
+
+
+def _round_half_up(value, decimals):
+    """Round like Excel does (half away from zero on the 15-digit value)"""
+    quantum = Decimal(1).scaleb(-decimals)
+    return Decimal(f"{value:.15g}").quantize(quantum, rounding=ROUND_HALF_UP)
+
+
+def _group_thousands(digits):
+    """Insert thousands separators into a string of digits"""
+    if not digits:
+        return ""
+    head = len(digits) % 3 or 3
+    return ",".join([digits[:head]] + [digits[i:i + 3] for i in range(head, len(digits), 3)])
+
+
+def _tokenize(section):
+    """Split a format section into (kind, text) tokens with literals resolved"""
+    tokens = []
+    i = 0
+    while i < len(section):
+        char = section[i]
+        if char == '"':
+            end = section.find('"', i + 1)
+            end = len(section) if end == -1 else end
+            tokens.append(("literal", section[i + 1:end]))
+            i = end + 1
+        elif char in "\\!" and i + 1 < len(section):
+            tokens.append(("literal", section[i + 1]))  # \x and !x: x as literal text
+            i += 2
+        elif char == "_" and i + 1 < len(section):
+            tokens.append(("literal", " "))
+            i += 2
+        elif char == "*" and i + 1 < len(section):
+            i += 2  # fill character: no fixed width to fill in a text rendering
+        elif char == "[":
+            end = section.find("]", i)
+            end = len(section) if end == -1 else end
+            tag = section[i + 1:end]
+            if tag.startswith("$") and "-" in tag:
+                tokens.append(("literal", tag[1:tag.index("-")]))
+            elif tag.startswith("$"):
+                tokens.append(("literal", tag[1:]))
+            elif tag.lower() in ("h", "hh", "m", "mm", "s", "ss"):
+                tokens.append(("elapsed", tag.lower()))
+            i = end + 1  # colour tags are dropped
+        elif char in "0#?.,%@":
+            tokens.append((char, char))
+            i += 1
+        elif char in "Ee" and i + 1 < len(section) and section[i + 1] in "+-":
+            tokens.append(("exponent", section[i:i + 2]))
+            i += 2
+        else:
+            tokens.append(("literal", char))
+            i += 1
+    return tokens
+
+
+def _is_date_section(section):
+    stripped = re.sub(r'"[^"]*"|[\\!].|\[[^\]]*\]', "", section)
+    return bool(re.search(r"[ymdhs]", stripped, re.IGNORECASE)) and not re.search(r"[0#?]", stripped)
+
+
+class _NumberSection:
+    """A compiled numeric format section"""
+
+    def __init__(self, section):
+        self.condition = None
+        match = CONDITION_RE.match(section)
+        if match:
+            self.condition = (match.group(1), float(match.group(2)))
+        tokens = _tokenize(section)
+        placeholder_positions = [i for i, (kind, _) in enumerate(tokens) if kind in "0#?"]
+        self.is_text_only = not placeholder_positions
+        self.percent = sum(1 for kind, _ in tokens if kind == "%")
+        self.tokens = tokens
+        if self.is_text_only:
+            return
+
+        first, last = placeholder_positions[0], placeholder_positions[-1]
+        # Commas right after the last digit placeholder scale by 1000 each
+        self.scale = 0
+        position = last + 1
+        while position < len(tokens) and tokens[position][0] == ",":
+            self.scale += 1
+            position += 1
+        self.prefix = tokens[:first]
+        self.suffix = tokens[position:]
+        body = tokens[first:last + 1]
+
+        self.exponent = None
+        for i, (kind, text) in enumerate(body):
+            if kind == "exponent":
+                self.exponent = (text, body[i + 1:])
+                body = body[:i]
+                break
+
+        point = next((i for i, (kind, _) in enumerate(body) if kind == "."), None)
+        integer_tokens = body if point is None else body[:point]
+        self.decimal_tokens = [] if point is None else body[point + 1:]
+        self.has_point = point is not None
+        self.thousands = any(kind == "," for kind, _ in integer_tokens)
+        self.integer_tokens = [token for token in integer_tokens if token[0] != ","]
+        self.decimals = sum(1 for kind, _ in self.decimal_tokens if kind in "0#?")
+
+    def matches(self, value):
+        operator, operand = self.condition
+        return {"<": value < operand, "<=": value <= operand, ">": value > operand,
+                ">=": value >= operand, "=": value == operand, "<>": value != operand}[operator]
+
+    def format(self, value, negative_sign):
+        if self.is_text_only:
+            return self._literals(self.tokens)
+        value = value * (100 ** self.percent) / (1000 ** self.scale)
+        if self.exponent:
+            body = self._format_scientific(abs(value))
+        else:
+            body = self._format_fixed(abs(value))
+        sign = "-" if negative_sign and value < 0 else ""
+        return sign + self._literals(self.prefix) + body + self._literals(self.suffix)
+
+    @staticmethod
+    def _literals(tokens):
+        return "".join(text for kind, text in tokens if kind in ("literal", "%"))
+
+    def _format_fixed(self, value):
+        rounded = _round_half_up(value, self.decimals)
+        integer_digits, _, fraction_digits = f"{rounded:f}".partition(".")
+        return self._fill_integer(integer_digits) + self._fill_fraction(fraction_digits)
+
+    def _fill_integer(self, digits):
+        placeholders = [kind for kind, _ in self.integer_tokens if kind in "0#?"]
+        if digits == "0":
+            digits = ""
+        minimum = len(placeholders) - next((i for i, kind in enumerate(placeholders) if kind == "0"),
+                                           len(placeholders))
+        digits = digits.rjust(minimum, "0")
+        if self.thousands:
+            return _group_thousands(digits) + self._literals(self.integer_tokens)
+
+        # Fill placeholders from the right; the leftmost one takes any extra digits
+        out = []
+        remaining = digits
+        slots = [i for i, (kind, _) in enumerate(self.integer_tokens) if kind in "0#?"]
+        for i in range(len(self.integer_tokens) - 1, -1, -1):
+            kind, text = self.integer_tokens[i]
+            if kind not in "0#?":
+                out.append(text)
+            elif i == slots[0]:
+                out.append(remaining if remaining else (" " if kind == "?" else ""))
+                remaining = ""
+            else:
+                out.append(remaining[-1:] if remaining else (" " if kind == "?" else ""))
+                remaining = remaining[:-1]
+        return "".join(reversed(out))
+
+    def _fill_fraction(self, digits):
+        if not self.has_point:
+            return ""
+        placeholders = [kind for kind, _ in self.decimal_tokens if kind in "0#?"]
+        digits = digits.ljust(len(placeholders), "0")
+        # Trailing zeros are dropped for # and shown as spaces for ?
+        keep = len(placeholders)
+        while keep > 0 and placeholders[keep - 1] != "0" and digits[keep - 1] == "0":
+            keep -= 1
+        out = []
+        digit_index = 0
+        for kind, text in self.decimal_tokens:
+            if kind in "0#?":
+                if digit_index < keep:
+                    out.append(digits[digit_index])
+                elif kind == "?":
+                    out.append(" ")
+                digit_index += 1
+            else:
+                out.append(text)
+        return "." + "".join(out)
+
+    def _format_scientific(self, value):
+        exponent_sign, exponent_tokens = self.exponent
+        integer_places = max(1, sum(1 for kind, _ in self.integer_tokens if kind in "0#?"))
+        exponent = 0
+        if value:
+            exponent = int(Decimal(value).adjusted())
+            # Engineering-style formats (##0.0E+0) keep exponents in multiples of the integer width
+            if integer_places > 1 and any(kind == "#" for kind, _ in self.integer_tokens):
+                exponent -= exponent % integer_places
+            else:
+                exponent -= integer_places - 1
+        mantissa = value / (10 ** exponent) if value else 0.0
+        rounded = _round_half_up(mantissa, self.decimals)
+        if value and abs(rounded) >= 10 ** integer_places:
+            exponent += 1
+            rounded = _round_half_up(value / (10 ** exponent), self.decimals)
+        integer_digits, _, fraction_digits = f"{rounded:f}".partition(".")
+        width = sum(1 for kind, _ in exponent_tokens if kind in "0#?")
+        exponent_text = str(abs(exponent)).rjust(width, "0")
+        if exponent < 0:
+            sign = "-"
+        else:
+            sign = "+" if exponent_sign.endswith("+") else ""
+        return (self._fill_integer(integer_digits) + self._fill_fraction(fraction_digits)
+                + exponent_sign[0] + sign + exponent_text)
+
+
+class _DateSection:
+    """A compiled date/time format section"""
+
+    def __init__(self, section):
+        self.section = re.sub(r"\[[^\]]*\]", "", section)
+        self.has_ampm = bool(re.search(r"AM/PM|A/P", self.section, re.IGNORECASE))
+
+    def format(self, value, negative_sign):
+        moment = EXCEL_EPOCH + timedelta(days=value)
+        out = []
+        position = 0
+        previous = None
+        for match in DATE_TOKEN_RE.finditer(self.section):
+            out.append(self.section[position:match.start()].replace('"', "").replace("\\", ""))
+            token = match.group(0)
+            lower = token.lower()
+            following = self.section[match.end():].lower()
+            is_minute = lower in ("m", "mm") and (previous in ("h", "hh") or following.lstrip(":").startswith("s"))
+            out.append(self._render(token, lower, moment, is_minute))
+            previous = lower
+            position = match.end()
+        out.append(self.section[position:].replace('"', "").replace("\\", ""))
+        return "".join(out)
+
+    def _render(self, token, lower, moment, is_minute):
+        hour = moment.hour
+        if self.has_ampm:
+            hour = hour % 12 or 12
+        if lower == "yyyy":
+            return f"{moment.year:04d}"
+        if lower == "yy":
+            return f"{moment.year % 100:02d}"
+        if is_minute:
+            return f"{moment.minute:02d}" if lower == "mm" else str(moment.minute)
+        if lower == "mmmmm":
+            return MONTH_NAMES[moment.month - 1][0]
+        if lower == "mmmm":
+            return MONTH_NAMES[moment.month - 1]
+        if lower == "mmm":
+            return MONTH_NAMES[moment.month - 1][:3]
+        if lower == "mm":
+            return f"{moment.month:02d}"
+        if lower == "m":
+            return str(moment.month)
+        if lower == "dddd":
+            return DAY_NAMES[moment.weekday()]
+        if lower == "ddd":
+            return DAY_NAMES[moment.weekday()][:3]
+        if lower == "dd":
+            return f"{moment.day:02d}"
+        if lower == "d":
+            return str(moment.day)
+        if lower == "hh":
+            return f"{hour:02d}"
+        if lower == "h":
+            return str(hour)
+        if lower == "ss":
+            return f"{moment.second:02d}"
+        if lower == "s":
+            return str(moment.second)
+        if lower in ("am/pm", "a/p"):
+            is_pm = moment.hour >= 12
+            if lower == "am/pm":
+                return "PM" if is_pm else "AM"
+            return ("P" if is_pm else "A") if token[0].isupper() else ("p" if is_pm else "a")
+        if lower.startswith("."):
+            fraction = moment.microsecond / 1e6
+            return f"{fraction:.{len(lower) - 1}f}"[1:]
+        return token
+
+
+def _split_sections(code):
+    """Split a format code on ';' outside quotes and escapes"""
+    sections = []
+    current = []
+    in_quotes = False
+    escaped = False
+    for char in code:
+        if escaped:
+            current.append(char)
+            escaped = False
+        elif char == "\\":
+            current.append(char)
+            escaped = True
+        elif char == '"':
+            current.append(char)
+            in_quotes = not in_quotes
+        elif char == ";" and not in_quotes:
+            sections.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+    sections.append("".join(current))
+    return sections
+
+
+class NumberFormat:
+    """A compiled Excel number format code"""
+
+    def __init__(self, code):
+        self.code = code
+        self.is_general = code.strip().lower() in ("general", "")
+        sections = _split_sections(code)
+        self.text_section = None
+        if len(sections) >= 4 or (sections and "@" in sections[-1] and len(sections) > 1):
+            self.text_section = sections.pop()
+        elif len(sections) == 1 and sections[0].strip() == "@":
+            self.text_section = sections[0]
+            sections = ["General"]
+        self.sections = [self._compile_section(section) for section in sections]
+
+    @staticmethod
+    def _compile_section(section):
+        if section.strip().lower() == "general":
+            return None
+        if re.search(r"[0#?]\s*/\s*[0#?\d]", section):
+            return None  # fractions are shown as General
+        if _is_date_section(section):
+            return _DateSection(section)
+        return _NumberSection(section)
+
+    def format(self, value):
+        """Return the display text Excel shows for `value`"""
+        if value is None:
+            return ""
+        if isinstance(value, bool):
+            return "TRUE" if value else "FALSE"
+        if isinstance(value, datetime):
+            # COM returns date cells as datetimes; format them from the serial number
+            value = (value.replace(tzinfo=None) - EXCEL_EPOCH).total_seconds() / 86400
+        if not isinstance(value, (int, float)):
+            if self.text_section is None:
+                return str(value)
+            return "".join(str(value) if kind == "@" else text
+                           for kind, text in _tokenize(self.text_section)
+                           if kind in ("literal", "@"))
+        if self.is_general:
+            return format_general(value)
+
+        section, negative_sign = self._pick_section(value)
+        if section is None:
+            return format_general(value if negative_sign else abs(value))
+        return section.format(value, negative_sign)
+
+    def _pick_section(self, value):
+        """Choose the section for a number; returns (section, whether to add '-')"""
+        sections = self.sections
+        conditional = [section for section in sections
+                       if isinstance(section, _NumberSection) and section.condition]
+        if conditional:
+            for section in conditional:
+                if section.matches(value):
+                    return section, False
+            remaining = [section for section in sections if section not in conditional]
+            return (remaining[0] if remaining else sections[-1]), value < 0
+        if len(sections) == 1 or value > 0:
+            return sections[0], len(sections) == 1
+        if value < 0:
+            return sections[1], False
+        return (sections[2] if len(sections) > 2 else sections[0]), False
+
+
+def compile_format(code):
+    """Compile a format code, reusing the cached compilation when there is one"""
+    compiled = _compiled_formats.get(code)
+    if compiled is None:
+        compiled = NumberFormat(code or "General")
+        _compiled_formats[code] = compiled
+    return compiled
+
+
+def format_value(value, code):
+    """Format a raw cell value with an Excel number format code"""
+    return compile_format(code).format(value)
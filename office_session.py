@@ -0,0 +1,772 @@
+"""Long-lived Office automation session serving report jobs from warm instances
+
+A run that starts Excel, Outlook and Word through COM spends seconds on
+each Dispatch (and used to leave Excel open in whatever state the run ended
+in). The session daemon owns the application instances and the workbooks
+they have open, and takes report jobs from a local IPC queue
+(multiprocessing.connection on 127.0.0.1, authenticated with a per-user key
+file). Jobs run one at a time on a single thread, since COM objects are
+bound to the thread that created them. Interactive ("display") jobs go
+before the rest, and a job identical to one still waiting shares that job's
+run and result.
+
+Instances are recycled before a job when they stop answering, have been up
+longer than MAX_INSTANCE_AGE or have served MAX_INSTANCE_JOBS jobs, and
+right after a job that failed while using an instance that no longer
+answers. Open workbooks are reopened when their file changes and the
+least recently used are closed beyond MAX_OPEN_WORKBOOKS.
+
+FakeOfficeBackend stands in for COM, so the protocol, the scheduling and
+the report's COM code paths run on Linux: its Excel opens workbooks with
+xlsx_reader underneath but hands out only the COM object model (Range
+Value/Text/NumberFormat, Font, Interior, Borders, MergeArea, ColumnWidth),
+and mail items are kept in memory.
+
+A job's output is captured per thread: the job thread's prints go to that
+job's buffer while the rest of the daemon keeps printing to its console.
+If the job thread dies, waiting clients get an error reply instead of
+waiting forever.
+
+python office_session.py [--fake] [--address 127.0.0.1:47031]   start the daemon
+python office_session.py --status | --stop                       query or stop it
+python autoEmail.py -m 6 --session                               run a report through it
+"""
+import os
+import io
+import sys
+import socket
+import json
+import time
+import heapq
+import argparse
+import threading
+import traceback
+from multiprocessing.connection import Client, Listener
+
+import profiling
+import xlsx_reader
+from html_table import XL_NONE, XL_BORDER_SIDES, XL_HORIZONTAL_ALIGN
+from pipeline import thread_output
+from sheet_block import reset_com_call_counts
+
+SESSION_HOST = "127.0.0.1"
+SESSION_PORT = 47031
+SESSION_KEY_FILE = os.path.join(os.path.expanduser("~"), ".autoEmail_cache", "office_session.key")
+MAX_INSTANCE_AGE = 4 * 60 * 60  # seconds an application instance is used before it is restarted
+MAX_INSTANCE_JOBS = 200         # jobs an application instance serves before it is restarted
+MAX_OPEN_WORKBOOKS = 4          # workbooks kept open in the warm Excel
+
+# run_report keyword arguments a report job may carry
+REPORT_JOB_ARGS = ("year", "months", "file_path", "output", "output_dir", "backend", "workers", "mail_settings",
+                   "signature_path", "recalculate", "use_cache", "concurrent", "units", "share_concurrency",
+                   "history", "exclude_rows")
+# Lower runs first; anything not listed is 1
+JOB_PRIORITIES = {"display": 0}
+WORKER_CHECK_INTERVAL = 1.0   # seconds between checks that the job thread is still alive
+SESSION_JOB_TIMEOUT = 60 * 60  # seconds a client waits for its report job
+
+
+class ComBackend:
+    """The real Office applications, through pywin32"""
+
+    def thread_init(self):
+        import pythoncom
+        pythoncom.CoInitialize()
+
+    def thread_exit(self):
+        import pythoncom
+        pythoncom.CoUninitialize()
+
+    def dispatch(self, prog_id):
+        import win32com.client
+        application = win32com.client.DispatchEx(prog_id)  # a private instance, not the user's own
+        if prog_id in ("Excel.Application", "Word.Application"):
+            application.Visible = False
+            application.DisplayAlerts = False
+        return application
+
+
+class FakeApplication:
+    """Common part of the fake Office applications: Name answers until fail() is called"""
+
+    prog_id = None
+
+    def __init__(self):
+        self.Visible = False
+        self.DisplayAlerts = True
+        self.failed = False
+        self.quit = False
+
+    @property
+    def Name(self):
+        if self.failed or self.quit:
+            raise RuntimeError(f"{self.prog_id} is not responding")
+        return self.prog_id.split(".")[0]
+
+    def fail(self):
+        """Make the instance stop answering, like a hung or crashed Office process"""
+        self.failed = True
+
+    def Quit(self):
+        self.quit = True
+
+
+XL_GENERAL = 1      # xlHAlignGeneral
+XL_CONTINUOUS = 1   # xlContinuous
+XL_BORDER_WEIGHT_CODES = {"1px": 2, "2px": -4138, "3px": 4}  # xlThin, xlMedium, xlThick
+
+
+def _hex_to_bgr(color):
+    """'#RRGGBB' to a COM BGR color integer"""
+    rgb = int(color.lstrip("#"), 16)
+    return ((rgb & 0xFF) << 16) | (rgb & 0xFF00) | (rgb >> 16)
+
+
+class _FakeFont:
+    def __init__(self, css):
+        self.Bold = css.get("font-weight") == "bold"
+        self.Italic = css.get("font-style") == "italic"
+        self.Color = _hex_to_bgr(css["color"]) if "color" in css else 0
+        self.Size = float(css.get("font-size", "11pt")[:-2])
+        self.Name = css.get("font-family", "Calibri")
+
+
+class _FakeInterior:
+    def __init__(self, css):
+        self.ColorIndex = XL_NONE if "background" not in css else 1
+        self.Color = _hex_to_bgr(css.get("background", "#FFFFFF"))
+
+
+class _FakeBorder:
+    def __init__(self, css_value):
+        self.LineStyle, self.Weight, self.Color = XL_NONE, 2, 0
+        if css_value:
+            width, _, color = css_value.split(" ")
+            self.LineStyle = XL_CONTINUOUS
+            self.Weight = XL_BORDER_WEIGHT_CODES.get(width, 2)
+            self.Color = _hex_to_bgr(color)
+
+
+class _FakeCount:
+    def __init__(self, count):
+        self.Count = count
+
+
+class _FakeComRange:
+    """A Range as Excel returns it over COM: Text and NumberFormat are one value, formats are per cell"""
+
+    def __init__(self, worksheet, first_row, first_col, last_row, last_col):
+        self.Worksheet = worksheet
+        self.Row = first_row
+        self.Column = first_col
+        self.Rows = _FakeCount(last_row - first_row + 1)
+        self.Columns = _FakeCount(last_col - first_col + 1)
+        self._cells = xlsx_reader.XlsxRange(worksheet.sheet, first_row, first_col, last_row, last_col)
+
+    @property
+    def Value(self):
+        return self._cells.Value
+
+    @property
+    def Text(self):
+        """The text shared by every cell, None when they differ"""
+        return self._common(self.Worksheet.sheet.cell_text)
+
+    @property
+    def NumberFormat(self):
+        """The number format shared by every cell, None when they differ"""
+        return self._common(self.Worksheet.sheet.cell_number_format)
+
+    def _common(self, getter):
+        values = {getter(row, col)
+                  for row in range(self.Row, self._cells.last_row + 1)
+                  for col in range(self.Column, self._cells.last_col + 1)}
+        return values.pop() if len(values) == 1 else None
+
+    def Find(self, what):
+        found = self._cells.Find(what)
+        return None if found is None else self.Worksheet.Range(found.Address)
+
+    def _css(self):
+        return self.Worksheet.sheet.cell_format(self.Row, self.Column)
+
+    @property
+    def Font(self):
+        return _FakeFont(self._css())
+
+    @property
+    def Interior(self):
+        return _FakeInterior(self._css())
+
+    @property
+    def HorizontalAlignment(self):
+        align = self._css().get("text-align")
+        return next((code for code, name in XL_HORIZONTAL_ALIGN.items() if name == align), XL_GENERAL)
+
+    def Borders(self, index):
+        side = next(side for side, code in XL_BORDER_SIDES.items() if code == index)
+        return _FakeBorder(self._css().get(f"border-{side}"))
+
+    @property
+    def MergeCells(self):
+        return self._merge() is not None
+
+    @property
+    def MergeArea(self):
+        return _FakeComRange(self.Worksheet, *(self._merge() or (self.Row, self.Column, self.Row, self.Column)))
+
+    def _merge(self):
+        for merge in self.Worksheet.sheet.layout()[0]:
+            if merge[0] <= self.Row <= merge[2] and merge[1] <= self.Column <= merge[3]:
+                return merge
+        return None
+
+    @property
+    def ColumnWidth(self):
+        return self.Worksheet.sheet.column_width(self.Column)
+
+
+class _FakeComWorksheet:
+    def __init__(self, workbook, sheet):
+        self.Parent = workbook
+        self.Name = sheet.Name
+        self.sheet = sheet
+
+    def Range(self, address):
+        return _FakeComRange(self, *xlsx_reader.parse_range_address(address))
+
+
+class _FakeComWorkbook:
+    """A workbook open in the fake Excel: read with xlsx_reader, offering only what COM offers"""
+
+    def __init__(self, path):
+        self._workbook = xlsx_reader.open_workbook(path)
+        self.FullName = self._workbook.FullName
+        self.Name = self._workbook.Name
+        self.Saved = True  # opened read-only, never edited
+        self.Worksheets = [_FakeComWorksheet(self, sheet) for sheet in self._workbook.Worksheets]
+        self.closed = False
+
+    def Close(self, save_changes=False):
+        if not self.closed:
+            self._workbook.Close()
+            self.closed = True
+
+
+class _FakeWorkbooks:
+    def __init__(self):
+        self.opened = []
+
+    def Open(self, path, *args, **kwargs):
+        workbook = _FakeComWorkbook(path)
+        self.opened.append(workbook)
+        return workbook
+
+    @property
+    def Count(self):
+        return sum(1 for workbook in self.opened if not workbook.closed)
+
+
+class FakeExcel(FakeApplication):
+    prog_id = "Excel.Application"
+
+    def __init__(self):
+        super().__init__()
+        self.Workbooks = _FakeWorkbooks()
+
+
+class _FakeAttachment:
+    def __init__(self):
+        self.PropertyAccessor = self
+
+    def SetProperty(self, name, value):
+        pass
+
+
+class _FakeAttachments(list):
+    def Add(self, path, *args):
+        self.append(path)
+        return _FakeAttachment()
+
+
+class _FakeRange:
+    """Enough of Word's Range/Selection for insert_signature_to_email"""
+
+    def __init__(self, document):
+        self.document = document
+
+    @property
+    def Text(self):
+        return self.document.text
+
+    @Text.setter
+    def Text(self, value):
+        self.document.text = value
+
+    def Select(self):
+        pass
+
+    def Copy(self):
+        pass
+
+    def Paste(self):
+        self.document.text += "[pasted]"
+
+    def EndKey(self, unit):
+        pass
+
+    def Collapse(self, direction):
+        pass
+
+    def TypeText(self, text):
+        self.document.text += text
+
+    InsertAfter = TypeText
+
+
+class _FakeDocument:
+    def __init__(self, application, text=""):
+        self.Application = application
+        self.text = text
+        self.Content = _FakeRange(self)
+
+    def Close(self, save_changes=False):
+        pass
+
+
+class FakeWord(FakeApplication):
+    prog_id = "Word.Application"
+
+    def __init__(self):
+        super().__init__()
+        self.Documents = self
+        self.Selection = None
+
+    def Open(self, path, *args):
+        document = _FakeDocument(self, os.path.basename(path))
+        self.Selection = document.Content
+        return document
+
+
+class _FakeMailItem:
+    def __init__(self, outlook):
+        self.outlook = outlook
+        self.Subject = ""
+        self.HTMLBody = ""
+        self.Attachments = _FakeAttachments()
+        word = FakeWord()
+        self.GetInspector = self
+        self.WordEditor = _FakeDocument(word)
+        word.Selection = self.WordEditor.Content
+
+    def Display(self):
+        self.outlook.displayed.append(self)
+
+    def Save(self):
+        if self not in self.outlook.drafts:
+            self.outlook.drafts.append(self)
+
+    def Delete(self):
+        if self in self.outlook.drafts:
+            self.outlook.drafts.remove(self)
+
+
+class FakeOutlook(FakeApplication):
+    prog_id = "Outlook.Application"
+
+    def __init__(self):
+        super().__init__()
+        self.drafts = []
+        self.displayed = []
+
+    def CreateItem(self, item_type):
+        return _FakeMailItem(self)
+
+
+class FakeOfficeBackend:
+    """In-process stand-ins for Excel, Outlook and Word; every dispatch is recorded"""
+
+    applications = {cls.prog_id: cls for cls in (FakeExcel, FakeOutlook, FakeWord)}
+
+    def __init__(self):
+        self.dispatched = []
+
+    def thread_init(self):
+        pass
+
+    def thread_exit(self):
+        pass
+
+    def dispatch(self, prog_id):
+        application = self.applications[prog_id]()
+        self.dispatched.append(application)
+        return application
+
+
+class _Instance:
+    def __init__(self, application):
+        self.application = application
+        self.started = time.time()
+        self.jobs = 0
+        self.used = False  # by the current job
+
+
+def _healthy(application):
+    try:
+        application.Name
+        return True
+    except Exception:
+        return False
+
+
+class OfficeSession:
+    """Warm Office application instances and the workbooks open in Excel (use from one thread)"""
+
+    def __init__(self, backend, max_age=MAX_INSTANCE_AGE, max_jobs=MAX_INSTANCE_JOBS,
+                 max_workbooks=MAX_OPEN_WORKBOOKS):
+        self.backend = backend
+        self.max_age = max_age
+        self.max_jobs = max_jobs
+        self.max_workbooks = max_workbooks
+        self.instances = {}  # prog id -> _Instance
+        self.workbooks = {}  # path -> ((size, mtime_ns), workbook), least recently used first
+        self.started = 0
+        self.recycled = 0
+
+    def application(self, prog_id):
+        """The warm instance of an application, started on first use"""
+        instance = self.instances.get(prog_id)
+        if instance is None:
+            start_time = time.perf_counter()
+            instance = self.instances[prog_id] = _Instance(self.backend.dispatch(prog_id))
+            self.started += 1
+            print(f"Started {prog_id} in {(time.perf_counter() - start_time) * 1000:.0f} ms")
+        instance.used = True
+        return instance.application
+
+    def workbook(self, path):
+        """A workbook open in the warm Excel, reopened when the file has changed"""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        version = (stat.st_size, stat.st_mtime_ns)
+        entry = self.workbooks.pop(path, None)
+        if entry is not None and entry[0] == version:
+            self.workbooks[path] = entry
+            self.application("Excel.Application")
+            return entry[1]
+        if entry is not None:
+            self._close_workbook(path, entry[1])
+        # UpdateLinks=0, ReadOnly=True: the report never writes to the workbook
+        workbook = self.application("Excel.Application").Workbooks.Open(path, 0, True)
+        self.workbooks[path] = (version, workbook)
+        while len(self.workbooks) > self.max_workbooks:
+            oldest = next(iter(self.workbooks))
+            self._close_workbook(oldest, self.workbooks.pop(oldest)[1])
+        return workbook
+
+    def _close_workbook(self, path, workbook):
+        try:
+            workbook.Close(False)
+        except Exception as e:
+            print(f"Could not close {os.path.basename(path)}: {e}")
+
+    def begin_job(self):
+        """Recycle instances that are unhealthy or past their age/job limits"""
+        now = time.time()
+        for prog_id, instance in list(self.instances.items()):
+            if now - instance.started > self.max_age:
+                self.recycle(prog_id, "too old")
+            elif instance.jobs >= self.max_jobs:
+                self.recycle(prog_id, f"served {instance.jobs} jobs")
+            elif not _healthy(instance.application):
+                self.recycle(prog_id, "not responding")
+            else:
+                instance.used = False
+
+    def end_job(self, failed):
+        """Count the job against the instances it used; after a failure drop the ones that stopped answering"""
+        for prog_id, instance in list(self.instances.items()):
+            if not instance.used:
+                continue
+            instance.jobs += 1
+            if failed and not _healthy(instance.application):
+                self.recycle(prog_id, "not responding after a failed job")
+
+    def recycle(self, prog_id, reason):
+        """Quit an instance (closing its workbooks); the next job starts a fresh one"""
+        instance = self.instances.pop(prog_id)
+        print(f"Recycling {prog_id} ({reason})")
+        if prog_id == "Excel.Application":
+            for path, (_, workbook) in list(self.workbooks.items()):
+                self._close_workbook(path, workbook)
+            self.workbooks.clear()
+        try:
+            instance.application.Quit()
+        except Exception:
+            pass  # already gone
+        self.recycled += 1
+
+    def close(self):
+        for prog_id in list(self.instances):
+            self.recycle(prog_id, "session closed")
+
+    def status(self):
+        now = time.time()
+        return {
+            "instances": {prog_id: {"age": round(now - instance.started), "jobs": instance.jobs}
+                          for prog_id, instance in self.instances.items()},
+            "workbooks": list(self.workbooks),
+            "started": self.started,
+            "recycled": self.recycled,
+        }
+
+
+class _Job:
+    def __init__(self, request, key, priority, sequence):
+        self.request = request
+        self.key = key
+        self.priority = priority
+        self.sequence = sequence
+        self.submitters = 1
+        self.result = None
+        self.done = threading.Event()
+
+    def __lt__(self, other):
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+
+class JobQueue:
+    """Report jobs by priority then arrival; an identical waiting job is shared, not queued twice"""
+
+    def __init__(self):
+        self._ready = threading.Condition()
+        self._heap = []
+        self._waiting = {}  # job key -> queued _Job
+        self._sequence = 0
+        self.closed = False
+
+    def submit(self, request):
+        key = json.dumps(request, sort_keys=True, ensure_ascii=False)
+        with self._ready:
+            job = self._waiting.get(key)
+            if job is not None:
+                job.submitters += 1
+                return job
+            self._sequence += 1
+            priority = JOB_PRIORITIES.get(request["args"].get("output"), 1)
+            job = self._waiting[key] = _Job(request, key, priority, self._sequence)
+            heapq.heappush(self._heap, job)
+            self._ready.notify()
+            return job
+
+    def next(self):
+        """The next job to run, or None once the queue is closed"""
+        with self._ready:
+            while not self._heap and not self.closed:
+                self._ready.wait()
+            if not self._heap:
+                return None
+            job = heapq.heappop(self._heap)
+            del self._waiting[job.key]
+            return job
+
+    def close(self):
+        with self._ready:
+            self.closed = True
+            self._ready.notify_all()
+
+    def __len__(self):
+        with self._ready:
+            return len(self._heap)
+
+
+class SessionServer:
+    """Accepts jobs over IPC and runs them on the session's thread"""
+
+    def __init__(self, backend, host=SESSION_HOST, port=SESSION_PORT, **session_options):
+        self.backend = backend
+        self.address = (host, port)
+        self.session_options = session_options
+        self.queue = JobQueue()
+        self.session = None
+        self.jobs_run = 0
+        self._listener = None
+        self._worker = None
+
+    def serve_forever(self):
+        self._listener = Listener(self.address, authkey=read_session_key(create=True))
+        self.address = self._listener.address
+        self._worker = threading.Thread(target=self._run_jobs, name="office-session", daemon=True)
+        self._worker.start()
+        print(f"Office session listening on {self.address[0]}:{self.address[1]}")
+        try:
+            while not self.queue.closed:
+                try:
+                    connection = self._listener.accept()
+                except Exception as e:
+                    if not self.queue.closed:
+                        print(f"Rejected connection: {e}")
+                    continue
+                threading.Thread(target=self._handle, args=(connection,), daemon=True).start()
+        finally:
+            self.stop()
+            self._listener.close()
+            self._worker.join()
+
+    def stop(self):
+        """Stop taking jobs; the ones already queued still run"""
+        if self.queue.closed:
+            return
+        self.queue.close()
+        try:
+            socket.create_connection(self.address, timeout=1).close()  # wake up the accept() call
+        except OSError:
+            pass
+
+    def _handle(self, connection):
+        with connection:
+            try:
+                request = connection.recv()
+                kind = request.get("type")
+                if kind == "report":
+                    unknown = set(request.get("args", {})) - set(REPORT_JOB_ARGS)
+                    if unknown:
+                        connection.send({"error": f"unknown report arguments: {', '.join(sorted(unknown))}"})
+                        return
+                    job = self.queue.submit(request)
+                    while not job.done.wait(WORKER_CHECK_INTERVAL):
+                        if not self._worker.is_alive():
+                            job.result = {"failed": "the session's job thread has stopped"}
+                            break
+                    connection.send(job.result)
+                elif kind == "status":
+                    connection.send({"queued": len(self.queue), "jobs_run": self.jobs_run,
+                                     **(self.session.status() if self.session else {})})
+                elif kind == "stop":
+                    connection.send({"stopping": True})
+                    self.stop()
+                else:
+                    connection.send({"error": f"unknown request type: {kind}"})
+            except (EOFError, OSError):
+                pass  # client went away
+
+    def _run_jobs(self):
+        import autoEmail  # the daemon runs autoEmail's reports; autoEmail only imports this module for --session
+        try:
+            self.backend.thread_init()
+            self.session = OfficeSession(self.backend, **self.session_options)
+            autoEmail._office_session = self.session
+            while True:
+                job = self.queue.next()
+                if job is None:
+                    break
+                try:
+                    job.result = self._run_job(autoEmail, job)
+                except Exception:
+                    traceback.print_exc()
+                    job.result = {"failed": f"session error: {traceback.format_exc(limit=1).strip()}"}
+                job.done.set()
+        finally:
+            autoEmail._office_session = None
+            if self.session is not None:
+                self.session.close()
+            self.backend.thread_exit()
+            self.stop()  # after a crash too: waiting clients are answered, new ones refused
+
+    def _run_job(self, autoEmail, job):
+        args = job.request["args"]
+        self.session.begin_job()
+        reset_com_call_counts()
+        output = io.StringIO()
+        start_time = time.perf_counter()
+        exit_code = autoEmail.EXIT_ERROR
+        try:
+            with thread_output(output):
+                exit_code = autoEmail.run_report(**args)
+        except Exception:
+            output.write(traceback.format_exc())
+        finally:
+            profiling.drain()  # spans would otherwise pile up over the daemon's lifetime
+        self.session.end_job(exit_code != autoEmail.EXIT_OK)
+        self.jobs_run += 1
+        seconds = time.perf_counter() - start_time
+        print(f"Job {self.jobs_run}: months {args.get('months')} -> exit {exit_code} in {seconds:.2f}s"
+              + (f" ({job.submitters} submitters)" if job.submitters > 1 else ""))
+        return {"exit_code": exit_code, "output": output.getvalue(), "seconds": round(seconds, 3),
+                "submitters": job.submitters}
+
+
+def read_session_key(create=False, key_file=None):
+    """The IPC authentication key, created (readable by the user only) when the daemon starts"""
+    key_file = key_file or SESSION_KEY_FILE
+    if create and not os.path.exists(key_file):
+        os.makedirs(os.path.dirname(key_file), exist_ok=True)
+        descriptor = os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(descriptor, "wb") as f:
+            f.write(os.urandom(32))
+    with open(key_file, "rb") as f:
+        return f.read()
+
+
+def parse_address(text):
+    """'host:port', ':port' or 'port' -> (host, port)"""
+    host, _, port = str(text).rpartition(":")
+    return host or SESSION_HOST, int(port)
+
+
+def send_request(request, address=(SESSION_HOST, SESSION_PORT), timeout=None):
+    """Send one request to the daemon and wait (at most timeout seconds) for its answer"""
+    with Client(address, authkey=read_session_key()) as connection:
+        connection.send(request)
+        if timeout is not None and not connection.poll(timeout):
+            raise TimeoutError(f"no answer within {timeout:g}s")
+        return connection.recv()
+
+
+def submit_report(args, address=(SESSION_HOST, SESSION_PORT), timeout=SESSION_JOB_TIMEOUT):
+    """Run a report job (run_report keyword arguments) in the daemon; prints its output, returns the exit code"""
+    try:
+        result = send_request({"type": "report", "args": args}, address, timeout)
+    except TimeoutError as e:
+        print(f"Office session at {address[0]}:{address[1]} did not finish the job: {e}")
+        return 1  # autoEmail.EXIT_ERROR
+    except (OSError, EOFError) as e:
+        print(f"Office session at {address[0]}:{address[1]} is not available: {e}")
+        return 1  # autoEmail.EXIT_ERROR
+    if "error" in result:
+        print(f"Office session refused the job: {result['error']}")
+        return 2  # autoEmail.EXIT_USAGE
+    if "failed" in result:
+        print(f"Office session could not run the job: {result['failed']}")
+        return 1  # autoEmail.EXIT_ERROR
+    print(result["output"], end="")
+    print(f"Office session job finished in {result['seconds']:.2f}s")
+    return result["exit_code"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep Office warm and run report jobs sent by autoEmail.py --session.")
+    parser.add_argument("--address", default=f"{SESSION_HOST}:{SESSION_PORT}", help="host:port to listen on")
+    parser.add_argument("--fake", action="store_true", help="use in-process fake Office applications (no pywin32)")
+    parser.add_argument("--max-age", type=float, default=MAX_INSTANCE_AGE,
+                        help=f"seconds before an instance is restarted (default: {MAX_INSTANCE_AGE})")
+    parser.add_argument("--max-jobs", type=int, default=MAX_INSTANCE_JOBS,
+                        help=f"jobs before an instance is restarted (default: {MAX_INSTANCE_JOBS})")
+    parser.add_argument("--status", action="store_true", help="print the running daemon's state")
+    parser.add_argument("--stop", action="store_true", help="stop the running daemon once its queued jobs have run")
+    args = parser.parse_args()
+    address = parse_address(args.address)
+    if args.status or args.stop:
+        try:
+            print(json.dumps(send_request({"type": "stop" if args.stop else "status"}, address),
+                             ensure_ascii=False, indent=1))
+        except (OSError, EOFError) as e:
+            print(f"Office session at {address[0]}:{address[1]} is not available: {e}")
+            sys.exit(1)
+        sys.exit(0)
+    server = SessionServer(FakeOfficeBackend() if args.fake else ComBackend(), *address,
+                           max_age=args.max_age, max_jobs=args.max_jobs)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Office session stopped")
@@ -0,0 +1,164 @@
+"""A small staged pipeline: run independent stages concurrently, then report the overlap
+
+Each Stage names the stages whose results it needs; a stage starts as soon
+as those are done. Stages run on a thread pool, except inline stages, which
+run on the calling thread (Excel COM objects may only be used from the
+thread that created them). What pooled stages print is held back and
+printed from the calling thread as each one finishes, so their lines do not
+interleave. The report compares wall-clock time with the summed stage time,
+so the gain from overlapping is visible.
+"""
+import io
+import sys
+import time
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+_output_lock = threading.Lock()
+
+
+class ThreadOutput:
+    """sys.stdout/sys.stderr stand-in sending each thread's writes to the writer bound to it
+
+    Only threads inside thread_output() are bound; every other thread keeps
+    writing to the console stream that was wrapped.
+    """
+
+    def __init__(self, console):
+        self.console = console
+        self._writers = {}  # thread ident -> writer
+
+    def __getattr__(self, name):
+        return getattr(self.console, name)  # encoding, isatty(), ... of the console
+
+    def write(self, text):
+        return self._writers.get(threading.get_ident(), self.console).write(text)
+
+    def flush(self):
+        self._writers.get(threading.get_ident(), self.console).flush()
+
+
+@contextlib.contextmanager
+def thread_output(writer):
+    """Send this thread's writes to sys.stdout/sys.stderr to writer
+
+    The streams are wrapped in a ThreadOutput while any thread is bound (a
+    stream swapped in meanwhile is wrapped too) and unwrapped after the last.
+    """
+    ident = threading.get_ident()
+    with _output_lock:
+        streams = []
+        for name in ("stdout", "stderr"):
+            stream = getattr(sys, name)
+            if not isinstance(stream, ThreadOutput):
+                stream = ThreadOutput(stream)
+                setattr(sys, name, stream)
+            stream._writers[ident] = writer
+            streams.append((name, stream))
+    try:
+        yield writer
+    finally:
+        with _output_lock:
+            for name, stream in streams:
+                del stream._writers[ident]
+                if not stream._writers and getattr(sys, name) is stream:
+                    setattr(sys, name, stream.console)
+
+
+class Stage:
+    """One unit of work: func(*results of `requires`)"""
+
+    def __init__(self, name, func, requires=(), inline=False):
+        self.name = name
+        self.func = func
+        self.requires = tuple(requires)
+        self.inline = inline
+
+
+def _timed(func, args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, start, time.perf_counter()
+
+
+def _timed_quietly(output, func, args):
+    """_timed on a pool thread, printing to output instead of the console"""
+    with thread_output(output):
+        return _timed(func, args)
+
+
+def run_stages(stages, workers=None, label="Pipeline"):
+    """Run stages in dependency order, concurrently where possible
+
+    Returns (results by stage name, timing report). Raises the first stage error.
+    """
+    by_name = {stage.name: stage for stage in stages}
+    for stage in stages:
+        missing = [name for name in stage.requires if name not in by_name]
+        if missing:
+            raise ValueError(f"Stage {stage.name} requires unknown stage(s): {', '.join(missing)}")
+
+    results = {}
+    spans = {}
+    pending = list(stages)
+    running = {}
+    outputs = {}  # pooled stage name -> what it printed
+    pool_size = workers or max(1, sum(not stage.inline for stage in stages))
+    start_time = time.perf_counter()
+
+    def ready(stage):
+        return all(name in results for name in stage.requires)
+
+    def record(name, outcome):
+        results[name], start, end = outcome
+        spans[name] = (start, end)
+
+    def finish(future):
+        name = running.pop(future)
+        sys.stdout.write(outputs.pop(name).getvalue())  # before a failed stage's error is raised
+        record(name, future.result())
+
+    with ThreadPoolExecutor(max_workers=pool_size) as executor:
+        while pending or running:
+            for stage in [stage for stage in pending if not stage.inline and ready(stage)]:
+                pending.remove(stage)
+                args = [results[name] for name in stage.requires]
+                outputs[stage.name] = io.StringIO()
+                running[executor.submit(_timed_quietly, outputs[stage.name], stage.func, args)] = stage.name
+
+            inline_stage = next((stage for stage in pending if stage.inline and ready(stage)), None)
+            if inline_stage is not None:
+                # Pooled stages keep running while this one occupies the calling thread
+                pending.remove(inline_stage)
+                args = [results[name] for name in inline_stage.requires]
+                record(inline_stage.name, _timed(inline_stage.func, args))
+            elif running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    finish(future)
+            elif pending:
+                raise ValueError(f"Stages can never run (circular requirements): "
+                                 f"{', '.join(stage.name for stage in pending)}")
+
+            for future in [future for future in running if future.done()]:
+                finish(future)
+
+    wall_seconds = time.perf_counter() - start_time
+    report = {
+        "wall_seconds": wall_seconds,
+        "stage_seconds": sum(end - start for start, end in spans.values()),
+        "stages": {name: {"start": start - start_time, "seconds": end - start}
+                   for name, (start, end) in spans.items()},
+    }
+    print_stage_report(report, label)
+    return results, report
+
+
+def print_stage_report(report, label="Pipeline"):
+    """Print per-stage timings and wall-clock vs summed stage time"""
+    for name, span in sorted(report["stages"].items(), key=lambda item: item[1]["start"]):
+        print(f"  {name}: +{span['start'] * 1000:.1f} ms, {span['seconds'] * 1000:.1f} ms")
+    wall, summed = report["wall_seconds"], report["stage_seconds"]
+    overlap = f" ({summed / wall:.2f}x overlap)" if wall > 0 else ""
+    print(f"{label}: wall-clock {wall * 1000:.1f} ms vs {summed * 1000:.1f} ms summed stage time{overlap}")
@@ -0,0 +1,164 @@
+"""Timing spans and counters for one run, as JSON lines and a --profile summary
+
+span() / @timed record how long each stage and helper took (nested spans
+remember their parent), count() keeps run counters such as bytes read from
+the workbook. Events are kept in memory; write_json_lines() appends them to
+a trace file (one JSON object per line, tagged with a run id, so runs and
+backends can be compared over time) and print_profile() prints a table.
+
+Batch worker processes hand their events back with drain() and the parent
+merge()s them, so a batch run is profiled as a whole.
+"""
+import os
+import json
+import time
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+
+_events = []
+_counters = Counter()
+_lock = threading.Lock()
+_local = threading.local()
+_run = {"id": None, "start": time.perf_counter(), "info": {}}
+
+
+def reset(**info):
+    """Start a new run: clear events and counters and remember run metadata"""
+    with _lock:
+        _events.clear()
+        _counters.clear()
+        _run.update(id=time.strftime("%Y%m%dT%H%M%S") + f"-{os.getpid()}",
+                    start=time.perf_counter(), info=dict(info))
+
+
+def set_run_info(**info):
+    _run["info"].update(info)
+
+
+@contextmanager
+def span(name, **attributes):
+    """Time the enclosed block as a span called name"""
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    parent = stack[-1] if stack else None
+    stack.append(name)
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        end = time.perf_counter()
+        stack.pop()
+        event = {"event": "span", "name": name, "parent": parent,
+                 "start_ms": round((start - _run["start"]) * 1000, 3),
+                 "ms": round((end - start) * 1000, 3),
+                 "thread": threading.current_thread().name, "pid": os.getpid()}
+        event.update(attributes)
+        if error:
+            event["error"] = error
+        with _lock:
+            _events.append(event)
+
+
+def timed(name=None):
+    """Decorator recording every call of a function as a span"""
+    def decorate(func):
+        span_name = name or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(name, amount=1):
+    with _lock:
+        _counters[name] += amount
+
+
+def add_bytes(source, amount):
+    """Count bytes read from a source such as 'workbook', 'share' or 'signature'"""
+    count(f"bytes_read.{source}", amount)
+
+
+def get_counters():
+    with _lock:
+        return dict(_counters)
+
+
+def drain():
+    """Return and clear this process's events and counters (for batch workers)"""
+    with _lock:
+        collected = {"events": list(_events), "counters": dict(_counters)}
+        _events.clear()
+        _counters.clear()
+    return collected
+
+
+def merge(collected):
+    """Add events/counters drained in another process to this run"""
+    with _lock:
+        _events.extend(collected["events"])
+        _counters.update(collected["counters"])
+
+
+def summarize():
+    """Aggregate spans by name: {name: {"calls", "total_ms", "max_ms"}}"""
+    summary = {}
+    with _lock:
+        events = list(_events)
+    for event in events:
+        if event["event"] != "span":
+            continue
+        entry = summary.setdefault(event["name"], {"calls": 0, "total_ms": 0.0, "max_ms": 0.0})
+        entry["calls"] += 1
+        entry["total_ms"] += event["ms"]
+        entry["max_ms"] = max(entry["max_ms"], event["ms"])
+    for entry in summary.values():
+        entry["total_ms"] = round(entry["total_ms"], 3)
+    return summary
+
+
+def wall_ms():
+    return (time.perf_counter() - _run["start"]) * 1000
+
+
+def write_json_lines(path, extra_counters=None):
+    """Append this run's spans and a summary record to a JSON lines file"""
+    with _lock:
+        events = list(_events)
+        counters = dict(_counters)
+    summary = {"event": "summary", "wall_ms": round(wall_ms(), 3), "counters": counters,
+               "spans": summarize(), **_run["info"]}
+    if extra_counters:
+        summary["counters"].update(extra_counters)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        for event in events + [summary]:
+            f.write(json.dumps({"run": _run["id"], **event}, ensure_ascii=False) + "\n")
+
+
+def print_profile(extra_counters=None):
+    """Print a per-span summary table (sorted by total time) and the run counters"""
+    total = wall_ms()
+    summary = summarize()
+    print(f"\nProfile (wall-clock {total:.1f} ms)")
+    print(f"{'span':<36} {'calls':>6} {'total ms':>10} {'mean ms':>9} {'max ms':>9} {'% wall':>7}")
+    for name, entry in sorted(summary.items(), key=lambda item: -item[1]["total_ms"]):
+        share = entry["total_ms"] / total * 100 if total > 0 else 0
+        print(f"{name:<36} {entry['calls']:>6} {entry['total_ms']:>10.1f} "
+              f"{entry['total_ms'] / entry['calls']:>9.2f} {entry['max_ms']:>9.1f} {share:>6.1f}%")
+    counters = get_counters()
+    counters.update(extra_counters or {})
+    for name, value in sorted(counters.items()):
+        print(f"  {name}: {value:,}")
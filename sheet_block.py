@@ -0,0 +1,138 @@
+"""Batched worksheet access: read whole blocks of cells in one backend call
+
+Every worksheet.Range(...) property read is a cross-process round trip on
+the COM backend, so metric lookups and table rendering read an in-memory
+SheetBlock instead of touching cells one at a time. All reads made through
+this module are counted so a run can report how many calls it made.
+"""
+import threading
+from collections import Counter
+
+from numfmt import format_value
+from profiling import span
+from xlsx_reader import parse_range_address, column_to_index, index_to_column
+
+_com_calls = Counter()
+_com_calls_lock = threading.Lock()
+
+
+def count_com_call(kind):
+    """Record one COM/backend call of the given kind"""
+    with _com_calls_lock:
+        _com_calls[kind] += 1
+
+
+def get_com_call_counts():
+    """Return a copy of the per-kind COM/backend call counters"""
+    return dict(_com_calls)
+
+
+def get_com_call_total():
+    return sum(_com_calls.values())
+
+
+def reset_com_call_counts():
+    _com_calls.clear()
+
+
+def add_com_call_counts(counts):
+    """Add call counts collected elsewhere (e.g. in a batch worker process)"""
+    with _com_calls_lock:
+        _com_calls.update(counts)
+
+
+def _as_grid(block):
+    """Normalize a COM Range value (scalar for one cell) to a tuple of row tuples"""
+    if isinstance(block, tuple):
+        return tuple(tuple(row) for row in block)
+    return ((block,),)
+
+
+class SheetBlock:
+    """In-memory copy of a rectangular worksheet region (values plus display text)"""
+
+    def __init__(self, worksheet, address):
+        self.worksheet = worksheet
+        self.address = address
+        self.first_row, self.first_col, self.last_row, self.last_col = parse_range_address(address)
+        range_obj = worksheet.Range(address)
+        count_com_call("Range.Value")
+        self.values = _as_grid(range_obj.Value)
+        self.texts = None
+        self._lazy_texts = {}
+        self._row_formats = {}
+
+        # The headless reader returns display text for a whole block at once;
+        # on COM, text is computed locally from one NumberFormat read per row
+        if worksheet_supports_block_text(worksheet):
+            count_com_call("Range.Text")
+            self.texts = _as_grid(range_obj.Text)
+
+    @property
+    def row_count(self):
+        return self.last_row - self.first_row + 1
+
+    @property
+    def column_count(self):
+        return self.last_col - self.first_col + 1
+
+    def value(self, row, col):
+        """Raw value of a cell inside the block"""
+        col = _col_index(col)
+        return self.values[row - self.first_row][col - self.first_col]
+
+    def text(self, row, col):
+        """Display text (Range.Text) of a cell inside the block"""
+        col = _col_index(col)
+        if self.texts is not None:
+            return self.texts[row - self.first_row][col - self.first_col]
+        if (row, col) not in self._lazy_texts:
+            number_format = self._row_number_format(row)
+            if number_format is not None:
+                text = format_value(self.value(row, col), number_format)
+            else:
+                # Mixed formats in this row: ask Excel for this cell's text
+                count_com_call("Range.Text")
+                text = self.worksheet.Range(f"{index_to_column(col)}{row}").Text
+            self._lazy_texts[(row, col)] = text
+        return self._lazy_texts[(row, col)]
+
+    def _row_number_format(self, row):
+        """NumberFormat shared by a block row (None when the cells differ)"""
+        if row not in self._row_formats:
+            count_com_call("Range.NumberFormat")
+            address = f"{index_to_column(self.first_col)}{row}:{index_to_column(self.last_col)}{row}"
+            number_format = self.worksheet.Range(address).NumberFormat
+            self._row_formats[row] = number_format if isinstance(number_format, str) else None
+        return self._row_formats[row]
+
+    def text_grid(self):
+        """Display text of every cell as a tuple of row tuples"""
+        if self.texts is None:
+            self.texts = tuple(
+                tuple(self.text(row, col) for col in range(self.first_col, self.last_col + 1))
+                for row in range(self.first_row, self.last_row + 1)
+            )
+        return self.texts
+
+
+def _col_index(col):
+    return column_to_index(col) if isinstance(col, str) else col
+
+
+def worksheet_supports_block_text(worksheet):
+    """True when Range.Text returns a whole grid (headless reader) instead of one string"""
+    return getattr(worksheet, "supports_block_text", False)
+
+
+def read_block(worksheet, address):
+    """Read a region such as 'Q50:AC60' in one backend call"""
+    with span("read_block", sheet=worksheet.Name, address=address):
+        return SheetBlock(worksheet, address)
+
+
+def read_number_format(worksheet, row, col):
+    """Number format code of one cell (None when the backend gives none)"""
+    count_com_call("Range.NumberFormat")
+    number_format = worksheet.Range(f"{index_to_column(_col_index(col))}{row}").NumberFormat
+    return number_format if isinstance(number_format, str) else None
@@ -0,0 +1,262 @@
+"""Mail signature from SIGN.docx, parsed straight from its zip/XML (no Word)
+
+The .docx is turned into a ready-to-insert HTML fragment once and cached on
+disk under the SHA-256 of the file, so later runs only hash the file and
+read the cached fragment until the signature document changes.
+"""
+import os
+import json
+import base64
+import hashlib
+import html
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ET
+
+from profiling import add_bytes, timed
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+R = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+A = "{http://schemas.openxmlformats.org/drawingml/2006/main}"
+WP = "{http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing}"
+PKG_REL = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+EMU_PER_PIXEL = 9525
+JUSTIFY_CSS = {"center": "center", "right": "right", "end": "right", "both": "justify"}
+HIGHLIGHT_CSS = {"yellow": "#FFFF00", "green": "#00FF00", "cyan": "#00FFFF", "magenta": "#FF00FF",
+                 "blue": "#0000FF", "red": "#FF0000", "lightGray": "#D3D3D3", "darkGray": "#A9A9A9"}
+
+SIGNATURE_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".autoEmail_cache", "signature")
+
+
+class Signature:
+    """An HTML signature fragment plus the images it references as cid:<id>"""
+
+    def __init__(self, html_fragment, images):
+        self.html = html_fragment
+        self.images = images  # {content id: (bytes, image subtype)}
+
+    def inline_html(self):
+        """The fragment with images embedded as data: URIs (for standalone .html files)"""
+        fragment = self.html
+        for content_id, (data, subtype) in self.images.items():
+            data_uri = f"data:image/{subtype};base64,{base64.b64encode(data).decode('ascii')}"
+            fragment = fragment.replace(f"cid:{content_id}", data_uri)
+        return fragment
+
+
+def _val(elem, tag):
+    child = elem.find(W + tag) if elem is not None else None
+    return None if child is None else child.get(W + "val", "true")
+
+
+def _is_on(value):
+    return value is not None and value not in ("0", "false", "off")
+
+
+def _run_css(run_properties):
+    css = []
+    if run_properties is None:
+        return css
+    if _is_on(_val(run_properties, "b")):
+        css.append("font-weight:bold")
+    if _is_on(_val(run_properties, "i")):
+        css.append("font-style:italic")
+    underline = _val(run_properties, "u")
+    if underline is not None and underline != "none":
+        css.append("text-decoration:underline")
+    color = _val(run_properties, "color")
+    if color and color != "auto":
+        css.append(f"color:#{color}")
+    size = _val(run_properties, "sz")
+    if size:
+        css.append(f"font-size:{int(size) / 2:g}pt")
+    fonts = run_properties.find(W + "rFonts")
+    if fonts is not None:
+        names = []
+        for key in ("ascii", "eastAsia"):
+            name = fonts.get(W + key)
+            if name and name not in names:
+                names.append(name)
+        if names:
+            css.append("font-family:" + ",".join(f"'{name}'" for name in names))
+    highlight = _val(run_properties, "highlight")
+    if highlight in HIGHLIGHT_CSS:
+        css.append(f"background:{HIGHLIGHT_CSS[highlight]}")
+    return css
+
+
+class _DocxConverter:
+    """Convert the body of a .docx document into an HTML fragment"""
+
+    def __init__(self, archive):
+        self.archive = archive
+        self.rels = {}
+        self.images = {}
+        rels_name = "word/_rels/document.xml.rels"
+        if rels_name in archive.namelist():
+            root = ET.fromstring(archive.read(rels_name))
+            for rel in root.iter(PKG_REL + "Relationship"):
+                self.rels[rel.get("Id")] = (rel.get("Target"), rel.get("TargetMode"))
+
+    def convert(self):
+        body = ET.fromstring(self.archive.read("word/document.xml")).find(W + "body")
+        parts = [self._block(child) for child in body]
+        return "".join(part for part in parts if part)
+
+    def _block(self, elem):
+        if elem.tag == W + "p":
+            return self._paragraph(elem)
+        if elem.tag == W + "tbl":
+            return self._table(elem)
+        return ""
+
+    def _paragraph(self, paragraph):
+        css = ["margin:0"]
+        properties = paragraph.find(W + "pPr")
+        justify = _val(properties, "jc")
+        if justify in JUSTIFY_CSS:
+            css.append(f"text-align:{JUSTIFY_CSS[justify]}")
+        content = "".join(self._inline(child) for child in paragraph)
+        return f'<p style="{";".join(css)}">{content or "&nbsp;"}</p>'
+
+    def _inline(self, elem):
+        if elem.tag == W + "r":
+            return self._run(elem)
+        if elem.tag == W + "hyperlink":
+            inner = "".join(self._inline(child) for child in elem)
+            target = self.rels.get(elem.get(R + "id"), (None, None))[0]
+            if target:
+                return f'<a href="{html.escape(target, quote=True)}">{inner}</a>'
+            return inner
+        if elem.tag in (W + "ins", W + "smartTag", W + "sdt", W + "sdtContent", W + "fldSimple"):
+            return "".join(self._inline(child) for child in elem)
+        return ""
+
+    def _run(self, run):
+        pieces = []
+        for child in run:
+            if child.tag == W + "t":
+                pieces.append(html.escape(child.text or ""))
+            elif child.tag == W + "tab":
+                pieces.append("&emsp;")
+            elif child.tag in (W + "br", W + "cr"):
+                pieces.append("<br>")
+            elif child.tag == W + "drawing":
+                pieces.append(self._drawing(child))
+        text = "".join(pieces)
+        css = _run_css(run.find(W + "rPr"))
+        if text and css:
+            return f'<span style="{";".join(css)}">{text}</span>'
+        return text
+
+    def _drawing(self, drawing):
+        blip = drawing.find(f".//{A}blip")
+        if blip is None:
+            return ""
+        target = self.rels.get(blip.get(R + "embed"), (None, None))[0]
+        if not target:
+            return ""
+        part_name = posixpath.normpath(posixpath.join("word", target))
+        if part_name not in self.archive.namelist():
+            return ""
+        data = self.archive.read(part_name)
+        subtype = posixpath.splitext(part_name)[1].lstrip(".").lower().replace("jpg", "jpeg")
+        content_id = f"sign-{hashlib.sha1(data).hexdigest()[:12]}"
+        self.images[content_id] = (data, subtype)
+
+        size = ""
+        extent = drawing.find(f".//{WP}extent")
+        if extent is not None:
+            width = round(int(extent.get("cx")) / EMU_PER_PIXEL)
+            height = round(int(extent.get("cy")) / EMU_PER_PIXEL)
+            size = f' width="{width}" height="{height}"'
+        return f'<img src="cid:{content_id}"{size} alt="">'
+
+    def _table(self, table):
+        rows = []
+        for row in table.findall(W + "tr"):
+            cells = []
+            for cell in row.findall(W + "tc"):
+                span = _val(cell.find(W + "tcPr"), "gridSpan")
+                colspan = f' colspan="{span}"' if span and span != "1" else ""
+                content = "".join(self._block(child) for child in cell)
+                cells.append(f'<td{colspan} style="vertical-align:top;padding:0 4px">{content}</td>')
+            rows.append(f"<tr>{''.join(cells)}</tr>")
+        return f'<table cellspacing="0" cellpadding="0" style="border-collapse:collapse">{"".join(rows)}</table>'
+
+
+@timed()
+def convert_docx_to_html(docx_path):
+    """Parse a .docx into a Signature (HTML fragment + images)"""
+    with zipfile.ZipFile(docx_path) as archive:
+        converter = _DocxConverter(archive)
+        fragment = converter.convert()
+    return Signature(f'<div class="signature">{fragment}</div>', converter.images)
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            add_bytes("signature", len(chunk))
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _load_cached(cache_dir, file_hash):
+    try:
+        with open(os.path.join(cache_dir, f"{file_hash}.json"), encoding="utf-8") as f:
+            entry = json.load(f)
+        images = {}
+        for content_id, (file_name, subtype) in entry["images"].items():
+            with open(os.path.join(cache_dir, file_name), "rb") as f:
+                images[content_id] = (f.read(), subtype)
+        return Signature(entry["html"], images)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _save_cached(cache_dir, file_hash, signature):
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        images = {}
+        for content_id, (data, subtype) in signature.images.items():
+            file_name = f"{content_id}.{subtype}"
+            with open(os.path.join(cache_dir, file_name), "wb") as f:
+                f.write(data)
+            images[content_id] = [file_name, subtype]
+        entry_path = os.path.join(cache_dir, f"{file_hash}.json")
+        temp_path = f"{entry_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"html": signature.html, "images": images}, f, ensure_ascii=False)
+        os.replace(temp_path, entry_path)
+    except OSError as e:
+        print(f"Warning: could not cache signature: {e}")
+
+
+def image_cache_path(content_id, subtype, cache_dir=SIGNATURE_CACHE_DIR):
+    """Path of a cached signature image (used to attach it to an Outlook mail)"""
+    return os.path.join(cache_dir, f"{content_id}.{subtype}")
+
+
+@timed()
+def load_signature(docx_path, cache_dir=SIGNATURE_CACHE_DIR):
+    """Return the Signature for docx_path, converting it only when its content changed
+
+    Returns None when the file is missing or cannot be parsed.
+    """
+    if not os.path.exists(docx_path):
+        print(f"Signature file not found: {docx_path}")
+        return None
+    try:
+        file_hash = _file_sha256(docx_path)
+        signature = _load_cached(cache_dir, file_hash)
+        if signature is None:
+            signature = convert_docx_to_html(docx_path)
+            _save_cached(cache_dir, file_hash, signature)
+            print(f"Signature parsed from {docx_path} and cached")
+        return signature
+    except (OSError, zipfile.BadZipFile, ET.ParseError, KeyError) as e:
+        print(f"Error reading signature {docx_path}: {e}")
+        return None
@@ -0,0 +1,376 @@
+"""MIME message building and pooled SMTP delivery (an alternative to Outlook)
+
+build_mime_message() turns the rendered report into a standards-compliant
+multipart message (plain text + HTML body, with the tables and signature
+inline, and any signature images attached as related parts).
+
+SMTPConnectionPool keeps a few authenticated connections open so a batch of
+messages does not pay for a TCP/TLS/AUTH handshake per message, and sends
+with ESMTP PIPELINING (RFC 2920) when the server offers it, so a long
+distribution list costs one round trip per recipient batch rather than one
+per RCPT TO. LocalSMTPServer is a small in-process stand-in for trying the
+path out without a real mail server.
+"""
+import re
+import copy
+import html
+import queue
+import smtplib
+import socketserver
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+from email.policy import SMTP as SMTP_POLICY
+from email.utils import formatdate, make_msgid
+
+from profiling import timed
+
+# Most servers cap the number of RCPT TO commands per transaction
+MAX_RECIPIENTS_PER_TRANSACTION = 100
+
+TAG_RE = re.compile(r"<[^>]+>")
+HEAD_RE = re.compile(r"<head>.*?</head>", re.IGNORECASE | re.DOTALL)
+BREAK_RE = re.compile(r"<br\s*/?>|</p>|</tr>|</div>", re.IGNORECASE)
+
+
+def html_to_text(html_body):
+    """Rough plain text alternative of an HTML body"""
+    text = BREAK_RE.sub("\n", HEAD_RE.sub("", html_body).replace("\n", ""))
+    text = re.sub(r"</t[dh]>", "\t", text, flags=re.IGNORECASE)
+    text = html.unescape(TAG_RE.sub("", text))
+    return "\n".join(line.rstrip() for line in text.splitlines()).strip() + "\n"
+
+
+def build_mime_message(subject, html_body, sender, recipients, cc=(), text_body=None,
+                       inline_images=None):
+    """Build a multipart/alternative (and related, when there are images) report message
+
+    inline_images maps a Content-ID (referenced as cid:<id> in the HTML) to
+    (bytes, mime subtype), e.g. {"sign-logo": (png_bytes, "png")}.
+    """
+    message = EmailMessage()
+    message["Subject"] = subject
+    message["From"] = sender
+    message["To"] = ", ".join(recipients)
+    if cc:
+        message["Cc"] = ", ".join(cc)
+    message["Date"] = formatdate(localtime=True)
+    message["Message-ID"] = make_msgid()
+
+    message.set_content(text_body or html_to_text(html_body))
+    message.add_alternative(html_body, subtype="html")
+    if inline_images:
+        html_part = message.get_payload()[1]
+        for content_id, (data, subtype) in inline_images.items():
+            html_part.add_related(data, maintype="image", subtype=subtype, cid=f"<{content_id}>")
+    return message
+
+
+class SMTPConnectionPool:
+    """A small pool of persistent SMTP connections"""
+
+    def __init__(self, host, port=25, size=2, username=None, password=None,
+                 starttls=False, use_ssl=False, timeout=30):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        smtp_class = smtplib.SMTP_SSL if self.use_ssl else smtplib.SMTP
+        connection = smtp_class(self.host, self.port, timeout=self.timeout)
+        connection.ehlo()
+        if self.starttls:
+            connection.starttls()
+            connection.ehlo()
+        if self.username:
+            connection.login(self.username, self.password or "")
+        return connection
+
+    def acquire(self):
+        """Take an idle (still alive) connection, or open a new one while below the pool size
+
+        Waiters are woken by a released connection or by a discarded one
+        (a None in the idle queue), after which the pool size is checked again.
+        """
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    reserved = self._created < self.size
+                    if reserved:
+                        self._created += 1
+                if reserved:
+                    # Outside the lock: new connections are set up (TCP/TLS/AUTH) side by side
+                    try:
+                        return self._connect()
+                    except Exception:
+                        with self._lock:
+                            self._created -= 1
+                        self._idle.put(None)
+                        raise
+                connection = self._idle.get()
+            if connection is None:
+                continue  # a connection was discarded: there may be room for a new one
+            try:
+                if connection.noop()[0] == 250:
+                    return connection
+            except smtplib.SMTPException:
+                pass
+            except OSError:
+                pass
+            self.discard(connection)
+
+    def release(self, connection):
+        self._idle.put(connection)
+
+    def discard(self, connection):
+        """Drop a broken connection so a fresh one can be opened in its place"""
+        with self._lock:
+            self._created -= 1
+        self._idle.put(None)
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close(self):
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if connection is None:
+                continue
+            try:
+                connection.quit()
+            except Exception:
+                connection.close()
+            with self._lock:
+                self._created -= 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def send(self, message):
+        """Send one EmailMessage to all its To/Cc/Bcc recipients; returns refused recipients"""
+        recipients = [address.addr_spec
+                      for header in ("To", "Cc", "Bcc") if message[header]
+                      for address in message[header].addresses]
+        sender = message["From"].addresses[0].addr_spec
+        if message["Bcc"]:
+            message = copy.copy(message)  # deleting rebinds the copy's header list; the caller's keeps Bcc
+            del message["Bcc"]
+        data = message.as_bytes(policy=SMTP_POLICY)
+
+        refused = {}
+        connection = self.acquire()
+        try:
+            for start in range(0, len(recipients), MAX_RECIPIENTS_PER_TRANSACTION):
+                batch = recipients[start:start + MAX_RECIPIENTS_PER_TRANSACTION]
+                refused.update(send_pipelined(connection, sender, batch, data))
+        except (smtplib.SMTPServerDisconnected, OSError):
+            self.discard(connection)
+            raise
+        except Exception:
+            self.release(connection)
+            raise
+        self.release(connection)
+        return refused
+
+
+def mail_options(connection, data):
+    """MAIL FROM parameters: BODY=8BITMIME when the data is not 7-bit clean and the server offers it"""
+    if not data.isascii() and connection.has_extn("8bitmime"):
+        return ["BODY=8BITMIME"]
+    return []
+
+
+def send_pipelined(connection, sender, recipients, data):
+    """Run one mail transaction, pipelining MAIL/RCPT/DATA when the server supports it
+
+    Returns {recipient: (code, message)} for refused recipients.
+    """
+    connection.ehlo_or_helo_if_needed()
+    options = mail_options(connection, data)
+    if not connection.has_extn("pipelining"):
+        try:
+            return connection.sendmail(sender, recipients, data, mail_options=options)
+        except smtplib.SMTPRecipientsRefused as e:
+            return e.recipients
+
+    # One write for the whole command group, then read the replies in order
+    mail_from = " ".join([f"MAIL FROM:<{sender}>"] + options)
+    commands = [mail_from] + [f"RCPT TO:<{recipient}>" for recipient in recipients] + ["DATA"]
+    connection.send("".join(command + "\r\n" for command in commands))
+
+    mail_code, mail_message = connection.getreply()
+    refused = {}
+    for recipient in recipients:
+        code, message = connection.getreply()
+        if code not in (250, 251):
+            refused[recipient] = (code, message)
+    data_code, data_message = connection.getreply()
+
+    if mail_code != 250 or len(refused) == len(recipients) or data_code != 354:
+        if data_code == 354:
+            connection.send(b".\r\n")  # abandon the message body we were invited to send
+            connection.getreply()
+        connection.rset()
+        if mail_code != 250:
+            raise smtplib.SMTPSenderRefused(mail_code, mail_message, sender)
+        if len(refused) == len(recipients):
+            raise smtplib.SMTPRecipientsRefused(refused)
+        raise smtplib.SMTPDataError(data_code, data_message)
+
+    body = re.sub(rb"(?m)^\.", b"..", data)
+    if not body.endswith(b"\r\n"):
+        body += b"\r\n"
+    connection.send(body + b".\r\n")
+    code, message = connection.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, message)
+    return refused
+
+
+@timed()
+def send_messages(pool, messages, workers=None):
+    """Send messages concurrently over the pool and report messages per second
+
+    Returns (sent count, {Message-ID: error}, {Message-ID: {recipient: (code, message)}}):
+    messages with refused recipients were still sent to the others.
+    """
+    workers = workers or pool.size
+    failures = {}
+    refusals = {}
+    start_time = time.perf_counter()
+
+    def deliver(message):
+        message_id = message["Message-ID"]
+        try:
+            return message_id, pool.send(message), None
+        except Exception as e:
+            return message_id, {}, e
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for message_id, refused, error in executor.map(deliver, messages):
+            if error is not None:
+                failures[message_id] = error
+                print(f"❌ {message_id}: {error}")
+            elif refused:
+                refusals[message_id] = refused
+                print(f"⚠ {message_id}: {len(refused)} recipient(s) refused: "
+                      + ", ".join(f"{recipient} ({code})" for recipient, (code, _) in refused.items()))
+
+    sent = len(messages) - len(failures)
+    seconds = time.perf_counter() - start_time
+    if seconds > 0:
+        print(f"SMTP: sent {sent}/{len(messages)} message(s) in {seconds:.2f}s "
+              f"({sent / seconds:.1f} messages/s)")
+    return sent, failures, refusals
+
+
+class _StandInHandler(socketserver.StreamRequestHandler):
+    """One SMTP session on the LocalSMTPServer"""
+
+    def reply(self, line):
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.sessions += 1
+        self.reply("220 localhost stand-in ESMTP")
+        sender, recipients = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("utf-8", "replace").strip()
+            verb = command[:4].upper()
+            if verb in ("EHLO", "HELO"):
+                self.wfile.write(b"250-localhost\r\n250-PIPELINING\r\n250-8BITMIME\r\n250 SIZE 52428800\r\n")
+            elif verb == "MAIL":
+                address, _, parameters = command[10:].strip().partition(" ")
+                sender, recipients = address.strip("<>"), []
+                server.mail_parameters.append(parameters.upper())
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                address = command[8:].strip().strip("<>")
+                if server.refuse and address in server.refuse:
+                    self.reply("550 No such user")
+                else:
+                    recipients.append(address)
+                    self.reply("250 OK")
+            elif verb == "DATA":
+                if not recipients:
+                    self.reply("503 No valid recipients")
+                    continue
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                lines = []
+                while True:
+                    data_line = self.rfile.readline()
+                    if not data_line or data_line == b".\r\n":
+                        break
+                    lines.append(data_line[1:] if data_line.startswith(b"..") else data_line)
+                with server.lock:
+                    server.messages.append((sender, list(recipients), b"".join(lines)))
+                self.reply("250 OK queued")
+            elif verb == "RSET":
+                sender, recipients = None, []
+                self.reply("250 OK")
+            elif verb == "NOOP":
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class LocalSMTPServer(socketserver.ThreadingTCPServer):
+    """In-process SMTP stand-in that keeps received messages in memory
+
+    with LocalSMTPServer() as server:
+        pool = SMTPConnectionPool("127.0.0.1", server.port)
+        ...
+        server.messages  # [(sender, recipients, raw message bytes)]
+        server.sessions  # connections opened
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0, refuse=()):
+        super().__init__((host, port), _StandInHandler)
+        self.messages = []
+        self.mail_parameters = []  # MAIL FROM parameters of each transaction, e.g. "BODY=8BITMIME"
+        self.sessions = 0  # SMTP connections accepted
+        self.refuse = set(refuse)
+        self.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,538 @@
+"""Local snapshot cache of the statistics workbook (avoids re-reading it over SMB)
+
+A snapshot holds the extracted worksheets in a compact columnar file: one
+array per cell attribute (row, column, kind, number, string id, style) plus
+a string table, laid out so the numeric columns are memory-mapped and used
+in place instead of being parsed. Styles, merges, column widths and
+formulas travel in a small JSON header. Besides the requested sheets, a
+snapshot stores every sheet their formulas read from (transitively), so
+recalculating from it resolves cross-sheet references like the original.
+
+Snapshots are tagged with the source file's size, mtime and SHA-256. A
+cache hit costs one stat() of the source; on a miss the file is read once
+(hashing it on the way), and when only its mtime changed the existing
+snapshot is re-tagged instead of rebuilt. The cache is kept under a size
+limit by evicting the least recently used snapshots (old months) first.
+"""
+import os
+import sys
+import json
+import mmap
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+import uuid
+from array import array
+from bisect import bisect_left, bisect_right
+
+from profiling import add_bytes, timed
+from numfmt import format_value
+from formula import referenced_sheets
+from xlsx_reader import XlsxWorkbook, XlsxWorksheet, open_workbook
+
+SNAPSHOT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".autoEmail_cache", "snapshots")
+SNAPSHOT_CACHE_LIMIT = 256 * 1024 * 1024  # bytes kept on disk across all snapshots
+SNAPSHOT_ORPHAN_AGE = 3600  # seconds before an unreferenced file in the cache is removed
+SNAPSHOT_MAGIC = b"AESNAP01"
+SNAPSHOT_VERSION = 2
+
+# Cell kinds stored in the "kinds" column
+KIND_EMPTY, KIND_NUMBER, KIND_STRING, KIND_BOOL = 0, 1, 2, 3
+
+# Column name -> array typecode; all columns of a sheet have one entry per stored cell
+COLUMNS = (("rows", "I"), ("cols", "I"), ("kinds", "B"), ("numbers", "d"),
+           ("strings", "I"), ("styles", "I"))
+
+
+class SnapshotWorksheet(XlsxWorksheet):
+    """A worksheet whose cells come from the memory-mapped snapshot columns"""
+
+    def __init__(self, workbook, name, columns, layout, formulas, shared_formulas, column_offsets=None):
+        super().__init__(workbook, name, None)
+        self._columns = columns
+        self._column_offsets = column_offsets  # name -> [file offset, typecode, count]
+        self._layout = layout
+        self.formulas = formulas
+        self.shared_formulas = shared_formulas
+
+    def ensure_rows(self, last_row):
+        """Materialize rows up to last_row from the columns (no XML involved)"""
+        with self._lock:
+            self._materialize(last_row)
+
+    def _materialize(self, last_row):
+        if self.fully_loaded or self.loaded_through >= last_row:
+            return
+        rows, cols, kinds, numbers, strings, styles = (self._columns[name] for name, _ in COLUMNS)
+        start = bisect_right(rows, self.loaded_through)
+        end = len(rows) if last_row == float("inf") else bisect_right(rows, last_row)
+        string_table = self.Parent.string_table
+        for index in range(start, end):
+            kind = kinds[index]
+            if kind == KIND_NUMBER:
+                value = numbers[index]
+            elif kind == KIND_STRING:
+                value = string_table[strings[index]]
+            elif kind == KIND_BOOL:
+                value = numbers[index] != 0
+            else:
+                value = None
+            self.rows.setdefault(rows[index], {})[cols[index]] = (value, styles[index])
+        if end == len(rows):
+            self.fully_loaded = True
+        else:
+            self.loaded_through = last_row
+
+    def scan_labels(self, labels, value_cols, label_cols=None):
+        """Like XlsxWorksheet.scan_labels, searching the mapped columns without materializing rows
+
+        A label's string ids are looked up as 4-byte patterns in the strings
+        column (a memchr-speed search of the mapped file), so only the cells
+        that hold them are looked at.
+        """
+        labels = {label for label in labels if label}
+        first_col, last_col = label_cols or (1, float("inf"))
+        if self.fully_loaded or self._column_offsets is None:
+            return self._scan_rows(labels, value_cols, first_col, last_col)
+        rows, cols = self._columns["rows"], self._columns["cols"]
+        first_cells = {}  # label -> index of its first cell in row-major order
+        for string_id, label in self.Parent.shared_string_ids(labels).items():
+            for index in self._string_cells(string_id):
+                if index >= first_cells.get(label, len(rows)):
+                    break
+                if first_col <= cols[index] <= last_col:
+                    first_cells[label] = index
+                    break
+        kinds, numbers, strings, styles = (self._columns[name] for name in ("kinds", "numbers", "strings", "styles"))
+        string_table = self.Parent.string_table
+        found = {}
+        for label, index in first_cells.items():
+            row = rows[index]
+            cells = {}
+            for cell in range(bisect_left(rows, row), bisect_right(rows, row)):
+                if cols[cell] not in value_cols:
+                    continue
+                kind, value = kinds[cell], None
+                if kind == KIND_NUMBER:
+                    value = numbers[cell]
+                elif kind == KIND_STRING:
+                    value = string_table[strings[cell]]
+                elif kind == KIND_BOOL:
+                    value = numbers[cell] != 0
+                cells[cols[cell]] = (value, styles[cell])
+            values = {}
+            for col in value_cols:
+                value, style = cells.get(col, (None, 0))
+                value = self._evaluate(row, col, value)
+                values[col] = (value, format_value(value, self.Parent.number_format(style)))
+            found[label] = (row, values)
+        return found
+
+    def _string_cells(self, string_id):
+        """Indices of the cells holding a string id, in row-major order"""
+        kinds, strings = self._columns["kinds"], self._columns["strings"]
+        data = self.Parent._mmap
+        if string_id == 0:
+            # Non-string cells store id 0 too, so walk the string cells instead
+            start = self._column_offsets["kinds"][0]
+            end = start + len(kinds)
+            position = data.find(bytes([KIND_STRING]), start, end)
+            while position != -1:
+                if strings[position - start] == 0:
+                    yield position - start
+                position = data.find(bytes([KIND_STRING]), position + 1, end)
+            return
+        pattern = array("I", [string_id]).tobytes()
+        start = self._column_offsets["strings"][0]
+        end = start + len(strings) * strings.itemsize
+        position = data.find(pattern, start, end)
+        while position != -1:
+            index, misaligned = divmod(position - start, strings.itemsize)
+            if not misaligned and kinds[index] == KIND_STRING:
+                yield index
+            position = data.find(pattern, position + 1, end)
+
+    def layout(self):
+        return self._layout
+
+    def _iter_rows(self):
+        return iter(())
+
+
+class SnapshotWorkbook(XlsxWorkbook):
+    """A workbook loaded from a snapshot file; behaves like XlsxWorkbook"""
+
+    def __init__(self, snapshot_path, source_path, source_mtime, recalculate=False, source_version=None):
+        self.FullName = os.path.abspath(source_path)
+        self.Name = os.path.basename(source_path)
+        self.source_mtime = source_mtime
+        self.source_version = source_version  # (size, mtime_ns, sha256) of the source the snapshot holds
+        self.recalculate = recalculate
+        self._formula_engine = None
+        self._lock = threading.RLock()
+        self._views = []
+
+        with open(snapshot_path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._mmap)
+        self._views.append(buffer)
+        if bytes(buffer[:8]) != SNAPSHOT_MAGIC:
+            self.Close()
+            raise ValueError(f"Not a workbook snapshot: {snapshot_path}")
+        header_length = int.from_bytes(buffer[8:16], "little")
+        header = json.loads(bytes(buffer[16:16 + header_length]).decode("utf-8"))
+        if header["version"] != SNAPSHOT_VERSION or header["byteorder"] != sys.byteorder:
+            self.Close()
+            raise ValueError(f"Incompatible workbook snapshot: {snapshot_path}")
+
+        def column(offset, typecode, count):
+            view = buffer[offset:offset + count * array(typecode).itemsize].cast(typecode)
+            self._views.append(view)
+            return view
+
+        self._number_formats = header["number_formats"]
+        self._cell_formats = header["cell_formats"]
+        self._string_offsets = column(*header["string_offsets"])
+        self._string_data_span = tuple(header["string_data"])
+        self._string_data = buffer[header["string_data"][0]:header["string_data"][0] + header["string_data"][1]]
+        self._views.append(self._string_data)
+        self.string_table = _StringTable(self._string_offsets, self._string_data)
+
+        self._sheets = {}
+        for sheet in header["sheets"]:
+            columns = {name: column(*sheet["columns"][name]) for name, _ in COLUMNS}
+            merges = [tuple(merge) for merge in sheet["merges"]]
+            widths = {int(col): width for col, width in sheet["widths"].items()}
+            formulas = {}
+            for row, col, source in sheet["formulas"]:
+                formulas[(row, col)] = tuple(source) if isinstance(source, list) else source
+            shared = {index: tuple(master) for index, master in sheet["shared_formulas"].items()}
+            self._sheets[sheet["name"]] = SnapshotWorksheet(self, sheet["name"], columns, (merges, widths),
+                                                            formulas, shared, sheet["columns"])
+
+    @property
+    def shared_strings(self):
+        return self.string_table
+
+    def shared_string_ids(self, texts):
+        """Like XlsxWorkbook.shared_string_ids, byte-searching the mapped string blob"""
+        start, length = self._string_data_span
+        ids = {}
+        for text in {text for text in texts if text}:
+            needle = text.encode("utf-8")
+            position = self._mmap.find(needle, start, start + length)
+            while position != -1:
+                index = bisect_right(self._string_offsets, position - start) - 1
+                if self.string_table[index].strip() == text:
+                    ids[index] = text
+                position = self._mmap.find(needle, position + 1, start + length)
+        return ids
+
+    def Close(self, save_changes=False):
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._mmap.close()
+
+
+class _StringTable:
+    """Strings decoded on first use from the snapshot's UTF-8 blob"""
+
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+        self.decoded = {}
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if index not in self.decoded:
+            self.decoded[index] = bytes(self.data[self.offsets[index]:self.offsets[index + 1]]).decode("utf-8")
+        return self.decoded[index]
+
+
+def precedent_sheets(workbook, sheet_names):
+    """sheet_names plus every sheet their formulas reference, directly or through other sheets"""
+    wanted = set(sheet_names)
+    pending = list(wanted)
+    while pending:
+        name = pending.pop()
+        worksheet = workbook.worksheet(name)
+        if worksheet is None:
+            continue
+        worksheet.ensure_rows(float("inf"))
+        texts = [source for source in worksheet.formulas.values() if isinstance(source, str)]
+        texts.extend(master[2] for master in worksheet.shared_formulas.values())
+        for text in texts:
+            for referenced in referenced_sheets(text, name) - wanted:
+                if workbook.worksheet(referenced) is None:
+                    print(f"Formula on {name} refers to missing sheet {referenced!r} (evaluates to #REF!)")
+                else:
+                    pending.append(referenced)
+                wanted.add(referenced)
+    return wanted
+
+
+@timed()
+def write_snapshot(workbook, snapshot_path, sheet_names=None):
+    """Write the given worksheets of an XlsxWorkbook (default: all) and the sheets their formulas read to a snapshot file"""
+    strings = {}
+    string_blob = bytearray()
+    string_offsets = array("I", [0])
+    sheets = []
+    if sheet_names is not None:
+        sheet_names = precedent_sheets(workbook, sheet_names)
+
+    for worksheet in workbook.Worksheets:
+        if sheet_names is not None and worksheet.Name not in sheet_names:
+            continue
+        worksheet.ensure_rows(float("inf"))
+        columns = {name: array(typecode) for name, typecode in COLUMNS}
+        for row in sorted(worksheet.rows):
+            for col, (value, style) in sorted(worksheet.rows[row].items()):
+                number, string_id, kind = 0.0, 0, KIND_EMPTY
+                if isinstance(value, bool):
+                    kind, number = KIND_BOOL, float(value)
+                elif isinstance(value, (int, float)):
+                    kind, number = KIND_NUMBER, float(value)
+                elif isinstance(value, str):
+                    kind = KIND_STRING
+                    if value not in strings:
+                        strings[value] = len(strings)
+                        string_blob += value.encode("utf-8")
+                        string_offsets.append(len(string_blob))
+                    string_id = strings[value]
+                for name, item in zip(("rows", "cols", "kinds", "numbers", "strings", "styles"),
+                                      (row, col, kind, number, string_id, style)):
+                    columns[name].append(item)
+        merges, widths = worksheet.layout()
+        sheets.append({
+            "name": worksheet.Name,
+            "columns": {name: columns[name] for name, _ in COLUMNS},
+            "merges": [list(merge) for merge in merges],
+            "widths": {str(col): width for col, width in widths.items()},
+            "formulas": [[row, col, list(source) if isinstance(source, tuple) else source]
+                         for (row, col), source in sorted(worksheet.formulas.items())],
+            "shared_formulas": {index: list(master) for index, master in worksheet.shared_formulas.items()},
+        })
+
+    workbook._load_styles()
+    header = {
+        "version": SNAPSHOT_VERSION,
+        "byteorder": sys.byteorder,
+        "number_formats": workbook._number_formats,
+        "cell_formats": workbook._cell_formats,
+        "sheets": sheets,
+    }
+    # Lay the arrays out after the header, each 8-byte aligned so it can be cast in place
+    arrays = [("string_offsets", string_offsets, header)]
+    for sheet in sheets:
+        arrays.extend((name, sheet["columns"][name], sheet["columns"]) for name, _ in COLUMNS)
+    header_length = 0
+    while True:
+        offset = _align(16 + header_length)
+        for name, values, owner in arrays:
+            owner[name] = [offset, values.typecode, len(values)]
+            offset = _align(offset + len(values) * values.itemsize)
+        header["string_data"] = [offset, len(string_blob)]
+        header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+        if len(header_bytes) <= header_length:
+            header_bytes = header_bytes.ljust(header_length)
+            break
+        header_length = len(header_bytes)  # offsets moved with the header size; lay out again
+
+    temp_path = f"{snapshot_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(SNAPSHOT_MAGIC + header_length.to_bytes(8, "little") + header_bytes)
+        for name, values, owner in arrays:
+            f.write(b"\0" * (owner[name][0] - f.tell()))
+            values.tofile(f)
+        f.write(b"\0" * (header["string_data"][0] - f.tell()))
+        f.write(string_blob)
+    os.replace(temp_path, snapshot_path)
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+class SnapshotCache:
+    """Snapshots of source workbooks, one metadata file per source tagged with size/mtime/hash
+
+    Each source has its own small JSON entry (named after a hash of its
+    path) that is replaced atomically, so parallel workers never rewrite
+    each other's entries. A hit only reads the entry and touches its mtime,
+    which is what eviction orders by.
+    """
+
+    def __init__(self, cache_dir=SNAPSHOT_CACHE_DIR, limit=SNAPSHOT_CACHE_LIMIT):
+        self.cache_dir = cache_dir
+        self.limit = limit
+
+    def _entry_path(self, source_path):
+        key = hashlib.sha256(source_path.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    @staticmethod
+    def _load_entry(entry_path):
+        try:
+            with open(entry_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _save_entry(entry_path, entry):
+        temp_path = f"{entry_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False, indent=1)
+        os.replace(temp_path, entry_path)
+
+    @timed("snapshot_open")
+    def open(self, source_path, sheet_names=None, recalculate=False):
+        """Open source_path through its snapshot, (re)building the snapshot when the file changed"""
+        source_path = os.path.abspath(source_path)
+        stat = os.stat(source_path)  # the only access to the share on a hit
+        entry_path = self._entry_path(source_path)
+        entry = previous = self._load_entry(entry_path)
+        wanted = sorted(sheet_names) if sheet_names is not None else None
+        if entry and (entry.get("source") != source_path or entry.get("sheets") != wanted):
+            entry = None
+
+        if entry and (entry["size"], entry["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns):
+            workbook = self._open_entry(entry, source_path, stat, recalculate)
+            if workbook is not None:
+                self._touch(entry_path)
+                print(f"Snapshot hit: {os.path.basename(source_path)}")
+                return workbook
+
+        # Miss: copy the file locally once, hashing it on the way
+        os.makedirs(self.cache_dir, exist_ok=True)
+        file_hash, local_copy = self._copy_with_hash(source_path)
+        try:
+            if entry and entry["sha256"] == file_hash:
+                entry.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+                workbook = self._open_entry(entry, source_path, stat, recalculate)
+                if workbook is not None:
+                    self._save_entry(entry_path, entry)
+                    print(f"Snapshot re-tagged (content unchanged): {os.path.basename(source_path)}")
+                    return workbook
+
+            start_time = time.perf_counter()
+            # A name of its own per build: no other entry can point at it (and evict it) before it is mapped
+            snapshot_file = f"{file_hash[:16]}-{uuid.uuid4().hex[:8]}.snap"
+            source_workbook = open_workbook(local_copy)
+            try:
+                write_snapshot(source_workbook, os.path.join(self.cache_dir, snapshot_file), sheet_names)
+            finally:
+                source_workbook.Close()
+            # Mapped before the entry is published, so a parallel eviction cannot remove it first
+            workbook = SnapshotWorkbook(os.path.join(self.cache_dir, snapshot_file), source_path,
+                                        stat.st_mtime, recalculate,
+                                        (stat.st_size, stat.st_mtime_ns, file_hash))
+            entry = {
+                "source": source_path, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                "sha256": file_hash, "sheets": wanted, "file": snapshot_file,
+            }
+            self._save_entry(entry_path, entry)
+            if previous and previous.get("file") not in (None, snapshot_file):
+                self._remove_file(previous["file"])
+            print(f"Snapshot built for {os.path.basename(source_path)} "
+                  f"in {(time.perf_counter() - start_time) * 1000:.0f} ms")
+        finally:
+            os.remove(local_copy)
+        self._evict(keep=entry_path)
+        return workbook
+
+    def _open_entry(self, entry, source_path, stat, recalculate):
+        try:
+            return SnapshotWorkbook(os.path.join(self.cache_dir, entry["file"]), source_path,
+                                    stat.st_mtime, recalculate,
+                                    (stat.st_size, stat.st_mtime_ns, entry["sha256"]))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Snapshot unusable, rebuilding: {e}")
+            return None
+
+    @staticmethod
+    def _touch(path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass  # evicted meanwhile; the open snapshot stays mapped
+
+    def _copy_with_hash(self, source_path):
+        digest = hashlib.sha256()
+        handle, local_copy = tempfile.mkstemp(suffix=".xlsx", dir=self.cache_dir)
+        with os.fdopen(handle, "wb") as target, open(source_path, "rb") as source:
+            for chunk in iter(lambda: source.read(1024 * 1024), b""):
+                add_bytes("share", len(chunk))
+                digest.update(chunk)
+                target.write(chunk)
+        return digest.hexdigest(), local_copy
+
+    def _remove_file(self, file_name):
+        try:
+            os.remove(os.path.join(self.cache_dir, file_name))
+        except OSError:
+            pass  # still mapped by another process (Windows); retried on the next eviction
+
+    def _evict(self, keep=None):
+        """Drop least recently used snapshots until the cache fits in the size limit
+
+        Snapshot and temporary files no entry refers to (replaced snapshots,
+        leftovers of interrupted runs) are removed once they are older than
+        SNAPSHOT_ORPHAN_AGE, which leaves alone the ones a parallel worker is
+        still writing.
+        """
+        entries, others = {}, []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            entry = self._load_entry(path) if name.endswith(".json") else None
+            if entry is not None and "file" in entry:
+                try:
+                    entries[path] = (os.path.getmtime(path), entry["file"], entry.get("source", name))
+                except OSError:
+                    pass
+            else:
+                others.append(name)
+        referenced = {file_name for _, file_name, _ in entries.values()}
+
+        now = time.time()
+        for name in others:
+            if name in referenced:
+                continue
+            try:
+                if now - os.path.getmtime(os.path.join(self.cache_dir, name)) > SNAPSHOT_ORPHAN_AGE:
+                    self._remove_file(name)
+            except OSError:
+                pass
+
+        sizes = {}
+        for file_name in referenced:
+            try:
+                sizes[file_name] = os.path.getsize(os.path.join(self.cache_dir, file_name))
+            except OSError:
+                sizes[file_name] = 0
+        total = sum(sizes.values())
+        for path in sorted(entries, key=lambda path: entries[path][0]):
+            if total <= self.limit:
+                break
+            if path == keep:
+                continue
+            self._remove_file(os.path.basename(path))
+            _, file_name, source = entries.pop(path)
+            if all(other != file_name for _, other, _ in entries.values()):
+                total -= sizes[file_name]
+                self._remove_file(file_name)
+            print(f"Snapshot evicted: {os.path.basename(source)}")
+
+    def clear(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+
+def open_cached_workbook(source_path, sheet_names=None, recalculate=False, cache_dir=SNAPSHOT_CACHE_DIR):
+    """Open a workbook through the local snapshot cache"""
+    return SnapshotCache(cache_dir).open(source_path, sheet_names, recalculate)
@@ -0,0 +1,300 @@
+"""Generate synthetic statistics workbooks shaped like the real one on the share
+
+The two report sheets are laid out the way autoEmail.py expects them:
+
+* 數位戶: labels in column Q, month columns from R, table rows 50-60
+* 數位平台收益: labels in column P, month columns from Q, table rows 11-41
+
+Both sheets carry formulas (rates, cumulative sums, IFERROR), #,##0 and
+percent number formats, styled headers, merged cells and column widths.
+`rows` adds detail rows below the report tables (up to hundreds of
+thousands) and `years` adds further blocks of twelve month columns, so the
+readers and renderers can be measured at sizes well beyond the real file.
+Sheets are streamed into the zip, so large workbooks need little memory.
+
+python synthetic_workbook.py out.xlsx --rows 100000 --years 3
+"""
+import argparse
+import random
+import zipfile
+from functools import partial
+from xml.sax.saxutils import escape
+
+from xlsx_reader import index_to_column
+
+# Cell styles (cellXfs indexes) written to xl/styles.xml
+STYLE_DEFAULT, STYLE_HEADER, STYLE_LABEL, STYLE_NUMBER, STYLE_PERCENT, STYLE_PERCENT2, STYLE_TITLE = range(7)
+
+STYLES_XML = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">
+<numFmts count="1"><numFmt numFmtId="164" formatCode="0.0%"/></numFmts>
+<fonts count="3"><font><sz val="11"/><name val="Calibri"/></font><font><b/><sz val="11"/><color theme="1"/><name val="Calibri"/></font><font><b/><sz val="14"/><color rgb="FF1F4E79"/><name val="Microsoft JhengHei"/></font></fonts>
+<fills count="3"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill><fill><patternFill patternType="solid"><fgColor theme="4" tint="0.7999816888943144"/><bgColor indexed="64"/></patternFill></fill></fills>
+<borders count="2"><border><left/><right/><top/><bottom/><diagonal/></border><border><left style="thin"><color indexed="64"/></left><right style="thin"><color indexed="64"/></right><top style="thin"><color indexed="64"/></top><bottom style="thin"><color indexed="64"/></bottom><diagonal/></border></borders>
+<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>
+<cellXfs count="7">
+<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>
+<xf numFmtId="0" fontId="1" fillId="2" borderId="1" xfId="0" applyFont="1" applyFill="1" applyBorder="1" applyAlignment="1"><alignment horizontal="center" vertical="center"/></xf>
+<xf numFmtId="0" fontId="0" fillId="0" borderId="1" xfId="0" applyBorder="1"/>
+<xf numFmtId="3" fontId="0" fillId="0" borderId="1" xfId="0" applyNumberFormat="1" applyBorder="1"/>
+<xf numFmtId="164" fontId="0" fillId="0" borderId="1" xfId="0" applyNumberFormat="1" applyBorder="1"/>
+<xf numFmtId="10" fontId="0" fillId="0" borderId="1" xfId="0" applyNumberFormat="1" applyBorder="1"/>
+<xf numFmtId="0" fontId="2" fillId="0" borderId="0" xfId="0" applyFont="1"/>
+</cellXfs>
+</styleSheet>"""
+
+ACCOUNT_LABELS = ["年目標數", "月目標數", "數位戶實績(存戶+卡戶)", "月目標達成率", "存戶", "卡戶",
+                  "網銀", "行銀", "其他", "合計"]
+PLATFORM_LABELS = ["月目標數", "實際數位平台收益", "月目標達成率", "累積月目標數", "累積月實際數",
+                   "累積月目標達成率"]
+HONOR_LABELS = ["榮譽累積月目標數", "榮譽累積月目標達成率"]  # only on workbooks generated with honor=True
+DETAIL_FIRST_ROW = 101
+
+
+class _SheetWriter:
+    """Stream one worksheet part row by row"""
+
+    def __init__(self, stream, strings):
+        self.stream = stream
+        self.strings = strings
+        self.cells = []
+        self.row = None
+
+    def write(self, text):
+        self.stream.write(text.encode("utf-8"))
+
+    def start(self, widths):
+        self.write('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                   '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+                   'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">')
+        self.write("<cols>" + "".join(f'<col min="{col}" max="{col}" width="{width}" customWidth="1"/>'
+                                      for col, width in sorted(widths.items())) + "</cols><sheetData>")
+
+    def cell(self, row, col, value, style=STYLE_DEFAULT, formula=None, cached=True):
+        if row != self.row:
+            self.flush_row()
+            self.row = row
+        ref = f"{index_to_column(col)}{row}"
+        formula_xml = f"<f>{escape(formula)}</f>" if formula else ""
+        if formula and not cached:
+            self.cells.append(f'<c r="{ref}" s="{style}">{formula_xml}</c>')
+        elif isinstance(value, str) and formula:
+            self.cells.append(f'<c r="{ref}" s="{style}" t="str">{formula_xml}<v>{escape(value)}</v></c>')
+        elif isinstance(value, str):
+            index = self.strings.setdefault(value, len(self.strings))
+            self.cells.append(f'<c r="{ref}" s="{style}" t="s"><v>{index}</v></c>')
+        elif value is None:
+            self.cells.append(f'<c r="{ref}" s="{style}"/>')
+        else:
+            self.cells.append(f'<c r="{ref}" s="{style}">{formula_xml}<v>{value!r}</v></c>')
+
+    def flush_row(self):
+        if self.row is not None and self.cells:
+            self.write(f'<row r="{self.row}">' + "".join(self.cells) + "</row>")
+        self.cells = []
+
+    def finish(self, merges):
+        self.flush_row()
+        self.write("</sheetData>")
+        if merges:
+            self.write(f'<mergeCells count="{len(merges)}">'
+                       + "".join(f'<mergeCell ref="{ref}"/>' for ref in merges) + "</mergeCells>")
+        self.write("</worksheet>")
+
+
+def _month_headers(years):
+    headers = []
+    for year in range(years):
+        for month in range(1, 13):
+            headers.append(f"{month}月" if year == 0 else f"第{year + 1}年{month}月")
+    return headers
+
+
+def _write_detail_rows(sheet, rng, label_col, first_value_col, month_count, rows, cached_values):
+    """Detail rows below the report table: a label, monthly numbers and a row total formula"""
+    total_col = first_value_col + month_count
+    first_letter, last_letter = index_to_column(first_value_col), index_to_column(total_col - 1)
+    for row in range(DETAIL_FIRST_ROW, DETAIL_FIRST_ROW + rows):
+        sheet.cell(row, 1, f"明細{row - DETAIL_FIRST_ROW + 1:06d}", STYLE_LABEL)
+        sheet.cell(row, label_col, f"分行{(row * 7919) % 500:03d}", STYLE_LABEL)
+        total = 0.0
+        for offset in range(month_count):
+            value = float(int(rng.random() * 1000000))
+            total += value
+            sheet.cell(row, first_value_col + offset, value, STYLE_NUMBER)
+        sheet.cell(row, total_col, total, STYLE_NUMBER, f"SUM({first_letter}{row}:{last_letter}{row})",
+                   cached_values)
+
+
+def _write_digital_account(sheet, rng, years, rows, cached_values):
+    label_col = 17  # Q
+    month_count = 12 * years
+    sheet.start({1: 20, label_col: 30, **{label_col + offset: 12 for offset in range(1, month_count + 2)}})
+    sheet.cell(1, 1, "數位戶統計", STYLE_TITLE)
+
+    sheet.cell(50, label_col, "項目", STYLE_HEADER)
+    for offset, header in enumerate(_month_headers(years), start=1):
+        sheet.cell(50, label_col + offset, header, STYLE_HEADER)
+
+    targets = [float(rng.randint(100000, 1600000)) for _ in range(month_count)]
+    actuals = [target * rng.uniform(0.7, 1.3) // 1 for target in targets]
+    parts = [[float(rng.randint(10000, 400000)) for _ in range(month_count)] for _ in range(5)]
+    for index, label in enumerate(ACCOUNT_LABELS):
+        row = 51 + index
+        sheet.cell(row, label_col, label, STYLE_LABEL)
+        for offset in range(month_count):
+            col = label_col + 1 + offset
+            letter = index_to_column(col)
+            if label == "年目標數":
+                sheet.cell(row, col, targets[offset] * 12, STYLE_NUMBER, f"{letter}52*12", cached_values)
+            elif label == "月目標數":
+                sheet.cell(row, col, targets[offset], STYLE_NUMBER)
+            elif label == "數位戶實績(存戶+卡戶)":
+                sheet.cell(row, col, actuals[offset], STYLE_NUMBER)
+            elif label == "月目標達成率":
+                sheet.cell(row, col, actuals[offset] / targets[offset], STYLE_PERCENT,
+                           f"IFERROR({letter}53/{letter}52,0)", cached_values)
+            elif label == "合計":
+                sheet.cell(row, col, sum(part[offset] for part in parts), STYLE_NUMBER,
+                           f"SUM({letter}55:{letter}59)", cached_values)
+            else:
+                sheet.cell(row, col, parts[index - 4][offset], STYLE_NUMBER)
+
+    _write_detail_rows(sheet, rng, label_col, label_col + 1, month_count, rows, cached_values)
+    sheet.finish(["A1:C1"])
+
+
+def _write_digital_platform(sheet, rng, years, rows, cached_values, honor=False):
+    label_col = 16  # P
+    month_count = 12 * years
+    first_letter = index_to_column(label_col + 1)
+    sheet.start({label_col: 28, **{label_col + offset: 14 for offset in range(1, month_count + 2)}})
+    sheet.cell(1, 1, "數位平台收益", STYLE_TITLE)
+
+    sheet.cell(11, label_col, "項目", STYLE_HEADER)
+    for offset, header in enumerate(_month_headers(years), start=1):
+        sheet.cell(11, label_col + offset, header, STYLE_HEADER)
+
+    targets = [float(rng.randint(20000000, 40000000)) for _ in range(month_count)]
+    actuals = [float(rng.randint(15000000, 50000000)) for _ in range(month_count)]
+    labels = PLATFORM_LABELS + HONOR_LABELS if honor else PLATFORM_LABELS
+    for index in range(30):
+        row = 12 + index
+        label = labels[index] if index < len(labels) else f"其他收益項目{index - 5:02d}"
+        sheet.cell(row, label_col, label, STYLE_LABEL)
+        for offset in range(month_count):
+            col = label_col + 1 + offset
+            letter = index_to_column(col)
+            cumulative_target = sum(targets[:offset + 1])
+            cumulative_actual = sum(actuals[:offset + 1])
+            if label == "月目標數":
+                sheet.cell(row, col, targets[offset], STYLE_NUMBER)
+            elif label == "實際數位平台收益":
+                sheet.cell(row, col, actuals[offset], STYLE_NUMBER)
+            elif label == "月目標達成率":
+                sheet.cell(row, col, actuals[offset] / targets[offset], STYLE_PERCENT2,
+                           f"{letter}13/{letter}12", cached_values)
+            elif label == "累積月目標數":
+                sheet.cell(row, col, cumulative_target, STYLE_NUMBER, f"SUM(${first_letter}12:{letter}12)",
+                           cached_values)
+            elif label == "累積月實際數":
+                sheet.cell(row, col, cumulative_actual, STYLE_NUMBER, f"SUM(${first_letter}13:{letter}13)",
+                           cached_values)
+            elif label == "累積月目標達成率":
+                sheet.cell(row, col, cumulative_actual / cumulative_target, STYLE_PERCENT,
+                           f"IFERROR({letter}16/{letter}15,0)", cached_values)
+            elif label == "榮譽累積月目標數":
+                sheet.cell(row, col, 163000000.0 * (offset // 12 + 1), STYLE_NUMBER)
+            elif label == "榮譽累積月目標達成率":
+                sheet.cell(row, col, rng.randint(5000, 20000) / 10000, STYLE_PERCENT)
+            else:
+                sheet.cell(row, col, float(rng.randint(0, 9999999)), STYLE_NUMBER)
+
+    _write_detail_rows(sheet, rng, label_col, label_col + 1, month_count, rows, cached_values)
+    sheet.finish(["P11:P11", "A1:C1"])
+
+
+def generate_workbook(path, rows=0, years=1, seed=1, cached_values=True, honor=False):
+    """Write a synthetic statistics workbook to path
+
+    rows: detail rows added below the report tables on both sheets
+    years: blocks of twelve month columns
+    cached_values: write formula results too (False mimics a file saved without them)
+    honor: add head office's 榮譽累積 rows below the cumulative ones
+    """
+    rng = random.Random(seed)
+    strings = {}
+    sheets = [("封面", None), ("數位戶", _write_digital_account),
+              ("數位平台收益", partial(_write_digital_platform, honor=honor))]
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", _content_types(len(sheets)))
+        archive.writestr("_rels/.rels",
+                         '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                         '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                         '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/'
+                         'relationships/officeDocument" Target="xl/workbook.xml"/></Relationships>')
+        archive.writestr("xl/workbook.xml",
+                         '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                         '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+                         'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><sheets>'
+                         + "".join(f'<sheet name="{escape(name)}" sheetId="{index}" r:id="rId{index}"/>'
+                                   for index, (name, _) in enumerate(sheets, start=1))
+                         + "</sheets></workbook>")
+        archive.writestr("xl/_rels/workbook.xml.rels",
+                         '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                         '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                         + "".join(f'<Relationship Id="rId{index}" Type="http://schemas.openxmlformats.org/'
+                                   f'officeDocument/2006/relationships/worksheet" Target="worksheets/sheet{index}.xml"/>'
+                                   for index in range(1, len(sheets) + 1))
+                         + '<Relationship Id="rIdS" Type="http://schemas.openxmlformats.org/officeDocument/2006/'
+                           'relationships/styles" Target="styles.xml"/>'
+                           '<Relationship Id="rIdT" Type="http://schemas.openxmlformats.org/officeDocument/2006/'
+                           'relationships/sharedStrings" Target="sharedStrings.xml"/></Relationships>')
+        archive.writestr("xl/styles.xml", STYLES_XML)
+
+        for index, (name, writer) in enumerate(sheets, start=1):
+            with archive.open(f"xl/worksheets/sheet{index}.xml", "w", force_zip64=True) as stream:
+                sheet = _SheetWriter(stream, strings)
+                if writer is None:
+                    sheet.start({1: 40})
+                    sheet.cell(1, 1, "統計報表 (synthetic)", STYLE_TITLE)
+                    sheet.finish([])
+                else:
+                    writer(sheet, rng, years, rows, cached_values)
+
+        with archive.open("xl/sharedStrings.xml", "w", force_zip64=True) as stream:
+            stream.write(f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                         f'<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+                         f'count="{len(strings)}" uniqueCount="{len(strings)}">'.encode("utf-8"))
+            for text in strings:
+                stream.write(f"<si><t>{escape(text)}</t></si>".encode("utf-8"))
+            stream.write(b"</sst>")
+    return path
+
+
+def _content_types(sheet_count):
+    main = "application/vnd.openxmlformats-officedocument.spreadsheetml"
+    return ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            f'<Override PartName="/xl/workbook.xml" ContentType="{main}.sheet.main+xml"/>'
+            + "".join(f'<Override PartName="/xl/worksheets/sheet{index}.xml" ContentType="{main}.worksheet+xml"/>'
+                      for index in range(1, sheet_count + 1))
+            + f'<Override PartName="/xl/styles.xml" ContentType="{main}.styles+xml"/>'
+            f'<Override PartName="/xl/sharedStrings.xml" ContentType="{main}.sharedStrings+xml"/>'
+            "</Types>")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic statistics workbook.")
+    parser.add_argument("path")
+    parser.add_argument("--rows", type=int, default=0, help="detail rows below the report tables")
+    parser.add_argument("--years", type=int, default=1, help="years of month columns")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--honor", action="store_true", help="add the 榮譽累積 rows")
+    parser.add_argument("--no-cached-values", action="store_true",
+                        help="leave formula results out, like a file saved without calculation")
+    args = parser.parse_args()
+    generate_workbook(args.path, args.rows, args.years, args.seed, not args.no_cached_values, args.honor)
+    print(f"Wrote {args.path}")
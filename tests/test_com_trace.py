@@ -0,0 +1,40 @@
+"""A report recorded through (fake) Excel and replayed from its trace renders the same mail"""
+import types
+
+import pytest
+
+import autoEmail
+import office_session
+from synthetic_workbook import generate_workbook
+
+
+@pytest.fixture
+def workbook(tmp_path, monkeypatch):
+    monkeypatch.setattr(autoEmail, "LABEL_INDEX_CACHE_FILE", str(tmp_path / "label_index.json"))
+    monkeypatch.setattr(autoEmail, "_label_index_cache", None)
+    path = tmp_path / "report.xlsx"
+    generate_workbook(str(path), seed=7)
+    return path
+
+
+def run(tmp_path, workbook, output_dir, *options):
+    return autoEmail.main(["-m", "5", "-y", "2026", "-w", str(workbook), "-o", "html", "--dry-run",
+                           "--no-history", "--signature", str(tmp_path / "missing.docx"),
+                           "--output-dir", str(output_dir), *options])
+
+
+def test_replay_renders_the_recorded_report(tmp_path, workbook, monkeypatch):
+    trace = tmp_path / "trace.json"
+    backend = office_session.FakeOfficeBackend()
+    monkeypatch.setattr(autoEmail, "win32com",
+                        types.SimpleNamespace(client=types.SimpleNamespace(Dispatch=backend.dispatch)))
+    assert run(tmp_path, workbook, tmp_path / "recorded", "--record", str(trace)) == 0
+
+    monkeypatch.setattr(autoEmail, "win32com", None)  # replaying needs no Excel at all
+    workbook.unlink()  # nor the workbook
+    assert run(tmp_path, workbook, tmp_path / "replayed", "--replay", str(trace)) == 0
+
+    recorded = sorted((tmp_path / "recorded").glob("*.html"))
+    replayed = sorted((tmp_path / "replayed").glob("*.html"))
+    assert [path.name for path in recorded] == [path.name for path in replayed] == ["report_202605.html"]
+    assert replayed[0].read_text(encoding="utf-8") == recorded[0].read_text(encoding="utf-8")
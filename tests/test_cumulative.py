@@ -0,0 +1,87 @@
+"""Prefix-sum windows of MonthlySeries must equal plain sums over the same months"""
+import random
+
+import pytest
+
+import cumulative
+from cumulative import MonthlySeries, cached_series, fiscal_year_start, month_index
+
+
+def naive_total(months, start, end):
+    return sum(value or 0.0 for (year, month), value in months.items()
+               if month_index(*start) <= month_index(year, month) <= month_index(*end))
+
+
+def add_months(year, month, count):
+    index = month_index(year, month) + count
+    return index // 12, index % 12 + 1
+
+
+def random_number(rng):
+    return rng.choice([None, "n/a", 0, rng.randint(-500, 5000), round(rng.uniform(-1e6, 1e6), 2)])
+
+
+def filled_series(rng, first_year=2023, years=3):
+    """A series built by random chunks (revisions, gaps and months added in front) and its plain values"""
+    series = MonthlySeries()
+    months = {}
+    for _ in range(40):
+        year, month = add_months(first_year, 1, rng.randrange(years * 12))
+        chunk = [random_number(rng) for _ in range(rng.randint(1, 8))]
+        series.update(year, month, chunk)
+        for offset, value in enumerate(chunk):
+            months[add_months(year, month, offset)] = value if type(value) in (int, float) else None
+    return series, months
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_windows_match_naive_sums(seed):
+    rng = random.Random(seed)
+    series, months = filled_series(rng)
+    span = [add_months(2022, 11, offset) for offset in range(42)]  # starts and ends outside the data too
+    for start in span:
+        for end in span:
+            assert series.total(start, end) == pytest.approx(naive_total(months, start, end)), (start, end)
+
+
+@pytest.mark.parametrize("start_month", [1, 4, 7, 10])
+def test_fiscal_year_and_trailing_windows_cross_year_ends(start_month):
+    series, months = filled_series(random.Random(start_month))
+    for year in (2023, 2024, 2025):
+        for month in range(1, 13):
+            fiscal_start = fiscal_year_start(year, month, start_month)
+            assert series.year_to_date(year, month, start_month) == \
+                pytest.approx(naive_total(months, fiscal_start, (year, month)))
+            assert series.trailing(year, month) == \
+                pytest.approx(naive_total(months, add_months(year, month, -11), (year, month)))
+
+
+def test_update_reports_changed_months():
+    series = MonthlySeries()
+    assert series.update(2024, 11, [1, 2, 3]) == 3  # Nov 2024 .. Jan 2025
+    assert series.update(2024, 12, [2, 3, 4]) == 1
+    assert series.total((2024, 12), (2025, 2)) == 9
+    assert series.months_from(2024, 11) == 4
+    assert series.months_from(2025, 1) == 2
+    assert series.months_from(2024, 10) == 0
+
+
+def test_cached_series_is_replaced_for_a_new_version(monkeypatch):
+    monkeypatch.setattr(cumulative, "_series_cache", cumulative.OrderedDict())
+    first = cached_series("report.xlsx", "actual", (10, 1))
+    first.update(0, 1, [5, 6])
+    assert cached_series("report.xlsx", "actual", (10, 1)) is first
+    second = cached_series("report.xlsx", "actual", (12, 2))
+    assert second is not first and len(second) == 0
+    assert len(cumulative._series_cache) == 1
+
+
+def test_cached_series_are_bounded_least_recently_used_first(monkeypatch):
+    monkeypatch.setattr(cumulative, "_series_cache", cumulative.OrderedDict())
+    monkeypatch.setattr(cumulative, "SERIES_CACHE_LIMIT", 3)
+    kept = cached_series("unit0.xlsx", "actual", 1)
+    for unit in range(1, 5):
+        cached_series(f"unit{unit}.xlsx", "actual", 1)
+        assert cached_series("unit0.xlsx", "actual", 1) is kept  # used again: stays
+    assert list(cumulative._series_cache) == [("unit3.xlsx", "actual"), ("unit4.xlsx", "actual"),
+                                              ("unit0.xlsx", "actual")]
@@ -0,0 +1,88 @@
+"""The bulk formatters must give exactly what the scalar formatters give, value by value"""
+import html
+import random
+import re
+
+import pytest
+
+import autoEmail
+from autoEmail import (format_digital_account_number, format_digital_account_numbers,
+                       format_platform_revenue, format_platform_revenues,
+                       format_percentage_from_text, format_percentages_from_text)
+from metrics import MISSING_VALUE, compile_template
+
+PAIRS = [
+    (format_digital_account_number, format_digital_account_numbers),
+    (format_platform_revenue, format_platform_revenues),
+    (format_percentage_from_text, format_percentages_from_text),
+]
+
+# 萬元/億元 boundaries, negatives, zero, missing values and rounding ties
+EDGE_VALUES = [
+    None, "", " ", "abc", True, False, 0, 0.0, -0.0,
+    9999, 9999.4, 9999.5, 10000, 10000.0, 14999.99, 15000, 25000, 9995000, 9999999.9,
+    99999999, 99999999.5, 100000000, 100000000.0, 104999999, 105000000, 125000000, 1e20, 10 ** 20,
+    -1, -9999.5, -10000, -100000000, -1e9,
+    0.5, 1.5, 2.5, -0.5, -2.5, 1000.5, 5000.5,
+    "12.25%", "12.35%", "-0.05%", "0.05%", "100%", "0%", "-3.45%", "1e5", "  7 ", "99.95%", "N/A",
+]
+
+
+def random_value(rng):
+    kind = rng.randrange(6)
+    if kind == 0:
+        return rng.choice(EDGE_VALUES)
+    if kind == 1:
+        return rng.uniform(-1e10, 1e10)
+    if kind == 2:
+        return rng.randint(-10 ** 12, 10 ** 12)
+    if kind == 3:
+        return f"{rng.uniform(-300, 300):.{rng.randint(0, 4)}f}%"
+    if kind == 4:
+        return rng.randint(-20000, 20000) + rng.choice([0, 0.5, 0.25, 0.75])  # ties at every scale
+    return round(rng.uniform(0, 2e9), rng.randint(-5, 2))
+
+
+@pytest.mark.parametrize("scalar, bulk", PAIRS, ids=lambda f: f.__name__)
+def test_edge_values(scalar, bulk):
+    assert bulk(EDGE_VALUES) == [scalar(value) for value in EDGE_VALUES]
+
+
+@pytest.mark.parametrize("scalar, bulk", PAIRS, ids=lambda f: f.__name__)
+def test_random_values(scalar, bulk):
+    rng = random.Random(20240716)
+    for _ in range(2000):
+        values = [random_value(rng) for _ in range(rng.randint(0, 30))]
+        values += values[:5]  # repeats go through the bulk formatters' memo
+        assert bulk(values) == [scalar(value) for value in values], values
+
+
+def test_boundaries_render_as_published():
+    assert format_platform_revenues([9999.5, 10000, 99999999.5, 100000000, -100000000]) == \
+        ["10,000元", "1萬元", "10,000萬元", "1.0億元", "-100,000,000元"]
+    assert format_digital_account_numbers([None, 0, 2.5, 3.5, -0.5]) == ["0", "0", "2", "4", "0"]
+    assert format_percentages_from_text([None, "", "12.25%", "-0.05%", "7.0%"]) == \
+        ["0%", "0%", "12.2%", "-0.1%", "7%"]
+
+
+def test_unit_table_shows_what_the_scalar_formatters_show():
+    """The units report formats each metric column in one bulk call; every cell must read like the mail text"""
+    rng = random.Random(7)
+    metrics = compile_template().plan.metrics
+    unit_values = {}
+    for unit in ["台北", "台中", "<高雄>", autoEmail.UNIT_ROLLUP_NAME]:
+        unit_values[unit] = {metric.key: random_value(rng) for metric in metrics if rng.random() < 0.8}
+    lines = autoEmail.render_unit_table(unit_values, metrics).splitlines()
+    rows = [[html.unescape(cell) for cell in re.findall(r"<td[^>]*>(.*?)</td>", line)] for line in lines[2:-1]]
+    expected = []
+    for unit, values in unit_values.items():
+        row = [unit]
+        for metric in metrics:
+            value = values.get(metric.key, metric.default)
+            if value is None and metric.default is None:
+                row.append(MISSING_VALUE)
+            else:
+                row.append(autoEmail.METRIC_FORMATTERS[metric.formatter](value))
+        expected.append(row)
+    assert rows == expected
+    assert f'font-weight:bold">{autoEmail.UNIT_ROLLUP_NAME}</td>' in lines[-2]
@@ -0,0 +1,51 @@
+"""Formulas evaluated locally must give the results Excel saved with them"""
+import pytest
+
+import xlsx_reader
+from synthetic_workbook import generate_workbook
+
+
+def formula_cells(workbook):
+    for worksheet in workbook.Worksheets:
+        worksheet.ensure_rows(float("inf"))
+        for row, col in sorted(worksheet.formulas):
+            yield worksheet, row, col
+
+
+def same_value(local, cached):
+    if isinstance(local, float) or isinstance(cached, float):
+        return local == pytest.approx(cached, rel=1e-12, abs=1e-12)
+    return local == cached
+
+
+@pytest.mark.parametrize("seed, years, rows", [(1, 1, 0), (3, 2, 40), (8, 3, 120)])
+def test_local_results_match_the_cached_values(tmp_path, seed, years, rows):
+    path = tmp_path / "report.xlsx"
+    generate_workbook(str(path), rows=rows, years=years, seed=seed, honor=True)
+    workbook = xlsx_reader.open_workbook(str(path), recalculate=True)
+    try:
+        cells = list(formula_cells(workbook))
+        assert len(cells) > 50
+        mismatches = [(worksheet.Name, xlsx_reader.index_to_column(col) + str(row),
+                       worksheet.cell_value(row, col), worksheet.raw_cell_value(row, col))
+                      for worksheet, row, col in cells
+                      if not same_value(worksheet.cell_value(row, col), worksheet.raw_cell_value(row, col))]
+        assert mismatches == []
+        assert workbook.formula_engine().stats["unsupported"] == 0
+    finally:
+        workbook.Close()
+
+
+def test_a_file_saved_without_results_reads_like_one_saved_with_them(tmp_path):
+    saved, bare = tmp_path / "saved.xlsx", tmp_path / "bare.xlsx"
+    generate_workbook(str(saved), rows=40, years=2, seed=4)
+    generate_workbook(str(bare), rows=40, years=2, seed=4, cached_values=False)
+    expected, workbook = xlsx_reader.open_workbook(str(saved)), xlsx_reader.open_workbook(str(bare))
+    try:
+        for worksheet, row, col in formula_cells(workbook):
+            assert worksheet.raw_cell_value(row, col) is None
+            cached = expected.worksheet(worksheet.Name).raw_cell_value(row, col)
+            assert same_value(worksheet.cell_value(row, col), cached), (worksheet.Name, row, col)
+    finally:
+        expected.Close()
+        workbook.Close()
@@ -0,0 +1,80 @@
+"""Metrics computed from the workbook must read like the cells they replace"""
+import pytest
+
+import autoEmail
+import xlsx_reader
+from cumulative import rate
+from metrics import RATE_NUMBER_FORMAT, compile_template, rollup_values
+from numfmt import format_value
+from synthetic_workbook import generate_workbook
+
+
+def test_rate_is_rounded_once():
+    # 10.549% shows as 10.5% on the sheet; rounding "10.55%" again would give 10.6%
+    text = format_value(rate(10549, 100000), RATE_NUMBER_FORMAT)
+    assert text == "10.5%"
+    assert autoEmail.format_percentage_from_text(text) == "10.5%"
+    assert rate(1, 0) is None
+
+
+def test_rollup_rates_are_rounded_once():
+    units = [{"platform_cumulative_actual": 5000, "platform_cumulative_target": 40000},
+             {"platform_cumulative_actual": 5549, "platform_cumulative_target": 60000}]
+    assert rollup_values(units)["platform_cumulative_rate_text"] == "10.5%"
+
+
+@pytest.fixture(scope="module")
+def workbook(tmp_path_factory):
+    path = tmp_path_factory.mktemp("metrics") / "report.xlsx"
+    generate_workbook(str(path), seed=5)
+    workbook = xlsx_reader.open_workbook(str(path))
+    yield workbook
+    workbook.Close()
+
+
+@pytest.mark.parametrize("month", range(1, 13))
+def test_cumulative_rate_matches_the_sheet(workbook, month):
+    worksheet = workbook.worksheet("數位平台收益")
+    values = compile_template().plan.extract_sheet(worksheet, month, autoEmail._find_metric_row)
+    row = autoEmail._find_metric_row(worksheet, "累積月目標達成率")
+    col = xlsx_reader.column_to_index("P") + month
+    assert values["platform_cumulative_rate_text"] == worksheet.cell_text(row, col)
+
+
+def test_honor_figures_are_read_from_their_rows(tmp_path):
+    path = tmp_path / "honor.xlsx"
+    generate_workbook(str(path), seed=5, honor=True)
+    workbook = xlsx_reader.open_workbook(str(path))
+    try:
+        worksheet = workbook.worksheet("數位平台收益")
+        values = compile_template().plan.extract_sheet(worksheet, 4, autoEmail._find_metric_row)
+        col = xlsx_reader.column_to_index("P") + 4
+        rate_row = autoEmail._find_metric_row(worksheet, "榮譽累積月目標達成率")
+        assert values["honor_cumulative_target"] == 163000000
+        assert values["platform_honor_cumulative_rate_text"] == worksheet.cell_text(rate_row, col)
+    finally:
+        workbook.Close()
+    body = autoEmail.build_mail_body(values, "04")
+    assert f"榮譽累積月目標數1.63億元，榮譽累積月目標達成率為" \
+           f"{autoEmail.format_percentage_from_text(values['platform_honor_cumulative_rate_text'])}。" in body
+
+
+def test_honor_figures_come_from_the_configuration_otherwise(tmp_path, monkeypatch):
+    config = tmp_path / "honor.json"
+    config.write_text('{"2026-05": {"target": 163000000, "rate": "140.6%"}}', encoding="utf-8")
+    monkeypatch.setattr(autoEmail, "HONOR_FIGURES_FILE", str(config))
+    configured = autoEmail.add_honor_figures({}, 2026, 5)
+    assert "榮譽累積月目標數1.63億元，榮譽累積月目標達成率為140.6%。" in autoEmail.build_mail_body(configured, "05")
+    # Nothing is made up for a period head office has not published
+    assert "榮譽累積月目標數-，榮譽累積月目標達成率為-。" in autoEmail.build_mail_body(
+        autoEmail.add_honor_figures({}, 2026, 6), "06")
+
+
+def test_honor_figures_are_not_rolled_up():
+    units = [{"platform_cumulative_actual": 100, "honor_cumulative_target": 10,
+              "platform_honor_cumulative_rate_text": "90%"},
+             {"platform_cumulative_actual": 200, "honor_cumulative_target": 20,
+              "platform_honor_cumulative_rate_text": "95%"}]
+    totals = rollup_values(units)
+    assert "honor_cumulative_target" not in totals
+    assert "platform_honor_cumulative_rate_text" not in totals
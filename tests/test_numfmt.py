@@ -0,0 +1,51 @@
+"""Display text of the number formats the report workbooks use, as Excel shows it"""
+import pytest
+
+from numfmt import format_value
+
+CASES = [
+    # #,##0: the 數位戶 and 數位平台收益 amounts
+    ("#,##0", 1234567.5, "1,234,568"),
+    ("#,##0", 999.5, "1,000"),
+    ("#,##0", -1234.4, "-1,234"),
+    ("#,##0", 0, "0"),
+    ("#,##0", None, ""),
+    # 0.0% / 0.00%: the 達成率 rows (half away from zero, once)
+    ("0.0%", 0.10549, "10.5%"),
+    ("0.0%", 0.10551, "10.6%"),
+    ("0.0%", 1.171150183515253, "117.1%"),
+    ("0.0%", 0, "0.0%"),
+    ("0.0%", 0.00049, "0.0%"),
+    ("0.0%", -0.0005, "-0.1%"),
+    ("0.00%", 1.72720287262665, "172.72%"),
+    ("0.00%", 0.12345, "12.35%"),
+    ("0.00%", 0.123449, "12.34%"),
+    # 萬/億 display: trailing commas scale by 1000, ! places a literal decimal point
+    ('0!.0,"萬"', 123456, "12.3萬"),
+    ('0!.0,"萬"', 5000, "0.5萬"),
+    ('0!.00,,"億"', 163000000, "1.63億"),
+    ('0!.00,,"億"', 123456789, "1.23億"),
+    ('#,##0,"千"', 1234567, "1,235千"),
+    ('#,##0.0,,"百萬"', -2345678, "-2.3百萬"),
+    # Negative and zero sections
+    ("#,##0;(#,##0)", -1234.5, "(1,235)"),
+    ('#,##0;[Red]-#,##0;"-"', 0, "-"),
+    ('#,##0;[Red]-#,##0;"-"', -5, "-5"),
+    ("#,##0.00_);(#,##0.00)", 3.5, "3.50 "),
+    ("#,##0.00_);(#,##0.00)", -3.5, "(3.50)"),
+    ('0.0%;-0.0%;"-"', 0, "-"),
+    ("0.0%;[Red]-0.0%", -0.1234, "-12.3%"),
+    ('#,##0;-#,##0;0;"text: "@', "abc", "text: abc"),
+    # General
+    ("General", 1234.5, "1234.5"),
+    ("General", 0.1 + 0.2, "0.3"),
+    ("General", 1e20, "1E+20"),
+    ("General", -7, "-7"),
+    ("General", "abc", "abc"),
+    ("General", True, "TRUE"),
+]
+
+
+@pytest.mark.parametrize("code, value, text", CASES)
+def test_display_text(code, value, text):
+    assert format_value(value, code) == text
@@ -0,0 +1,82 @@
+"""Report jobs sent to the office session daemon (fake Office) come back like in-process runs"""
+import threading
+import time
+import types
+
+import pytest
+
+import autoEmail
+import office_session
+from synthetic_workbook import generate_workbook
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setattr(office_session, "SESSION_KEY_FILE", str(tmp_path / "session.key"))
+    monkeypatch.setattr(autoEmail, "LABEL_INDEX_CACHE_FILE", str(tmp_path / "label_index.json"))
+    monkeypatch.setattr(autoEmail, "_label_index_cache", None)
+    server = office_session.SessionServer(office_session.FakeOfficeBackend(), port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 10
+    while server.address[1] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert server.address[1] != 0
+    yield server
+    if thread.is_alive():
+        office_session.send_request({"type": "stop"}, server.address, timeout=10)
+        thread.join(10)
+
+
+def report_args(tmp_path, workbook, output_dir):
+    return {"year": 2026, "months": [7], "file_path": str(workbook), "output": "html",
+            "output_dir": str(output_dir), "backend": "excel", "history": False,
+            "signature_path": str(tmp_path / "missing.docx")}
+
+
+def test_daemon_round_trip(tmp_path, server, monkeypatch, capsys):
+    workbook = tmp_path / "report.xlsx"
+    generate_workbook(str(workbook), seed=11)
+
+    for output_dir in ("daemon", "daemon_again"):
+        assert office_session.submit_report(report_args(tmp_path, workbook, tmp_path / output_dir),
+                                            server.address, timeout=60) == 0
+    assert "Office session job finished" in capsys.readouterr().out
+    status = office_session.send_request({"type": "status"}, server.address, timeout=10)
+    assert status["jobs_run"] == 2
+
+    # The same job run in this process through the same fake Excel
+    backend = office_session.FakeOfficeBackend()
+    monkeypatch.setattr(autoEmail, "win32com",
+                        types.SimpleNamespace(client=types.SimpleNamespace(Dispatch=backend.dispatch)))
+    assert autoEmail.run_report(**report_args(tmp_path, workbook, tmp_path / "local")) == 0
+
+    expected = (tmp_path / "local" / "report_202607.html").read_text(encoding="utf-8")
+    for output_dir in ("daemon", "daemon_again"):
+        assert (tmp_path / output_dir / "report_202607.html").read_text(encoding="utf-8") == expected
+
+
+def test_unknown_arguments_are_refused(tmp_path, server):
+    result = office_session.send_request({"type": "report", "args": {"no_such_option": 1}},
+                                         server.address, timeout=10)
+    assert "no_such_option" in result["error"]
+
+
+def test_excluded_rows_reach_the_daemon(tmp_path, server, monkeypatch):
+    workbook = tmp_path / "report.xlsx"
+    generate_workbook(str(workbook), seed=11)
+    args = report_args(tmp_path, workbook, tmp_path / "daemon")
+    args["exclude_rows"] = autoEmail.parse_row_spans("23-25,30")
+    assert office_session.submit_report(args, server.address, timeout=60) == 0
+
+    backend = office_session.FakeOfficeBackend()
+    monkeypatch.setattr(autoEmail, "win32com",
+                        types.SimpleNamespace(client=types.SimpleNamespace(Dispatch=backend.dispatch)))
+    for output_dir, exclude_rows in (("local", [(23, 25), (30, 30)]), ("default", autoEmail.PLATFORM_EXCLUDED_ROWS)):
+        local = report_args(tmp_path, workbook, tmp_path / output_dir)
+        assert autoEmail.run_report(**local, exclude_rows=exclude_rows) == 0
+
+    pages = {name: (tmp_path / name / "report_202607.html").read_text(encoding="utf-8")
+             for name in ("daemon", "local", "default")}
+    assert pages["daemon"] == pages["local"]
+    assert pages["local"].count("<tr") == pages["default"].count("<tr") + 5  # 4 rows left out instead of 9
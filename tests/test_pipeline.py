@@ -0,0 +1,43 @@
+"""Concurrent stages must not interleave what they print"""
+import sys
+import threading
+
+import pytest
+
+from pipeline import Stage, run_stages
+
+
+def test_stage_output_is_printed_whole_from_the_calling_thread(capsys):
+    half_printed, other_printed = threading.Event(), threading.Event()
+
+    def first():
+        print("10 CSS classes", end="")
+        half_printed.set()
+        other_printed.wait(5)  # the other stage prints in the middle of this line
+        print(" rendered")
+        return 1
+
+    def second():
+        half_printed.wait(5)
+        print("Signature file not found")
+        other_printed.set()
+        return 2
+
+    console = sys.stdout
+    results, _ = run_stages([Stage("table", first), Stage("signature", second),
+                             Stage("assemble", lambda a, b: a + b, requires=("table", "signature"), inline=True)])
+    assert results["assemble"] == 3
+    assert sys.stdout is console
+    lines = capsys.readouterr().out.splitlines()
+    assert "10 CSS classes rendered" in lines
+    assert "Signature file not found" in lines
+
+
+def test_failed_stage_output_is_printed_before_the_error(capsys):
+    def failing():
+        print("reading 數位戶")
+        raise ValueError("sheet missing")
+
+    with pytest.raises(ValueError, match="sheet missing"):
+        run_stages([Stage("values", failing)])
+    assert "reading 數位戶" in capsys.readouterr().out
@@ -0,0 +1,141 @@
+"""MIME building and pooled delivery, against the in-process SMTP stand-in"""
+import email
+import threading
+import time
+from email.policy import default as DEFAULT_POLICY
+
+import pytest
+
+import autoEmail
+import smtp_mail
+from smtp_mail import LocalSMTPServer, SMTPConnectionPool, build_mime_message, send_messages
+from synthetic_workbook import generate_workbook
+
+HTML = "<html><head><style>td{color:red}</style></head><body><p>至05績效</p>" \
+       "<table><tr><td>a</td><td>b</td></tr></table><img src=\"cid:sign-logo\"></body></html>"
+
+
+def report_message(to=("a@example.com",), **kwargs):
+    return build_mime_message("(週報)績效數字統計", HTML, "report@example.com", list(to), **kwargs)
+
+
+def parsed(data):
+    return email.message_from_bytes(data, policy=DEFAULT_POLICY)
+
+
+@pytest.fixture
+def server():
+    with LocalSMTPServer(refuse={"nobody@example.com"}) as server:
+        yield server
+
+
+def test_message_is_text_and_html_alternatives():
+    message = report_message(cc=["c@example.com"])
+    assert message.get_content_type() == "multipart/alternative"
+    text, html_part = message.get_payload()
+    assert text.get_content_type() == "text/plain"
+    assert "至05績效" in text.get_content() and "a\tb" in text.get_content()
+    assert "color:red" not in text.get_content()
+    assert html_part.get_content_type() == "text/html" and html_part.get_content() == HTML + "\n"
+    assert (message["To"], message["Cc"]) == ("a@example.com", "c@example.com")
+    assert message["Message-ID"] and message["Date"]
+
+
+def test_inline_images_are_related_to_the_html():
+    message = report_message(inline_images={"sign-logo": (b"\x89PNG fake", "png")})
+    text, related = message.get_payload()
+    assert related.get_content_type() == "multipart/related"
+    html_part, image = related.get_payload()
+    assert html_part.get_content_type() == "text/html"
+    assert image.get_content_type() == "image/png"
+    assert image["Content-ID"] == "<sign-logo>"
+    assert image.get_content() == b"\x89PNG fake"
+    # and the same structure survives the wire format
+    assert parsed(bytes(message)).get_payload()[1].get_payload()[1]["Content-ID"] == "<sign-logo>"
+
+
+def test_pool_delivers_to_every_recipient_without_the_bcc_header(server):
+    message = report_message(to=["a@example.com", "b@example.com"], cc=["c@example.com"])
+    message["Bcc"] = "hidden@example.com"
+    with SMTPConnectionPool("127.0.0.1", server.port) as pool:
+        assert pool.send(message) == {}
+    [(sender, recipients, data)] = server.messages
+    assert sender == "report@example.com"
+    assert recipients == ["a@example.com", "b@example.com", "c@example.com", "hidden@example.com"]
+    assert parsed(data)["Bcc"] is None
+    assert message["Bcc"] == "hidden@example.com"  # the caller's message is left as it was
+    assert server.mail_parameters == ["BODY=8BITMIME"]  # the subject and body are not 7-bit
+
+
+def test_refused_recipients_are_reported(server, capsys):
+    messages = [report_message(to=["a@example.com", "nobody@example.com"]), report_message()]
+    with SMTPConnectionPool("127.0.0.1", server.port) as pool:
+        sent, failures, refusals = send_messages(pool, messages)
+    assert (sent, failures) == (2, {})
+    assert list(refusals) == [messages[0]["Message-ID"]]
+    assert refusals[messages[0]["Message-ID"]]["nobody@example.com"][0] == 550
+    assert sorted(recipients for _, recipients, _ in server.messages) == [["a@example.com"], ["a@example.com"]]
+    assert "nobody@example.com (550)" in capsys.readouterr().out
+
+
+def test_every_recipient_refused_fails_the_message(server):
+    message = report_message(to=["nobody@example.com"])
+    with SMTPConnectionPool("127.0.0.1", server.port) as pool:
+        sent, failures, refusals = send_messages(pool, [message])
+    assert sent == 0 and message["Message-ID"] in failures and not server.messages
+
+
+def test_connections_are_reused(server):
+    messages = [report_message() for _ in range(12)]
+    with SMTPConnectionPool("127.0.0.1", server.port, size=2) as pool:
+        sent, failures, refusals = send_messages(pool, messages)
+    assert sent == 12 and len(server.messages) == 12
+    assert 1 <= server.sessions <= 2
+
+
+def test_new_connections_are_set_up_side_by_side(server, monkeypatch):
+    connect = SMTPConnectionPool._connect
+
+    def slow_connect(pool):
+        time.sleep(0.3)  # TCP/TLS/AUTH against a slow server
+        return connect(pool)
+
+    monkeypatch.setattr(SMTPConnectionPool, "_connect", slow_connect)
+    pool = SMTPConnectionPool("127.0.0.1", server.port, size=3)
+    connections = []
+    threads = [threading.Thread(target=lambda: connections.append(pool.acquire())) for _ in range(3)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    elapsed = time.perf_counter() - start
+    for connection in connections:
+        pool.release(connection)
+    pool.close()
+    assert len(connections) == 3
+    assert elapsed < 0.75  # one after another would take 0.9s
+
+
+def test_refused_recipient_fails_the_run(tmp_path, server, monkeypatch):
+    monkeypatch.setattr(autoEmail, "LABEL_INDEX_CACHE_FILE", str(tmp_path / "label_index.json"))
+    monkeypatch.setattr(autoEmail, "_label_index_cache", None)
+    workbook = tmp_path / "report.xlsx"
+    generate_workbook(str(workbook), seed=2)
+    options = ["-m", "5", "-y", "2026", "-w", str(workbook), "--backend", "headless", "--no-cache",
+               "--no-history", "--signature", str(tmp_path / "missing.docx"), "-o", "smtp",
+               "--smtp-host", "127.0.0.1", "--smtp-port", str(server.port), "--sender", "report@example.com"]
+    assert autoEmail.main(options + ["--to", "a@example.com"]) == autoEmail.EXIT_OK
+    assert autoEmail.main(options + ["--to", "a@example.com,nobody@example.com"]) == autoEmail.EXIT_ERROR
+    assert len(server.messages) == 2  # the second one still reached a@example.com
+
+
+def test_dry_run_never_sends(tmp_path, server, capsys):
+    workbook = tmp_path / "report.xlsx"
+    generate_workbook(str(workbook), seed=2)
+    options = ["-m", "5", "-y", "2026", "-w", str(workbook), "--backend", "headless", "--no-cache", "--no-history",
+               "--dry-run", "--smtp-host", "127.0.0.1", "--smtp-port", str(server.port),
+               "--sender", "report@example.com", "--to", "a@example.com"]
+    assert autoEmail.main(options + ["-o", "smtp"]) == autoEmail.EXIT_USAGE
+    assert "cannot be combined with --output smtp" in capsys.readouterr().err
+    assert not server.messages
@@ -0,0 +1,118 @@
+"""Snapshot cache: hits touch only the source's stat, changes rebuild, old months are evicted"""
+import os
+import time
+
+import pytest
+
+import snapshot
+import xlsx_reader
+from snapshot import SnapshotCache
+from synthetic_workbook import generate_workbook
+
+SHEET = "數位平台收益"
+
+
+def source(tmp_path, name, seed):
+    path = tmp_path / name
+    generate_workbook(str(path), rows=40, seed=seed)
+    return str(path)
+
+
+def cell_values(workbook):
+    worksheet = workbook.worksheet(SHEET)
+    worksheet.ensure_rows(float("inf"))
+    return {(row, col): worksheet.cell_value(row, col) for row in worksheet.rows for col in worksheet.rows[row]}
+
+
+def source_values(path):
+    workbook = xlsx_reader.open_workbook(path)
+    try:
+        return cell_values(workbook)
+    finally:
+        workbook.Close()
+
+
+def open_and_read(cache, path):
+    workbook = cache.open(path, [SHEET])
+    try:
+        return cell_values(workbook)
+    finally:
+        workbook.Close()
+
+
+def entry(cache, path):
+    return cache._load_entry(cache._entry_path(os.path.abspath(path)))
+
+
+def fail(*args, **kwargs):
+    raise AssertionError("the source was read")
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SnapshotCache(str(tmp_path / "cache"))
+
+
+def test_hit_only_stats_the_source(tmp_path, cache, monkeypatch, capsys):
+    path = source(tmp_path, "report.xlsx", seed=1)
+    assert open_and_read(cache, path) == source_values(path)
+    assert "Snapshot built for report.xlsx" in capsys.readouterr().out
+
+    real_open = open
+
+    def guarded_open(file, *args, **kwargs):
+        if os.path.abspath(str(file)) == path:
+            fail()
+        return real_open(file, *args, **kwargs)
+
+    monkeypatch.setattr(SnapshotCache, "_copy_with_hash", fail)
+    monkeypatch.setattr(snapshot, "open_workbook", fail)
+    monkeypatch.setattr(snapshot, "open", guarded_open, raising=False)
+    assert open_and_read(cache, path) == source_values(path)
+    assert "Snapshot hit: report.xlsx" in capsys.readouterr().out
+
+
+def test_touched_source_is_retagged_and_changed_source_rebuilt(tmp_path, cache, monkeypatch, capsys):
+    path = source(tmp_path, "report.xlsx", seed=1)
+    open_and_read(cache, path)
+    built = entry(cache, path)
+
+    later = time.time() + 60
+    os.utime(path, (later, later))  # saved again without changes
+    with monkeypatch.context() as patch:
+        patch.setattr(snapshot, "write_snapshot", fail)
+        assert open_and_read(cache, path) == source_values(path)
+    assert "Snapshot re-tagged (content unchanged): report.xlsx" in capsys.readouterr().out
+    retagged = entry(cache, path)
+    assert retagged["file"] == built["file"] and retagged["sha256"] == built["sha256"]
+    assert retagged["mtime_ns"] == os.stat(path).st_mtime_ns
+
+    generate_workbook(path, rows=40, seed=2)  # a month filled in
+    assert open_and_read(cache, path) == source_values(path)
+    assert "Snapshot built for report.xlsx" in capsys.readouterr().out
+    rebuilt = entry(cache, path)
+    assert rebuilt["sha256"] != built["sha256"] and rebuilt["file"] != built["file"]
+    assert not os.path.exists(os.path.join(cache.cache_dir, built["file"]))  # the old snapshot is gone
+
+
+def test_least_recently_used_snapshots_are_evicted(tmp_path, cache, capsys):
+    january, february, march = (source(tmp_path, f"{month}.xlsx", seed) for seed, month in enumerate(
+        ("january", "february", "march"), 1))
+    open_and_read(cache, january)
+    open_and_read(cache, february)
+    sizes = [os.path.getsize(os.path.join(cache.cache_dir, entry(cache, path)["file"]))
+             for path in (january, february)]
+    # Room for two snapshots, not three
+    cache.limit = sum(sizes) + max(sizes) // 2
+    old = time.time() - 3600
+    for age, path in enumerate((january, february)):
+        os.utime(cache._entry_path(os.path.abspath(path)), (old + age, old + age))
+    open_and_read(cache, january)  # a hit makes January the most recently used
+    capsys.readouterr()
+
+    open_and_read(cache, march)
+    assert "Snapshot evicted: february.xlsx" in capsys.readouterr().out
+    assert entry(cache, february) is None
+    assert entry(cache, january) and entry(cache, march)
+    snapshots = [name for name in os.listdir(cache.cache_dir) if name.endswith(".snap")]
+    assert sorted(snapshots) == sorted(entry(cache, path)["file"] for path in (january, march))
@@ -0,0 +1,114 @@
+"""The headless reader must give the report what Excel gives it"""
+import zipfile
+
+import pytest
+
+import autoEmail
+import cumulative
+import office_session
+import xlsx_reader
+from synthetic_workbook import generate_workbook
+
+
+@pytest.fixture
+def workbook_path(tmp_path):
+    path = tmp_path / "report.xlsx"
+    generate_workbook(str(path), rows=40, seed=9)
+    return path
+
+
+def fresh_caches(monkeypatch, tmp_path, name):
+    """Label index and monthly series caches of their own, so each backend reads the workbook itself"""
+    monkeypatch.setattr(autoEmail, "LABEL_INDEX_CACHE_FILE", str(tmp_path / f"{name}_label_index.json"))
+    monkeypatch.setattr(autoEmail, "_label_index_cache", None)
+    monkeypatch.setattr(cumulative, "_series_cache", cumulative.OrderedDict())
+
+
+def all_months(worksheets, use_find=False):
+    return {month: autoEmail.get_dynamic_values(*worksheets, month, use_find) for month in range(1, 13)}
+
+
+def test_headless_values_match_the_com_label_lookup(workbook_path, tmp_path, monkeypatch):
+    fresh_caches(monkeypatch, tmp_path, "headless")
+    workbook = xlsx_reader.open_workbook(str(workbook_path))
+    try:
+        headless = all_months(autoEmail.find_report_worksheets(workbook))
+    finally:
+        workbook.Close()
+
+    excel = office_session.FakeOfficeBackend().dispatch("Excel.Application")
+    com_workbook = excel.Workbooks.Open(str(workbook_path))
+    try:
+        assert not hasattr(com_workbook.Worksheets[1], "scan_labels")  # COM worksheets go through find_row
+        for name, use_find in (("index", False), ("find", True)):
+            fresh_caches(monkeypatch, tmp_path, name)
+            assert all_months(autoEmail.find_report_worksheets(com_workbook), use_find) == headless
+    finally:
+        com_workbook.Close()
+
+    assert headless[5]["platform_cumulative_rate_text"].endswith("%")
+    assert {key for values in headless.values() for key in values} >= {
+        "digital_month_target", "digital_actual", "digital_achievement_rate_text", "platform_month_target",
+        "platform_actual", "platform_achievement_rate_text", "platform_cumulative_target",
+        "platform_cumulative_actual", "platform_cumulative_rate_text"}
+
+
+def rewrite_shared_strings(source, target, replacements):
+    """Copy a workbook with some <si> elements of its shared strings table replaced"""
+    with zipfile.ZipFile(source) as original, zipfile.ZipFile(target, "w", zipfile.ZIP_DEFLATED) as copy:
+        for item in original.infolist():
+            data = original.read(item)
+            if item.filename == "xl/sharedStrings.xml":
+                for old, new in replacements.items():
+                    assert old.encode("utf-8") in data
+                    data = data.replace(old.encode("utf-8"), new.encode("utf-8"))
+            copy.writestr(item, data)
+
+
+def test_rich_text_and_escaped_labels_are_found(workbook_path, tmp_path, monkeypatch):
+    styled = tmp_path / "styled.xlsx"
+    rewrite_shared_strings(workbook_path, styled, {
+        # a label typed with part of it in bold is stored as runs
+        "<si><t>累積月目標達成率</t></si>":
+            '<si><r><rPr><b/></rPr><t>累積</t></r><r><t xml:space="preserve">月目標達成率 </t></r>'
+            '<rPh sb="0" eb="2"><t>ㄌㄟˇ</t></rPh></si>',
+        # and other writers escape characters Excel leaves alone
+        "<si><t>數位戶實績(存戶+卡戶)</t></si>": "<si><t>&#25976;位戶實績&#40;存戶+卡戶)</t></si>",
+    })
+    expected = {}
+    for name, path in (("plain", workbook_path), ("styled", styled)):
+        fresh_caches(monkeypatch, tmp_path, name)
+        workbook = xlsx_reader.open_workbook(str(path))
+        try:
+            if name == "styled":
+                ids = workbook.shared_string_ids({"累積月目標達成率", "數位戶實績(存戶+卡戶)", "月目標達成率"})
+                assert sorted(ids.values()) == ["數位戶實績(存戶+卡戶)", "月目標達成率", "累積月目標達成率"]
+                assert workbook._shared_strings is None  # found without reading the whole table
+            expected[name] = all_months(autoEmail.find_report_worksheets(workbook))
+        finally:
+            workbook.Close()
+    assert expected["styled"] == expected["plain"]
+
+
+def test_streamed_rows_are_not_kept_in_the_tree(tmp_path, monkeypatch):
+    path = tmp_path / "long.xlsx"
+    generate_workbook(str(path), rows=500, seed=3)
+    roots = []
+    iterparse = xlsx_reader.ET.iterparse
+
+    def recording_iterparse(*args, **kwargs):
+        for position, (event, elem) in enumerate(iterparse(*args, **kwargs)):
+            if position == 0:
+                roots.append(elem)
+            yield event, elem
+
+    monkeypatch.setattr(xlsx_reader.ET, "iterparse", recording_iterparse)
+    workbook = xlsx_reader.open_workbook(str(path))
+    try:
+        worksheet = workbook.worksheet("數位平台收益")
+        worksheet.ensure_rows(float("inf"))
+        assert len(worksheet.rows) > 500
+        [root] = [root for root in roots if root.tag == xlsx_reader.NS_MAIN + "worksheet"]
+        assert sum(1 for _ in root.iter(xlsx_reader.NS_MAIN + "row")) == 0
+    finally:
+        workbook.Close()
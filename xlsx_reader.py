@@ -0,0 +1,735 @@
+"""Headless streaming reader for .xlsx workbooks (no Excel required)
+
+Only the parts needed for the report are parsed: the workbook index, the
+shared strings, the styles and the worksheets that are actually touched.
+Worksheets are streamed row by row and parsing stops as soon as the rows
+asked for have been read.
+
+The objects mimic the small part of the Excel COM object model used by
+autoEmail.py (Worksheets, Name, Range, Value, Text, Find, Row) so the
+extraction helpers can run on either backend unchanged. Lazy loading is
+guarded by locks, so different threads may read the same workbook.
+
+scan_labels() finds label rows without parsing the sheet at all: the raw
+XML is searched in fixed-size chunks for the integer ids of the labels'
+shared strings, and the scan stops once every label has been found.
+"""
+import os
+import re
+import html
+import colorsys
+import zipfile
+import posixpath
+import threading
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+
+from numfmt import BUILTIN_NUMBER_FORMATS, format_value
+from profiling import add_bytes, span
+
+NS_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+NS_REL = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+NS_PKG_REL = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+CELL_REF_RE = re.compile(r"^\$?([A-Za-z]{1,3})\$?(\d+)$")
+MERGE_CELL_RE = re.compile(rb'<(?:\w+:)?mergeCell\s+ref="([^"]+)"')
+COL_RE = re.compile(rb'<(?:\w+:)?col\s([^>]*)>')
+ATTR_RE = re.compile(rb'(\w+)="([^"]*)"')
+DEFAULT_COLUMN_WIDTH = 8.43
+SCAN_CHUNK_SIZE = 1024 * 1024  # bytes of XML searched at a time by the label scan
+SCAN_CELL_RE = re.compile(rb'<c\s([^>]*?)(?:/>|>(.*?)</c>)', re.S)
+SCAN_VALUE_RE = re.compile(rb'<v>([^<]*)</v>')
+SCAN_TEXT_RE = re.compile(rb'<t(?:\s[^>]*)?>([^<]*)</t>')
+PHONETIC_RE = re.compile(rb'<rPh\b.*?</rPh>', re.S)
+SHARED_STRING_RE = re.compile(rb'<si(?:/>|>(.*?)</si>)', re.S)
+
+def column_to_index(letters):
+    """Convert Excel column letters to a 1-based column index"""
+    result = 0
+    for char in letters.upper():
+        result = result * 26 + (ord(char) - ord('A') + 1)
+    return result
+
+
+def index_to_column(index):
+    """Convert a 1-based column index to Excel column letters"""
+    result = ""
+    while index > 0:
+        index -= 1
+        result = chr(index % 26 + ord('A')) + result
+        index //= 26
+    return result
+
+
+def split_cell_address(address):
+    """Split an address like 'R55' into (row, column index)"""
+    match = CELL_REF_RE.match(address.strip())
+    if not match:
+        raise ValueError(f"Invalid cell address: {address}")
+    return int(match.group(2)), column_to_index(match.group(1))
+
+
+def parse_range_address(address):
+    """Parse 'A1:Z100' (or a single cell) into (first_row, first_col, last_row, last_col)"""
+    parts = address.split(':')
+    first_row, first_col = split_cell_address(parts[0])
+    if len(parts) == 1:
+        return first_row, first_col, first_row, first_col
+    last_row, last_col = split_cell_address(parts[1])
+    return (min(first_row, last_row), min(first_col, last_col),
+            max(first_row, last_row), max(first_col, last_col))
+
+
+def _complete_chunks(stream, terminator, size=SCAN_CHUNK_SIZE):
+    """Read a stream in chunks of about `size` bytes, each cut after its last `terminator`"""
+    tail = b""
+    while True:
+        data = stream.read(size)
+        if not data:
+            if tail:
+                yield tail
+            return
+        data = tail + data
+        cut = data.rfind(terminator)
+        if cut == -1:
+            tail = data
+            continue
+        cut += len(terminator)
+        yield data[:cut]
+        tail = data[cut:]
+
+
+def _xml_text(fragment):
+    """Text of the <t> elements in an <si> or <is> fragment (phonetic runs skipped)"""
+    return html.unescape(b"".join(SCAN_TEXT_RE.findall(PHONETIC_RE.sub(b"", fragment))).decode("utf-8"))
+
+
+def _cell_attributes(chunk, position):
+    """Attributes of the <c> element enclosing `position` in raw sheet XML, or None"""
+    start = chunk.rfind(b"<c ", 0, position)
+    if start == -1 or chunk.find(b"</c>", start, position) != -1:
+        return None
+    return dict(ATTR_RE.findall(chunk[start + 3:chunk.find(b">", start)]))
+
+
+class XlsxRange:
+    """A rectangular block of cells on an XlsxWorksheet"""
+
+    def __init__(self, worksheet, first_row, first_col, last_row, last_col):
+        self.Worksheet = worksheet
+        self.Row = first_row
+        self.Column = first_col
+        self.last_row = last_row
+        self.last_col = last_col
+
+    @property
+    def Address(self):
+        first = f"{index_to_column(self.Column)}{self.Row}"
+        if (self.Row, self.Column) == (self.last_row, self.last_col):
+            return first
+        return f"{first}:{index_to_column(self.last_col)}{self.last_row}"
+
+    @property
+    def Value(self):
+        """Single value for one cell, tuple of row tuples otherwise (as COM does)"""
+        return self._collect(self.Worksheet.cell_value)
+
+    @property
+    def Text(self):
+        """Display text; a tuple of row tuples for multi-cell ranges"""
+        return self._collect(self.Worksheet.cell_text)
+
+    @property
+    def NumberFormat(self):
+        """Number format code shared by the cells, None when they differ (as COM does)"""
+        self.Worksheet.ensure_rows(self.last_row)
+        formats = {self.Worksheet.cell_number_format(row, col)
+                   for row in range(self.Row, self.last_row + 1)
+                   for col in range(self.Column, self.last_col + 1)}
+        return formats.pop() if len(formats) == 1 else None
+
+    def _collect(self, getter):
+        if (self.Row, self.Column) == (self.last_row, self.last_col):
+            return getter(self.Row, self.Column)
+        self.Worksheet.ensure_rows(self.last_row)
+        return tuple(
+            tuple(getter(row, col) for col in range(self.Column, self.last_col + 1))
+            for row in range(self.Row, self.last_row + 1)
+        )
+
+    def Find(self, what):
+        """Find the first cell containing `what` (xlPart, by rows, after the top-left cell)"""
+        needle = str(what).lower()
+        self.Worksheet.ensure_rows(self.last_row)
+        cells = [(row, col)
+                 for row in range(self.Row, self.last_row + 1)
+                 for col in range(self.Column, self.last_col + 1)]
+        # Excel starts searching after the first cell and wraps around to it last
+        for row, col in cells[1:] + cells[:1]:
+            text = self.Worksheet.cell_text(row, col)
+            if text and needle in text.lower():
+                return XlsxRange(self.Worksheet, row, col, row, col)
+        return None
+
+
+class XlsxWorksheet:
+    """A worksheet whose rows are streamed from the zip on demand"""
+
+    # Range.Text returns a grid for multi-cell ranges (COM only returns one string)
+    supports_block_text = True
+
+    def __init__(self, workbook, name, part_name):
+        self.Parent = workbook
+        self.Name = name
+        self.part_name = part_name
+        self.rows = {}
+        self.loaded_through = 0
+        self.fully_loaded = False
+        self._row_stream = None
+        self._layout = None
+        self.formulas = {}           # (row, col) -> formula text, or ("shared", si) for shared followers
+        self.shared_formulas = {}    # si -> (row, col, formula text) of the shared formula's master
+        self._lock = threading.RLock()
+
+    def Range(self, address):
+        return XlsxRange(self, *parse_range_address(address))
+
+    def ensure_rows(self, last_row):
+        """Stream the sheet until `last_row` has been read (or the sheet ends)"""
+        if self.fully_loaded or self.loaded_through >= last_row:
+            return
+        with self._lock:
+            if self.fully_loaded or self.loaded_through >= last_row:
+                return
+            if self._row_stream is None:
+                self._row_stream = self._iter_rows()
+            for row_number, cells in self._row_stream:
+                self.rows[row_number] = cells
+                self.loaded_through = row_number
+                if row_number >= last_row:
+                    return
+            self.fully_loaded = True
+            self._row_stream = None
+
+    def layout(self):
+        """Return (merged ranges, {col: width}) scanned from the raw sheet part
+
+        <cols> and <mergeCells> sit outside <sheetData>, so a byte scan finds
+        them without parsing any rows.
+        """
+        if self._layout is None:
+            data = self.Parent.archive.read(self.part_name)
+            merges = [parse_range_address(ref.decode()) for ref in MERGE_CELL_RE.findall(data)]
+            widths = {}
+            for attrs in COL_RE.findall(data):
+                attrs = dict(ATTR_RE.findall(attrs))
+                if b"width" not in attrs:
+                    continue
+                for col in range(int(attrs[b"min"]), int(attrs[b"max"]) + 1):
+                    widths[col] = float(attrs[b"width"])
+            self._layout = (merges, widths)
+        return self._layout
+
+    def column_width(self, col):
+        return self.layout()[1].get(col, DEFAULT_COLUMN_WIDTH)
+
+    def cell_format(self, row, col):
+        """CSS declarations for a cell's font, fill, borders and alignment"""
+        return self.Parent.cell_format(self.cell(row, col)[1])
+
+    def cell_number_format(self, row, col):
+        """Number format code of a cell (formulas are not evaluated for it)"""
+        self.ensure_rows(row)
+        return self.Parent.number_format(self.rows.get(row, {}).get(col, (None, 0))[1])
+
+    def cell(self, row, col):
+        """Return (value, style index) of a cell, (None, 0) when empty
+
+        Formula cells saved without a cached value (or every formula cell when
+        the workbook was opened with recalculate=True) are evaluated locally.
+        """
+        self.ensure_rows(row)
+        value, style = self.rows.get(row, {}).get(col, (None, 0))
+        return self._evaluate(row, col, value), style
+
+    def _evaluate(self, row, col, value):
+        if (row, col) in self.formulas and (value is None or self.Parent.recalculate):
+            value = self.Parent.formula_engine().value(self.Name, row, col)
+            if hasattr(value, "code"):
+                value = value.code  # error values read back like cached ones (t="e")
+        return value
+
+    def raw_cell_value(self, row, col):
+        """The value stored in the file, without evaluating formulas"""
+        self.ensure_rows(row)
+        return self.rows.get(row, {}).get(col, (None, 0))[0]
+
+    def cell_value(self, row, col):
+        return self.cell(row, col)[0]
+
+    def cell_text(self, row, col):
+        value, style = self.cell(row, col)
+        return format_value(value, self.Parent.number_format(style))
+
+    def scan_labels(self, labels, value_cols, label_cols=None):
+        """Find the first row holding each label and read the value_cols cells of that row
+
+        Rows are searched top to bottom (left to right within a row) for a cell
+        whose text, stripped, equals a label; label_cols = (first, last) limits
+        the columns searched. The sheet XML is streamed in fixed-size chunks
+        without building rows: shared-string labels are matched by their
+        integer ids, and reading stops once every label has been found.
+        Returns {label: (row, {col: (value, display text)})} for the labels found.
+        """
+        labels = {label for label in labels if label}
+        first_col, last_col = label_cols or (1, float("inf"))
+        if self.fully_loaded or not labels:
+            return self._scan_rows(labels, value_cols, first_col, last_col)
+
+        searches = [(b"<v>%d</v>" % index, label, (b"s",))
+                    for index, label in self.Parent.shared_string_ids(labels).items()]
+        # Inline and formula strings hold the text itself
+        searches += [(b">" + escape(label).encode("utf-8") + b"<", label, (b"inlineStr", b"str"))
+                     for label in labels]
+        found = {}
+        with span("label_scan"), self.Parent.archive.open(self.part_name) as stream:
+            for chunk in _complete_chunks(stream, b"</row>"):
+                first_hits = {}  # label -> (position, row) of its first cell in this chunk
+                for needle, label, cell_types in searches:
+                    if label in found:
+                        continue
+                    position = chunk.find(needle)
+                    while position != -1 and position < first_hits.get(label, (len(chunk),))[0]:
+                        attrs = _cell_attributes(chunk, position)
+                        if attrs is not None and attrs.get(b"t", b"n") in cell_types:
+                            if b"r" not in attrs:  # cells without references: parse the rows instead
+                                return self._scan_rows(labels, value_cols, first_col, last_col)
+                            row, col = split_cell_address(attrs[b"r"].decode())
+                            if first_col <= col <= last_col:
+                                first_hits[label] = (position, row)
+                                break
+                        position = chunk.find(needle, position + 1)
+                # Chunks hold whole rows in order, so a label's first hit here is its first in the sheet
+                for label, (position, row) in first_hits.items():
+                    row_xml = chunk[chunk.rfind(b"<row", 0, position):chunk.find(b"</row>", position)]
+                    found[label] = (row, self._scan_row_values(row, row_xml, value_cols))
+                if len(found) == len(labels):
+                    break
+        return found
+
+    def _scan_rows(self, labels, value_cols, first_col, last_col):
+        """scan_labels over parsed rows (sheets already loaded, or XML the byte scan cannot read)"""
+        self.ensure_rows(float("inf"))
+        found = {}
+        for row in sorted(self.rows):
+            for col, (value, _) in sorted(self.rows[row].items()):
+                if first_col <= col <= last_col and isinstance(value, str):
+                    label = value.strip()
+                    if label in labels and label not in found:
+                        found[label] = (row, {value_col: self._scan_value(row, value_col)
+                                              for value_col in value_cols})
+            if len(found) == len(labels):
+                break
+        return found
+
+    def _scan_row_values(self, row, row_xml, value_cols):
+        values = {}
+        for match in SCAN_CELL_RE.finditer(row_xml):
+            attrs = dict(ATTR_RE.findall(match.group(1)))
+            col = split_cell_address(attrs[b"r"].decode())[1]
+            if col not in value_cols:
+                continue
+            body = match.group(2) or b""
+            cell_type = attrs.get(b"t", b"n").decode()
+            if cell_type == "inlineStr":
+                value = _xml_text(body)
+            else:
+                raw = SCAN_VALUE_RE.search(body)
+                raw = html.unescape(raw.group(1).decode("utf-8")) if raw else None
+                value = self._decode_value(cell_type, raw, self.Parent.shared_strings if cell_type == "s" else None)
+            style = int(attrs.get(b"s", 0))
+            if b"<f" in body and (value is None or self.Parent.recalculate):
+                value, style = self.cell(row, col)  # evaluated like any other formula cell
+            values[col] = (value, format_value(value, self.Parent.number_format(style)))
+        for col in value_cols:
+            if col not in values:  # no <c> element: an empty cell
+                values[col] = (None, format_value(None, self.Parent.number_format(0)))
+        return values
+
+    def _scan_value(self, row, col):
+        value, style = self.cell(row, col)
+        return value, format_value(value, self.Parent.number_format(style))
+
+    def _iter_rows(self):
+        """Yield (row number, {col: (value, style)}) pairs from the sheet part"""
+        shared_strings = self.Parent.shared_strings
+        row_number = 0
+        with self.Parent.archive.open(self.part_name) as stream:
+            cells = {}
+            col = 0
+            sheet_data = None
+            for event, elem in ET.iterparse(stream, events=("start", "end")):
+                tag = elem.tag
+                if event == "start":
+                    if tag == NS_MAIN + "row":
+                        row_number = int(elem.get("r", row_number + 1))
+                        cells = {}
+                        col = 0
+                    elif tag == NS_MAIN + "sheetData":
+                        sheet_data = elem
+                    continue
+                if tag == NS_MAIN + "c":
+                    ref = elem.get("r")
+                    col = split_cell_address(ref)[1] if ref else col + 1
+                    value = self._decode_cell(elem, shared_strings)
+                    style = int(elem.get("s", 0))
+                    formula = elem.find(NS_MAIN + "f")
+                    if formula is not None:
+                        self._record_formula(row_number, col, formula)
+                    if value is not None or style:
+                        cells[col] = (value, style)
+                    elem.clear()
+                elif tag == NS_MAIN + "row":
+                    yield row_number, cells
+                    elem.clear()
+                    if sheet_data is not None:
+                        sheet_data.clear()  # detach the finished rows too, or the tree grows a node per row
+
+    def _record_formula(self, row, col, formula):
+        text = formula.text
+        if formula.get("t") == "shared":
+            index = formula.get("si")
+            if text:
+                self.shared_formulas[index] = (row, col, text)
+            else:
+                text = ("shared", index)
+        if text:
+            self.formulas[(row, col)] = text
+
+    @classmethod
+    def _decode_cell(cls, elem, shared_strings):
+        cell_type = elem.get("t", "n")
+        if cell_type == "inlineStr":
+            return "".join(t.text or "" for t in elem.iter(NS_MAIN + "t"))
+        return cls._decode_value(cell_type, elem.findtext(NS_MAIN + "v"), shared_strings)
+
+    @staticmethod
+    def _decode_value(cell_type, raw, shared_strings):
+        if raw is None:
+            return None
+        if cell_type == "s":
+            return shared_strings[int(raw)]
+        if cell_type == "b":
+            return raw == "1"
+        if cell_type in ("str", "e"):
+            return raw
+        return float(raw)
+
+
+class _CountingFile:
+    """Workbook file wrapper counting the bytes actually read (for the run profile)"""
+
+    def __init__(self, file):
+        self._file = file
+
+    def read(self, size=-1):
+        data = self._file.read(size)
+        add_bytes("workbook", len(data))
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class XlsxWorkbook:
+    """An .xlsx file opened for reading without Excel"""
+
+    def __init__(self, path, recalculate=False):
+        self.FullName = os.path.abspath(path)
+        self.Name = os.path.basename(path)
+        file = open(path, "rb")
+        stat = os.fstat(file.fileno())
+        self.source_version = (stat.st_size, stat.st_mtime_ns)  # of the file actually read
+        self._file = _CountingFile(file)
+        self.archive = zipfile.ZipFile(self._file)
+        self.recalculate = recalculate
+        self._formula_engine = None
+        self._lock = threading.RLock()
+        self._shared_strings = None
+        self._number_formats = None
+        self._cell_formats = None
+        self._sheets = self._read_sheet_index()
+
+    @property
+    def Worksheets(self):
+        return list(self._sheets.values())
+
+    def worksheet(self, name):
+        return self._sheets.get(name)
+
+    def Close(self, save_changes=False):
+        self.archive.close()
+        self._file.close()
+
+    def formula_engine(self, build=True):
+        """FormulaEngine of the workbook, created the first time a formula is evaluated
+
+        With build=False the engine is returned only if one exists already.
+        """
+        with self._lock:
+            if self._formula_engine is None and build:
+                from formula import FormulaEngine  # formula.py imports this module
+                self._formula_engine = FormulaEngine(self)
+        return self._formula_engine
+
+    def reuse_formula_engine(self, engine):
+        """Take over the engine of an earlier save of this workbook; returns the results it had to drop"""
+        with self._lock:
+            with span("formula_rebind"):
+                dropped = engine.rebind(self)
+            self._formula_engine = engine
+        return dropped
+
+    def _read_sheet_index(self):
+        """Map sheet names to their parts using workbook.xml and its relationships"""
+        rels = {}
+        with self.archive.open("xl/_rels/workbook.xml.rels") as stream:
+            for rel in ET.parse(stream).getroot().iter(NS_PKG_REL + "Relationship"):
+                target = rel.get("Target")
+                if target.startswith('/'):
+                    target = target.lstrip('/')
+                else:
+                    target = posixpath.normpath(posixpath.join("xl", target))
+                rels[rel.get("Id")] = target
+        sheets = {}
+        with self.archive.open("xl/workbook.xml") as stream:
+            for sheet in ET.parse(stream).getroot().iter(NS_MAIN + "sheet"):
+                name = sheet.get("name")
+                sheets[name] = XlsxWorksheet(self, name, rels[sheet.get(NS_REL + "id")])
+        return sheets
+
+    @property
+    def shared_strings(self):
+        with self._lock:
+            if self._shared_strings is None:
+                self._shared_strings = self._read_shared_strings()
+        return self._shared_strings
+
+    def _read_shared_strings(self):
+        """Stream the shared strings table (phonetic runs are skipped like Excel does)"""
+        strings = []
+        if "xl/sharedStrings.xml" not in self.archive.namelist():
+            return strings
+        with self.archive.open("xl/sharedStrings.xml") as stream:
+            parts = []
+            in_phonetic = False
+            for event, elem in ET.iterparse(stream, events=("start", "end")):
+                tag = elem.tag
+                if tag == NS_MAIN + "rPh":
+                    in_phonetic = event == "start"
+                elif event == "end" and tag == NS_MAIN + "t" and not in_phonetic:
+                    parts.append(elem.text or "")
+                elif event == "end" and tag == NS_MAIN + "si":
+                    strings.append("".join(parts))
+                    parts = []
+                    elem.clear()
+        return strings
+
+    def shared_string_ids(self, texts):
+        """Map the indices of the shared strings equal (stripped) to one of texts to that text
+
+        The table is read in fixed-size chunks of whole <si> elements, each
+        one's text joined from its <t> runs (rich text and entities included,
+        phonetic runs skipped), so the table itself is never kept in memory.
+        """
+        texts = {text for text in texts if text}
+        with self._lock:
+            if self._shared_strings is not None:
+                return {index: text.strip() for index, text in enumerate(self._shared_strings)
+                        if text.strip() in texts}
+        ids = {}
+        if "xl/sharedStrings.xml" not in self.archive.namelist():
+            return ids
+        index = 0
+        with span("shared_string_ids"), self.archive.open("xl/sharedStrings.xml") as stream:
+            for chunk in _complete_chunks(stream, b"</si>"):
+                if index == 0 and b"<si" not in chunk and b":si>" in chunk:
+                    # Prefixed tags (<x:si>): count on the parsed table instead
+                    return {index: text.strip() for index, text in enumerate(self.shared_strings)
+                            if text.strip() in texts}
+                for fragment in SHARED_STRING_RE.findall(chunk):
+                    text = _xml_text(fragment).strip()
+                    if text in texts:
+                        ids[index] = text
+                    index += 1
+        return ids
+
+    def number_format(self, style_index):
+        """Return the number format code used by a cell style index"""
+        self._load_styles()
+        if style_index < len(self._number_formats):
+            return self._number_formats[style_index]
+        return "General"
+
+    def cell_format(self, style_index):
+        """Return the CSS declarations (dict) for a cell style index"""
+        self._load_styles()
+        if style_index < len(self._cell_formats):
+            return self._cell_formats[style_index]
+        return {}
+
+    def _load_styles(self):
+        if self._number_formats is not None:
+            return
+        with self._lock:
+            if self._number_formats is None:
+                number_formats, self._cell_formats = self._read_styles()
+                self._number_formats = number_formats  # set last: it marks the styles as loaded
+
+    def _read_styles(self):
+        number_formats = []
+        cell_formats = []
+        if "xl/styles.xml" not in self.archive.namelist():
+            return number_formats, cell_formats
+        with self.archive.open("xl/styles.xml") as stream:
+            root = ET.parse(stream).getroot()
+        custom = {int(fmt.get("numFmtId")): fmt.get("formatCode")
+                  for fmt in root.iter(NS_MAIN + "numFmt")}
+        fonts = [_font_css(font) for font in _children(root, "fonts", "font")]
+        fills = [_fill_css(fill) for fill in _children(root, "fills", "fill")]
+        borders = [_border_css(border) for border in _children(root, "borders", "border")]
+        for xf in _children(root, "cellXfs", "xf"):
+            fmt_id = int(xf.get("numFmtId", 0))
+            number_formats.append(custom.get(fmt_id, BUILTIN_NUMBER_FORMATS.get(fmt_id, "General")))
+            css = {}
+            for table, key in ((fonts, "fontId"), (fills, "fillId"), (borders, "borderId")):
+                position = int(xf.get(key, 0))
+                if position < len(table):
+                    css.update(table[position])
+            alignment = xf.find(NS_MAIN + "alignment")
+            if alignment is not None:
+                if alignment.get("horizontal") in ("left", "center", "right", "justify"):
+                    css["text-align"] = alignment.get("horizontal")
+                if alignment.get("vertical") in ("top", "center"):
+                    css["vertical-align"] = "middle" if alignment.get("vertical") == "center" else "top"
+                if alignment.get("wrapText") == "1":
+                    css["white-space"] = "normal"
+            cell_formats.append(css)
+        return number_formats, cell_formats
+
+
+# Legacy indexed color palette (indexes 0-63), 64/65 are the system colors
+INDEXED_COLORS = (
+    "000000 FFFFFF FF0000 00FF00 0000FF FFFF00 FF00FF 00FFFF "
+    "000000 FFFFFF FF0000 00FF00 0000FF FFFF00 FF00FF 00FFFF "
+    "800000 008000 000080 808000 800080 008080 C0C0C0 808080 "
+    "9999FF 993366 FFFFCC CCFFFF 660066 FF8080 0066CC CCCCFF "
+    "000080 FF00FF FFFF00 00FFFF 800080 800000 008080 0000FF "
+    "00CCFF CCFFFF CCFFCC FFFF99 99CCFF FF99CC CC99FF FFCC99 "
+    "3366FF 33CCCC 99CC00 FFCC00 FF9900 FF6600 666699 969696 "
+    "003366 339966 003300 333300 993300 993366 333399 333333 "
+    "000000 FFFFFF"
+).split()
+
+# Default Office theme colors in SpreadsheetML theme index order
+THEME_COLORS = ["FFFFFF", "000000", "E7E6E6", "44546A", "4472C4", "ED7D31",
+                "A5A5A5", "FFC000", "5B9BD5", "70AD47", "0563C1", "954F72"]
+
+BORDER_CSS = {
+    "hair": "1px solid", "thin": "1px solid", "medium": "2px solid", "thick": "3px solid",
+    "dashed": "1px dashed", "dotted": "1px dotted", "double": "3px double",
+    "mediumDashed": "2px dashed", "dashDot": "1px dashed", "mediumDashDot": "2px dashed",
+    "dashDotDot": "1px dotted", "mediumDashDotDot": "2px dotted", "slantDashDot": "2px dashed",
+}
+
+
+def _children(root, parent_tag, child_tag):
+    parent = root.find(NS_MAIN + parent_tag)
+    return [] if parent is None else parent.findall(NS_MAIN + child_tag)
+
+
+def _color_hex(elem):
+    """Resolve an rgb/indexed/theme color element to '#RRGGBB' (None when automatic)"""
+    if elem is None or elem.get("auto") == "1":
+        return None
+    if elem.get("rgb"):
+        rgb = elem.get("rgb")[-6:]
+    elif elem.get("indexed") is not None:
+        index = int(elem.get("indexed"))
+        if index >= len(INDEXED_COLORS):
+            return None
+        rgb = INDEXED_COLORS[index]
+    elif elem.get("theme") is not None:
+        index = int(elem.get("theme"))
+        if index >= len(THEME_COLORS):
+            return None
+        rgb = THEME_COLORS[index]
+    else:
+        return None
+    tint = float(elem.get("tint", 0))
+    if tint:
+        rgb = _apply_tint(rgb, tint)
+    return "#" + rgb.upper()
+
+
+def _apply_tint(rgb, tint):
+    """Lighten/darken a color the way Excel applies a theme tint"""
+    red, green, blue = (int(rgb[i:i + 2], 16) / 255 for i in (0, 2, 4))
+    hue, lightness, saturation = colorsys.rgb_to_hls(red, green, blue)
+    if tint < 0:
+        lightness = lightness * (1 + tint)
+    else:
+        lightness = lightness * (1 - tint) + tint
+    red, green, blue = colorsys.hls_to_rgb(hue, lightness, saturation)
+    return "".join(f"{round(channel * 255):02X}" for channel in (red, green, blue))
+
+
+def _font_css(font):
+    css = {}
+    bold = font.find(NS_MAIN + "b")
+    if bold is not None and bold.get("val", "1") not in ("0", "false"):
+        css["font-weight"] = "bold"
+    italic = font.find(NS_MAIN + "i")
+    if italic is not None and italic.get("val", "1") not in ("0", "false"):
+        css["font-style"] = "italic"
+    underline = font.find(NS_MAIN + "u")
+    if underline is not None and underline.get("val", "single") != "none":
+        css["text-decoration"] = "underline"
+    color = _color_hex(font.find(NS_MAIN + "color"))
+    if color and color != "#000000":
+        css["color"] = color
+    size = font.find(NS_MAIN + "sz")
+    if size is not None:
+        css["font-size"] = f"{float(size.get('val')):g}pt"
+    name = font.find(NS_MAIN + "name")
+    if name is not None:
+        css["font-family"] = name.get("val")
+    return css
+
+
+def _fill_css(fill):
+    pattern = fill.find(NS_MAIN + "patternFill")
+    if pattern is None or pattern.get("patternType") in (None, "none", "gray125"):
+        return {}
+    color = _color_hex(pattern.find(NS_MAIN + "fgColor"))
+    return {"background": color} if color else {}
+
+
+def _border_css(border):
+    css = {}
+    for side in ("top", "right", "bottom", "left"):
+        edge = border.find(NS_MAIN + side)
+        if edge is None or edge.get("style") in (None, "none"):
+            continue
+        color = _color_hex(edge.find(NS_MAIN + "color")) or "#000000"
+        css[f"border-{side}"] = f"{BORDER_CSS.get(edge.get('style'), '1px solid')} {color}"
+    return css
+
+
+def open_workbook(path, recalculate=False):
+    """Open an .xlsx workbook for headless reading
+
+    With recalculate=True formula cells are always evaluated locally instead
+    of using the values cached in the file.
+    """
+    return XlsxWorkbook(path, recalculate)